@@ -38,6 +38,9 @@ class NonactivatedFilter(admin.SimpleListFilter):
         elif val == 'threedays':
             d = datetime.date.today() - datetime.timedelta(days=3)
             return queryset.filter(is_active=False, is_activated=False, date_joined__date__lt=d)
+        elif val == 'week':
+            d = datetime.date.today() - datetime.timedelta(weeks=1)
+            return queryset.filter(is_active=False, is_activated=False, date_joined__date__lt=d)
 
 
 class AdvUserAdmin(admin.ModelAdmin):
@@ -47,7 +50,7 @@ class AdvUserAdmin(admin.ModelAdmin):
     fields = (
         ('username', 'email'),
         ('first_name', 'last_name'),
-        ('send_messages', 'is_active', 'is_activated'),
+        ('send_messages', 'comment_digest', 'is_active', 'is_activated'),
         ('is_staff', 'is_superuser'),
         'groups',
         'user_permisions',
@@ -85,7 +88,7 @@ class AdditionalImageInline(admin.TabularInline):
 
 
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ('rubric', 'title', 'content', 'characters', 'source', 'author', 'created_at')
+    list_display = ('rubric', 'title', 'content', 'characters', 'source', 'author', 'created_at', 'views')
     fields = (
         ('rubric', 'author'),
         'title', 'content', 'characters', 'source', 'image', 'is_active'
@@ -93,6 +96,12 @@ class ArticleAdmin(admin.ModelAdmin):
     inlines = (AdditionalImageInline,)
     # actions = (send_new_comment_notification,)
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save_keeping_views()
+        else:
+            obj.save()
+
 
 admin.site.register(Article, ArticleAdmin)
 
@@ -0,0 +1,123 @@
+"""Сброс второстепенной нагрузки при перегрузке.
+
+Прокси ставит заголовок X-Request-Start (config/nginx.conf), по нему видно,
+сколько запрос ждал свободного воркера. Воркер считается перегруженным, если
+ожидание или недавнее время ответа выше бюджета ADMISSION_*. Число
+одновременных запросов (ADMISSION_MAX_IN_FLIGHT) имеет смысл только для
+воркеров с потоками (gthread, threads > 1): синхронный воркер gunicorn
+обслуживает один запрос за раз, и его перегрузка видна по ожиданию.
+
+Перегруженный воркер сразу отвечает 503 с Retry-After на второстепенные
+запросы (капча, поиск, списки в админке, некэшированные списки статей), а
+статьи продолжают отдаваться. Запрос, ждавший дольше ADMISSION_DEADLINE, уже никто
+не ждет: он отклоняется при любом приоритете. Страницы для публикации
+(publish.fetch, request.publishing) не отклоняются и в нагрузке не учитываются.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import metrics
+
+HEADER = 'HTTP_X_REQUEST_START'
+# недавнее время ответа забывается вдвое за столько секунд,
+# иначе воркер, отклоняющий все подряд, не вышел бы из перегрузки
+LATENCY_HALF_LIFE = 5
+LATENCY_WEIGHT = 0.2
+
+# капча, подсказки поиска и списки статей (by_rubric - это и поиск);
+# страницы статей (detail, detail_img, fragments) обслуживаются всегда
+LOW_PRIORITY = {
+    'captcha-image', 'captcha-image-2x', 'captcha-audio', 'captcha-refresh',
+    'main:typeahead', 'main:index', 'main:by_rubric', 'main:profile',
+}
+# ответы API из кэша дешевы: отклоняется только промах (api.cached_response)
+CACHED_LISTINGS = {'api_articles', 'api_comments', 'api_rubrics'}
+
+lock = threading.Lock()
+state = {'in_flight': 0, 'latency': 0.0, 'updated': 0.0}
+
+
+def queue_delay(request, now):
+    value = request.META.get(HEADER, '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return 0.0
+    # nginx $msec - секунды, другие прокси пишут милли- и микросекунды
+    while started > now * 100:
+        started /= 1000
+    return max(0.0, now - started)
+
+
+def recent_latency(now):
+    return state['latency'] * 2 ** (-(now - state['updated']) / LATENCY_HALF_LIFE)
+
+
+def record(seconds, now):
+    with lock:
+        state['latency'] += LATENCY_WEIGHT * (seconds - recent_latency(now))
+        state['updated'] = now
+
+
+def overloaded(delay, now):
+    limit = settings.ADMISSION_MAX_IN_FLIGHT
+    return (delay > settings.ADMISSION_MAX_QUEUE_DELAY
+            or limit is not None and state['in_flight'] > limit
+            or recent_latency(now) > settings.ADMISSION_MAX_LATENCY)
+
+
+def is_low_priority(request, view_name):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # списки в админке - самые тяжелые ее страницы
+    return view_name in LOW_PRIORITY or (view_name.startswith('admin:') and view_name.endswith('_changelist'))
+
+
+def shed(request, reason):
+    match = request.resolver_match
+    metrics.inc('http_requests_shed_total', route=match.view_name if match else 'unmatched', reason=reason)
+    response = HttpResponse('Сервер перегружен, повторите позже', status=503,
+                            content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = settings.ADMISSION_RETRY_AFTER
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class AdmissionMiddleware:
+    """Решает до вызова view, обслуживать ли запрос; стоит после MetricsMiddleware,
+    чтобы отклоненные запросы попадали в метрики."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if getattr(request, 'publishing', False):
+            # 503 оборвал бы публикацию (publish.render_page), а ее клиент не ждет
+            request.queue_delay, request.overloaded = 0.0, False
+            return self.get_response(request)
+        now = time.time()
+        request.queue_delay = queue_delay(request, now)
+        request.overloaded = overloaded(request.queue_delay, now)
+        with lock:
+            state['in_flight'] += 1
+        try:
+            response = self.get_response(request)
+        finally:
+            with lock:
+                state['in_flight'] -= 1
+        if response.status_code != 503:
+            finished = time.time()
+            record(finished - now, finished)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.queue_delay > settings.ADMISSION_DEADLINE:
+            return shed(request, 'deadline')
+        if request.overloaded and is_low_priority(request, request.resolver_match.view_name):
+            return shed(request, 'overload')
+        return None
@@ -0,0 +1,144 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.urls import path
+from rest_framework import generics
+from rest_framework.pagination import CursorPagination
+
+from . import admission, metrics
+from .models import Article, AdditionalImage, Comment, Rubric, SubRubric, SuperRubric
+from .serializers import ArticleSerializer, CommentSerializer, SuperRubricSerializer
+from .serializers import article_dict, comment_dict, requested_fields
+
+VERSION_KEY = 'api:version'
+
+
+def content_version():
+    return cache.get_or_set(VERSION_KEY, time.time(), None)
+
+
+def content_changed(sender, **kwargs):
+    cache.set(VERSION_KEY, time.time(), None)
+
+
+for model in (Article, AdditionalImage, Comment, Rubric, SubRubric, SuperRubric):
+    post_save.connect(content_changed, sender=model)
+    post_delete.connect(content_changed, sender=model)
+
+
+def cached_response(view):
+    """ETag и кэш готового JSON по адресу запроса и версии данных.
+
+    Версия меняется при любом сохранении/удалении статей, рубрик и комментариев,
+    поэтому устаревший ответ не отдается, а повторный запрос с If-None-Match
+    получает 304 без обращения к БД.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        digest = hashlib.md5(('%s:%s' % (content_version(), request.get_full_path())).encode()).hexdigest()
+        etag = '"%s"' % digest
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        key = 'api:response:' + digest
+        content = cache.get(key)
+        metrics.inc('cache_requests_total', cache='api', result='miss' if content is None else 'hit')
+        if content is None:
+            if getattr(request, 'overloaded', False) and request.resolver_match.view_name in admission.CACHED_LISTINGS:
+                return admission.shed(request, 'overload')
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.render()
+            content = response.content
+            cache.set(key, content, settings.API_CACHE_TIMEOUT)
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+    return wrapper
+
+
+class CreatedCursorPagination(CursorPagination):
+    ordering = '-created_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CommentCursorPagination(CreatedCursorPagination):
+    ordering = 'created_at'
+
+
+def article_queryset():
+    return Article.objects.filter(is_active=True) \
+        .select_related('rubric') \
+        .prefetch_related('additionalimage_set')
+
+
+class ArticleList(generics.ListAPIView):
+    serializer_class = ArticleSerializer
+    pagination_class = CreatedCursorPagination
+
+    def get_queryset(self):
+        queryset = article_queryset()
+        rubric = self.request.query_params.get('rubric', '')
+        if rubric.isdigit():
+            queryset = queryset.filter(rubric=rubric)
+        fields = requested_fields(self.request, ArticleSerializer.Meta.fields)
+        if 'images' not in fields:
+            queryset = queryset.prefetch_related(None)
+        if 'content' not in fields:
+            queryset = queryset.defer('content')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        fields = requested_fields(request, ArticleSerializer.Meta.fields)
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response([article_dict(a, fields, request) for a in page])
+
+
+class ArticleDetail(generics.RetrieveAPIView):
+    serializer_class = ArticleSerializer
+
+    def get_queryset(self):
+        return article_queryset()
+
+
+class CommentList(generics.ListAPIView):
+    serializer_class = CommentSerializer
+    pagination_class = CommentCursorPagination
+
+    def get_queryset(self):
+        article = get_object_or_404(Article.objects.only('pk'), pk=self.kwargs['pk'], is_active=True)
+        return Comment.objects.filter(article=article, is_active=True)
+
+    def list(self, request, *args, **kwargs):
+        fields = requested_fields(request, CommentSerializer.Meta.fields)
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response([comment_dict(c, fields) for c in page])
+
+
+class RubricList(generics.ListAPIView):
+    serializer_class = SuperRubricSerializer
+
+    def get_queryset(self):
+        return SuperRubric.objects.prefetch_related(
+            Prefetch('rubric_set', queryset=SubRubric.objects.order_by('order'))
+        )
+
+
+urlpatterns = [
+    path('articles/', cached_response(ArticleList.as_view()), name='api_articles'),
+    path('articles/<int:pk>/', cached_response(ArticleDetail.as_view()), name='api_article'),
+    path('articles/<int:pk>/comments/', cached_response(CommentList.as_view()), name='api_comments'),
+    path('rubrics/', cached_response(RubricList.as_view()), name='api_rubrics'),
+]
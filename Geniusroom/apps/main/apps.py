@@ -1,3 +1,5 @@
+import os
+
 from django.apps import AppConfig
 from django.dispatch import Signal
 
@@ -9,6 +11,14 @@ class MainConfig(AppConfig):
     name = 'Geniusroom.apps.main'
     verbose_name = 'Великие музыканты'
 
+    def ready(self):
+        # подключает обработчики сигналов моделей
+        from . import api, counters, digests, edge, feeds, publish, related, stats, trending, typeahead
+        if os.environ.get('RUN_MAIN') == 'true':
+            # процесс runserver, который обслуживает запросы; gunicorn - post_worker_init
+            counters.start()
+            typeahead.start()
+
 
 def user_registered_dispatcher(sender, **kwargs):
     send_activation_notification(kwargs['instance'])
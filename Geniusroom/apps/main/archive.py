@@ -0,0 +1,58 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import AdditionalImage, ArchivedArticle, ArchivedComment, ArchivedImage, Article, Comment, MediaFile
+from .models import visible_tree
+
+ARTICLE_FIELDS = ('id', 'rubric_id', 'title', 'content', 'source', 'characters', 'image', 'author_id',
+                  'is_active', 'created_at', 'views')
+COMMENT_FIELDS = ('id', 'article_id', 'parent_id', 'path', 'author', 'content', 'is_active', 'created_at')
+
+
+def add_refs(names):
+    # архив - еще одна ссылка на файл: django_cleanup при удалении статьи
+    # уменьшит счетчик, но файл останется (storage.py)
+    for name in names:
+        if not MediaFile.objects.filter(name=name).update(refs=F('refs') + 1):
+            try:
+                with transaction.atomic():
+                    MediaFile.objects.create(name=name, refs=2)
+            except IntegrityError:
+                MediaFile.objects.filter(name=name).update(refs=F('refs') + 1)
+
+
+def archive(pks):
+    """Переносит статьи с иллюстрациями и комментариями в архивные таблицы.
+
+    Статьи удаляются обычным delete(), поэтому статистика рубрик, ленты,
+    похожие статьи и кэши обновляются теми же сигналами, что и при удалении.
+    """
+    with transaction.atomic():
+        articles = list(Article.objects.filter(pk__in=pks).values(*ARTICLE_FIELDS))
+        if not articles:
+            return 0
+        pks = [a['id'] for a in articles]
+        ArchivedArticle.objects.bulk_create([ArchivedArticle(**a) for a in articles])
+        images = list(AdditionalImage.objects.filter(article__in=pks).values_list('article_id', 'image', 'caption'))
+        ArchivedImage.objects.bulk_create([ArchivedImage(article_id=article_id, image=image, caption=caption)
+                                           for article_id, image, caption in images])
+        ArchivedComment.objects.bulk_create(
+            [ArchivedComment(**c) for c in Comment.objects.filter(article__in=pks).values(*COMMENT_FIELDS)],
+            batch_size=500)
+        add_refs([a['image'] for a in articles if a['image']] + [image for _, image, _ in images])
+        for article in Article.objects.filter(pk__in=pks):
+            article.delete()
+    return len(pks)
+
+
+def archived_detail(pk):
+    """Данные для detail по архивной статье или None."""
+    article = ArchivedArticle.objects.select_related('rubric').filter(pk=pk).first()
+    if article is None:
+        return None
+    return {
+        'article': article,
+        'ais': article.archivedimage_set.all(),
+        'comments': visible_tree(ArchivedComment.objects.filter(article=article, is_active=True).order_by('path')),
+        'archived': True,
+    }
@@ -3,9 +3,17 @@ from .models import SubRubric
 
 def article_context_processor(request):
     context = {}
-    context['rubrics'] = SubRubric.objects.all()
+    # статистика рубрик приходит тем же запросом
+    context['rubrics'] = SubRubric.objects.select_related('super_rubric__stats', 'stats')
     context['keyword'] = ''
     context['all'] = ''
+    # страница рисуется для publish.py (меню подключается через SSI), для
+    # кэширующего прокси (edge.py) или в кэш статических страниц (pages.py):
+    # пользовательские части подгружаются с /fragments/
+    # атрибут ставит только publish.fetch, заголовком клиента его не включить
+    context['publishing'] = getattr(request, 'publishing', False)
+    context['shared'] = context['publishing'] or getattr(request, 'edge_cached', False) or \
+        getattr(request, 'shared_page', False)
 
     if 'keyword' in request.GET:
         keyword = request.GET['keyword']
@@ -0,0 +1,101 @@
+"""Счетчики просмотров статей.
+
+Просмотр только увеличивает число в памяти воркера; фоновый поток раз в
+VIEW_COUNTS_FLUSH_INTERVAL секунд (или раньше, когда накопилось
+VIEW_COUNTS_MAX_PENDING просмотров) записывает суммы пачками UPDATE.
+Страница не ждет БД и не блокирует строку статьи. При падении воркера
+теряется не больше одного интервала и не больше VIEW_COUNTS_MAX_PENDING
+просмотров; при обычной остановке остаток записывается (config/gunicorn.conf.py).
+Просмотры опубликованных страниц приходят через /fragments/ и считаются не
+чаще раза в VIEW_COUNTS_CLIENT_WINDOW секунд на клиента и статью (hit_from).
+"""
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+lock = threading.Lock()
+state = {'pending': Counter(), 'total': 0, 'pid': None}
+wakeup = threading.Event()
+
+
+def hit(pk):
+    with lock:
+        state['pending'][pk] += 1
+        state['total'] += 1
+        full = state['total'] >= settings.VIEW_COUNTS_MAX_PENDING
+    if full:
+        wakeup.set()
+
+
+def hit_from(client, pk):
+    if cache.add('viewed:%s:%d' % (client, pk), 1, settings.VIEW_COUNTS_CLIENT_WINDOW):
+        hit(pk)
+
+
+def take():
+    with lock:
+        deltas = state['pending']
+        state['pending'], state['total'] = Counter(), 0
+    return deltas
+
+
+def restore(deltas):
+    with lock:
+        state['pending'].update(deltas)
+        state['total'] += sum(deltas.values())
+
+
+def flush():
+    """Записывает накопленные просмотры; возвращает их число."""
+    from .models import Article
+
+    deltas = take()
+    if not deltas:
+        return 0
+    pks = sorted(deltas)
+    size = settings.VIEW_COUNTS_BATCH_SIZE
+    try:
+        with transaction.atomic():
+            for start in range(0, len(pks), size):
+                batch = pks[start:start + size]
+                # update() обходит сигналы: кэши и опубликованные страницы не сбрасываются
+                Article.objects.filter(pk__in=batch).update(views=F('views') + Case(
+                    *[When(pk=pk, then=Value(deltas[pk])) for pk in batch], output_field=IntegerField()))
+    except Exception:
+        restore(deltas)
+        raise
+    total = sum(deltas.values())
+    metrics.inc('article_views_flushed_total', total)
+    return total
+
+
+def run():
+    while True:
+        wakeup.wait(settings.VIEW_COUNTS_FLUSH_INTERVAL)
+        wakeup.clear()
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            # БД недоступна: просмотры остаются в памяти до следующей попытки
+            logger.exception('Не удалось записать просмотры')
+
+
+def start():
+    # потоки не переживают fork, поэтому запускается в каждом воркере
+    # (post_worker_init в config/gunicorn.conf.py, для runserver - MainConfig.ready)
+    with lock:
+        if state['pid'] == os.getpid():
+            return
+        state['pid'] = os.getpid()
+    threading.Thread(target=run, name='view-counts', daemon=True).start()
@@ -0,0 +1,91 @@
+"""Сводки новых комментариев для авторов статей (AdvUser.comment_digest).
+
+Для таких авторов комментарий не отправляет письмо и ничего не пишет в БД:
+сводка собирается из самих комментариев, созданных после
+AdvUser.digest_sent_at. manage.py send_comment_digests (из cron, например раз
+в минуту) отправляет каждому автору не чаще раза в COMMENT_DIGEST_INTERVAL
+секунд одно письмо со всеми новыми комментариями. Шаблоны загружаются один
+раз на отправку, все письма уходят через одно SMTP-соединение; письмо, которое
+сервер не принял, не мешает остальным и повторяется при следующем запуске.
+Авторам без адреса сводки не собираются.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F
+from django.template.loader import get_template
+from django.utils import timezone
+
+from . import metrics
+from .models import AdvUser, Comment
+from .utilities import get_host
+
+logger = logging.getLogger(__name__)
+
+# комментарий получает created_at до фиксации транзакции: последние секунды
+# откладываются до следующей отправки, чтобы не пропустить незафиксированные
+SETTLE = timedelta(seconds=10)
+
+
+def pending(cutoff):
+    return Comment.objects.filter(is_active=True, article__author__comment_digest=True,
+                                  article__author__send_messages=True, article__author__is_active=True,
+                                  article__author__email__gt='',
+                                  created_at__gt=F('article__author__digest_sent_at'), created_at__lte=cutoff)
+
+
+def collect(cutoff, due):
+    """Автор -> [статья, [комментарии]] и число комментариев сверх COMMENT_DIGEST_MAX_COMMENTS."""
+    digests = {}
+    comments = pending(cutoff).filter(article__author__digest_sent_at__lte=due).select_related('article') \
+        .order_by('article__author', 'article', 'created_at')
+    for comment in comments.iterator():
+        digest = digests.setdefault(comment.article.author_id, {'articles': [], 'count': 0})
+        digest['count'] += 1
+        if digest['count'] > settings.COMMENT_DIGEST_MAX_COMMENTS:
+            continue
+        if not digest['articles'] or digest['articles'][-1][0].pk != comment.article_id:
+            digest['articles'].append((comment.article, []))
+        digest['articles'][-1][1].append(comment)
+    return digests
+
+
+def send_digests(now=None):
+    """Отправляет сводки авторам, у которых подошел срок; возвращает число писем."""
+    now = now or timezone.now()
+    cutoff = now - SETTLE
+    digests = collect(cutoff, now - timedelta(seconds=settings.COMMENT_DIGEST_INTERVAL))
+    if not digests:
+        return 0
+    subject = get_template('main/email/comment_digest_letter_subject.txt')
+    body = get_template('main/email/comment_digest_letter_body.html')
+    host = get_host()
+    sent = []
+    connection = get_connection()
+    connection.open()
+    try:
+        for author in AdvUser.objects.filter(pk__in=digests):
+            digest = digests[author.pk]
+            context = {'author': author, 'host': host, 'articles': digest['articles'], 'count': digest['count'],
+                       'more': max(0, digest['count'] - settings.COMMENT_DIGEST_MAX_COMMENTS)}
+            message = EmailMultiAlternatives(subject=subject.render(context).strip(), body='',
+                                             from_email=settings.EMAIL_HOST_USER, to=[author.email],
+                                             connection=connection)
+            message.attach_alternative(body.render(context), 'text/html')
+            try:
+                if message.send():
+                    sent.append(author.pk)
+            except Exception:
+                # срок этого автора не сдвигается: сводка уйдет при следующем запуске
+                logger.exception('Сводка комментариев для %s не отправлена', author.email)
+    finally:
+        connection.close()
+    AdvUser.objects.filter(pk__in=sent).update(digest_sent_at=cutoff)
+    metrics.inc('comment_digests_sent_total', len(sent))
+    metrics.inc('comment_digest_comments_total', sum(digests[pk]['count'] for pk in sent))
+    return len(sent)
+
+
+metrics.gauges['comment_notifications_pending'] = lambda: pending(timezone.now()).count()
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import urllib.request
+from functools import wraps
+from queue import Queue
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.cache import has_vary_header
+from django.utils.module_loading import import_string
+
+from .models import Article, Comment, Rubric, SubRubric, SuperRubric
+
+# ключи Surrogate-Key: nav - боковое меню со статистикой рубрик (есть на всех страницах),
+# index - главная, r<pk> - рубрика, a<pk> - статья
+NAV = 'nav'
+INDEX = 'index'
+# прокси ограничивают длину заголовка: ключи отправляются пачками
+KEYS_PER_REQUEST = 100
+
+local = threading.local()
+logger = logging.getLogger(__name__)
+lock = threading.Lock()
+# очередь очисток и поток, который их отправляет; свои в каждом процессе
+sender = {'pid': None, 'queue': None}
+
+
+def rubric_key(pk):
+    return 'r%d' % pk
+
+
+def article_key(pk):
+    return 'a%d' % pk
+
+
+def index_keys():
+    return {NAV, INDEX}
+
+
+def rubric_keys(pk):
+    return {NAV, rubric_key(pk)}
+
+
+def detail_keys(rubric_pk, pk):
+    # на странице есть название рубрики; заголовки похожих статей добавляет detail
+    return {NAV, rubric_key(rubric_pk), article_key(pk)}
+
+
+def image_keys(rubric_pk, pk, img):
+    return {article_key(pk)}
+
+
+def edge_cache(keys):
+    """Помечает запрос как общий для кэширующего прокси с ключами keys(**kwargs).
+
+    Страница GET-запроса рисуется без пользовательских данных (как для publish.py),
+    поэтому одна копия годится для всех посетителей; представление может добавить
+    ключи в request.surrogate_keys. Заголовки ставит EdgeCacheMiddleware.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            request.edge_cached = settings.EDGE_CACHE_ENABLED and request.method in ('GET', 'HEAD')
+            request.surrogate_keys = set(keys(**kwargs))
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class EdgeCacheMiddleware:
+    """Отдает прокси ответы представлений с edge_cache.
+
+    Стоит в MIDDLEWARE выше SessionMiddleware и CsrfViewMiddleware: ответ
+    приходит сюда уже с их cookie и Vary, и страница, которая все-таки
+    оказалась личной, в кэш прокси не попадет. Браузер всегда перепроверяет
+    страницу, прокси хранит ее до очистки по ключам.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'edge_cached', False) and response.status_code == 200 and not response.cookies \
+                and not has_vary_header(response, 'Cookie'):
+            response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+            response['Surrogate-Control'] = 'max-age=%d' % settings.EDGE_CACHE_TIMEOUT
+            response['Surrogate-Key'] = ' '.join(sorted(request.surrogate_keys))
+        return response
+
+
+class HttpPurgeTransport:
+    """Отправляет PURGE (или BAN) с заголовком Surrogate-Key на каждый прокси."""
+
+    def __init__(self, urls, method='PURGE', timeout=2):
+        self.urls = urls
+        self.method = method
+        self.timeout = timeout
+
+    def purge(self, keys):
+        for url in self.urls:
+            request = urllib.request.Request(url, method=self.method, headers={'Surrogate-Key': ' '.join(keys)})
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+
+
+def get_transport():
+    options = dict(settings.EDGE_CACHE_PURGE)
+    return import_string(options.pop('TRANSPORT'))(**{k.lower(): v for k, v in options.items()})
+
+
+def send(keys):
+    try:
+        transport = get_transport()
+        for i in range(0, len(keys), KEYS_PER_REQUEST):
+            transport.purge(keys[i:i + KEYS_PER_REQUEST])
+    except Exception:
+        # прокси недоступен: страницы устареют не дольше EDGE_CACHE_TIMEOUT
+        logger.exception('Не удалось очистить кэш прокси: %s', ' '.join(keys))
+
+
+def run(queue):
+    while True:
+        keys = queue.get()
+        try:
+            send(keys)
+        finally:
+            queue.task_done()
+
+
+def flush():
+    # запросы к прокси идут из фонового потока: ответ не ждет их таймаутов
+    keys, local.keys = getattr(local, 'keys', None), None
+    if not keys:
+        return
+    with lock:
+        # потоки не переживают fork: воркер заводит свой при первой очистке
+        if sender['pid'] != os.getpid():
+            sender.update(pid=os.getpid(), queue=Queue())
+            threading.Thread(target=run, args=(sender['queue'],), name='edge-purge', daemon=True).start()
+        sender['queue'].put(sorted(keys))
+
+
+def wait():
+    """Ждет отправки всех очисток этого процесса (для тестов и команд)."""
+    if sender['pid'] == os.getpid():
+        sender['queue'].join()
+
+
+def purge(keys):
+    # ключи всех изменений транзакции отправляются один раз после commit
+    if not settings.EDGE_CACHE_ENABLED:
+        return
+    if getattr(local, 'keys', None) is None:
+        local.keys = set()
+    local.keys.update(keys)
+    transaction.on_commit(flush)
+
+
+def article_changed(sender, instance, **kwargs):
+    keys = {INDEX, article_key(instance.pk), rubric_key(instance.rubric_id)}
+    # прежнее состояние запоминается в stats.remember_state
+    old = getattr(instance, '_stats_state', None)
+    if old:
+        keys.add(rubric_key(old[0]))
+    # меню показывает число статей: оно меняется, только если статья
+    # появилась, исчезла, переехала или сменила видимость
+    if kwargs.get('created', True) or old != (instance.rubric_id, instance.is_active, instance.created_at):
+        keys.add(NAV)
+    purge(keys)
+
+
+def comment_changed(sender, instance, **kwargs):
+    purge({article_key(instance.article_id)})
+
+
+def rubric_changed(sender, instance, **kwargs):
+    keys = {NAV, rubric_key(instance.pk)}
+    keys.update(rubric_key(pk) for pk in Rubric.objects.filter(super_rubric=instance.pk).values_list('pk', flat=True))
+    purge(keys)
+
+
+post_save.connect(article_changed, sender=Article)
+post_delete.connect(article_changed, sender=Article)
+post_save.connect(comment_changed, sender=Comment)
+post_delete.connect(comment_changed, sender=Comment)
+for model in (Rubric, SubRubric, SuperRubric):
+    post_save.connect(rubric_changed, sender=model)
+    post_delete.connect(rubric_changed, sender=model)
@@ -0,0 +1,205 @@
+import gzip
+import os
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.text import Truncator
+
+from . import metrics
+from .models import Article, FeedTarget, Rubric, SubRubric, SuperRubric
+from .pages import PAGES
+from .utilities import get_host
+
+# статьи раскладываются по файлам sitemap по диапазонам pk:
+# изменение статьи переписывает только ее файл
+SHARD_SIZE = 10000
+FEED_SIZE = 20
+FEED_FORMATS = (('atom', Atom1Feed), ('rss', Rss201rev2Feed))
+
+
+def public_path(*parts):
+    return os.path.join(settings.PUBLIC_ROOT, *parts)
+
+
+def write_file(path, data):
+    # запись через временный файл: nginx никогда не отдаст недописанный файл;
+    # рядом кладется .gz для gzip_static
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for name, content in ((path, data), (path + '.gz', gzip.compress(data, 9))):
+        tmp = '%s.%d.tmp' % (name, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, name)
+
+
+def remove_file(path):
+    for name in (path, path + '.gz'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def urlset(entries):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for loc, lastmod in entries:
+        lines.append('<url><loc>%s</loc>%s</url>' % (
+            escape(loc), '<lastmod>%s</lastmod>' % lastmod.date().isoformat() if lastmod else ''))
+    lines.append('</urlset>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def article_url(rubric_id, pk):
+    return get_host() + reverse('main:detail', kwargs={'rubric_pk': rubric_id, 'pk': pk})
+
+
+def shard_path(number):
+    return public_path('sitemaps', 'articles-%d.xml' % number)
+
+
+def write_shard(number):
+    rows = Article.objects.filter(is_active=True, pk__gte=number * SHARD_SIZE, pk__lt=(number + 1) * SHARD_SIZE) \
+        .order_by('pk').values_list('pk', 'rubric_id', 'created_at')
+    entries = [(article_url(rubric_id, pk), created_at) for pk, rubric_id, created_at in rows]
+    if entries:
+        write_file(shard_path(number), urlset(entries))
+    else:
+        remove_file(shard_path(number))
+
+
+def write_pages():
+    host = get_host()
+    entries = [(host + reverse('main:index'), None)]
+    entries += [(host + reverse('main:other', kwargs={'page': page}), None) for page in PAGES]
+    stats = dict(SubRubric.objects.values_list('pk', 'stats__latest_created_at'))
+    entries += [(host + reverse('main:by_rubric', kwargs={'pk': pk}), latest) for pk, latest in stats.items()]
+    write_file(public_path('sitemaps', 'pages.xml'), urlset(entries))
+
+
+def write_index():
+    directory = public_path('sitemaps')
+    os.makedirs(directory, exist_ok=True)
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.xml'))
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for name in names:
+        mtime = datetime.fromtimestamp(os.path.getmtime(os.path.join(directory, name)), timezone.utc)
+        lines.append('<sitemap><loc>%s/sitemaps/%s</loc><lastmod>%s</lastmod></sitemap>' % (
+            get_host(), name, mtime.isoformat(timespec='seconds')))
+    lines.append('</sitemapindex>')
+    write_file(public_path('sitemap.xml'), '\n'.join(lines).encode('utf-8'))
+
+
+def write_feeds(name, title, link, articles):
+    articles = list(articles.select_related('rubric')[:FEED_SIZE])
+    for ext, feed_class in FEED_FORMATS:
+        feed = feed_class(title=title, link=link, description=title, language=settings.LANGUAGE_CODE,
+                          feed_url='%s/feeds/%s.%s' % (get_host(), name, ext))
+        for article in articles:
+            url = article_url(article.rubric_id, article.pk)
+            feed.add_item(title=article.title, link=url, unique_id=url, pubdate=article.created_at,
+                          description=Truncator(article.content).chars(300),
+                          categories=[article.rubric.name])
+        write_file(public_path('feeds', '%s.%s' % (name, ext)), feed.writeString('utf-8').encode('utf-8'))
+
+
+def write_rubric_feeds(rubric_id):
+    rubric = SubRubric.objects.select_related('super_rubric').filter(pk=rubric_id).first()
+    if rubric is None:
+        for ext, _ in FEED_FORMATS:
+            remove_file(public_path('feeds', 'rubric-%d.%s' % (rubric_id, ext)))
+        return
+    write_feeds('rubric-%d' % rubric_id, str(rubric), get_host() + reverse('main:by_rubric', kwargs={'pk': rubric_id}),
+                Article.objects.filter(is_active=True, rubric=rubric_id))
+
+
+def write_main_feeds():
+    write_feeds('all', 'Из жизни замечательных людей', get_host() + reverse('main:index'),
+                Article.objects.filter(is_active=True))
+
+
+def build_all():
+    # отмеченное до начала сборки она и перепишет
+    FeedTarget.objects.all().delete()
+    max_pk = Article.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+    shards = range(max_pk // SHARD_SIZE + 1)
+    for number in shards:
+        write_shard(number)
+    # файлы диапазонов, которых больше нет (например, после удаления статей)
+    directory = public_path('sitemaps')
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith('articles-') and name.endswith('.xml'):
+            if int(name[len('articles-'):-len('.xml')]) not in shards:
+                remove_file(os.path.join(directory, name))
+    write_pages()
+    write_index()
+    for rubric_id in SubRubric.objects.values_list('pk', flat=True):
+        write_rubric_feeds(rubric_id)
+    write_main_feeds()
+
+
+def mark(names):
+    FeedTarget.objects.bulk_create([FeedTarget(name=name) for name in names], ignore_conflicts=True)
+
+
+def schedule(shards=(), rubrics=(), pages=False):
+    # запрос только отмечает файлы; переписывает их manage.py build_feeds --pending
+    # (по cron). Отметка после commit: сборка, забравшая отметку, уже видит изменение
+    if not settings.FEEDS_AUTO_UPDATE:
+        return
+    names = {'articles-%d' % number for number in shards} | {'rubric-%d' % pk for pk in rubrics}
+    if pages:
+        names.add('pages')
+    transaction.on_commit(lambda: mark(names))
+
+
+def build_pending():
+    """Переписывает отмеченные файлы, индекс и общие ленты; возвращает число отметок."""
+    with transaction.atomic():
+        names = set(FeedTarget.objects.values_list('name', flat=True))
+        FeedTarget.objects.filter(name__in=names).delete()
+    if not names:
+        return 0
+    try:
+        for name in sorted(names):
+            kind, _, number = name.partition('-')
+            if kind == 'articles':
+                write_shard(int(number))
+            elif kind == 'rubric':
+                write_rubric_feeds(int(number))
+            elif kind == 'pages':
+                write_pages()
+        write_index()
+        write_main_feeds()
+    except Exception:
+        # отметки возвращаются в очередь для следующего запуска
+        mark(names)
+        raise
+    return len(names)
+
+
+def article_changed(sender, instance, **kwargs):
+    rubrics = {instance.rubric_id}
+    # прежняя рубрика запоминается в stats.remember_state
+    old = getattr(instance, '_stats_state', None)
+    if old:
+        rubrics.add(old[0])
+    schedule(shards={instance.pk // SHARD_SIZE}, rubrics=rubrics, pages=True)
+
+
+def rubric_changed(sender, instance, **kwargs):
+    schedule(rubrics={instance.pk} if instance.super_rubric_id else (), pages=True)
+
+
+post_save.connect(article_changed, sender=Article)
+post_delete.connect(article_changed, sender=Article)
+for model in (Rubric, SubRubric, SuperRubric):
+    post_save.connect(rubric_changed, sender=model)
+    post_delete.connect(rubric_changed, sender=model)
+metrics.gauges['feeds_pending'] = FeedTarget.objects.count
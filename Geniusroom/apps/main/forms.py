@@ -1,21 +1,33 @@
+from io import BytesIO
+
 from django.core import validators
+from django.core.files.base import ContentFile
 from django import forms
 from django.core.exceptions import ValidationError
 from django.forms import fields, models
 from django.contrib.auth import password_validation
 from django.forms import inlineformset_factory
+from django.utils import timezone
 from captcha.fields import CaptchaField
 
+from . import uploads
 from .apps import user_registered
-from .models import AdvUser, Article, SuperRubric, SubRubric, AdditionalImage, Comment
+from .utilities import resize_image
+from .models import AdvUser, Article, SuperRubric, SubRubric, AdditionalImage, Comment, MAX_COMMENT_DEPTH
 
 
 class ChangeUserInfoForm(forms.ModelForm):
     email = forms.EmailField(required=True, label='Адрес электронной почты')
 
+    def save(self, commit=True):
+        if {'send_messages', 'comment_digest'} & set(self.changed_data):
+            # уже отправленные по одному (или пропущенные) комментарии не попадут в сводку
+            self.instance.digest_sent_at = timezone.now()
+        return super().save(commit)
+
     class Meta:
         model = AdvUser
-        fields = ('username', 'email', 'first_name', 'last_name', 'send_messages')
+        fields = ('username', 'email', 'first_name', 'last_name', 'send_messages', 'comment_digest')
 
 
 class RegisterUserForm(forms.ModelForm):
@@ -53,7 +65,8 @@ class RegisterUserForm(forms.ModelForm):
 
     class Meta:
         model = AdvUser
-        fields = ('username', 'email', 'password1', 'password2', 'first_name', 'last_name', 'send_messages')
+        fields = ('username', 'email', 'password1', 'password2', 'first_name', 'last_name', 'send_messages',
+                  'comment_digest')
 
 
 class SubRubricForm(forms.ModelForm):
@@ -77,6 +90,8 @@ class ArticleForm(forms.ModelForm):
                                      'invalid': 'Введите в формате: "<имя> (<год_рождения>-<год_смерти>)"'
                                  }
                                  )
+    # токен изображения, загруженного по частям (uploads.resumable_upload)
+    image_upload = forms.CharField(required=False, widget=forms.HiddenInput)
 
     class Meta:
         model = Article
@@ -85,43 +100,67 @@ class ArticleForm(forms.ModelForm):
             'author': forms.HiddenInput
         }
 
+    def __init__(self, *args, user=None, **kwargs):
+        # загрузка по частям принадлежит тому, кто вошел, а не присланному полю author
+        self.user = user
+        super().__init__(*args, **kwargs)
+
     def clean_image(self):
         val = self.cleaned_data['image']
 
-        if 'image' in self.changed_data:
-            from PIL import Image
+        if self.data.get('image_upload'):
+            val = uploads.resumable_file(self.data['image_upload'], self.user.pk if self.user else None)
+        elif 'image' not in self.changed_data:
+            return val
+
+        from PIL import Image
+        with val:
             img = Image.open(val.file)
             fmt = img.format.lower()
+            # JPEG сразу декодируется в уменьшенном масштабе
+            img.draft(img.mode, (300, 300))
+            resized = resize_image(img)
+            # загрузка лежит во временном файле на диске (uploads.py),
+            # уменьшенная копия небольшая
+            buffer = BytesIO()
+            resized.save(buffer, fmt)
+        return ContentFile(buffer.getvalue(), name=val.name)
 
-            w = img.size[0]
-            h = img.size[1]
-
-            if w > h:
-                quotient = h / w
-                resized = img.resize(size=(300, round(300 * quotient)))
-            else:
-                quotient = w / h
-                resized = img.resize(size=(round(300 * quotient), 300))
-
-            val.file = type(val.file)()
-            resized.save(val.file, fmt)
-
-        return val
+    def save(self, *args, **kwargs):
+        article = super().save(*args, **kwargs)
+        uploads.discard(self.cleaned_data.get('image_upload'))
+        return article
 
 
 AIFormSet = inlineformset_factory(Article, AdditionalImage, fields='__all__')
 
 
-class UserCommentForm(forms.ModelForm):
+class CommentFormMixin:
+    def clean(self):
+        super().clean()
+        parent = self.cleaned_data.get('parent')
+        article = self.cleaned_data.get('article')
+        if parent and article and parent.article_id != article.pk:
+            raise ValidationError({'parent': ValidationError(
+                'Комментарий относится к другой статье', code='wrong_article'
+            )})
+        if parent and parent.depth + 1 >= MAX_COMMENT_DEPTH:
+            raise ValidationError({'parent': ValidationError(
+                'Слишком глубокая ветка ответов', code='too_deep'
+            )})
+
+
+class UserCommentForm(CommentFormMixin, forms.ModelForm):
     class Meta:
         model = Comment
         exclude = ('is_active',)
         widgets = {
-            'article': forms.HiddenInput
+            'article': forms.HiddenInput,
+            'parent': forms.HiddenInput,
         }
 
 
-class GuestCommentForm(forms.ModelForm):
+class GuestCommentForm(CommentFormMixin, forms.ModelForm):
     captcha = CaptchaField(label='Введите текст с картинки', error_messages={
         'invalid': 'Неправильный текст'
     })
@@ -130,5 +169,6 @@ class GuestCommentForm(forms.ModelForm):
         model = Comment
         exclude = ('is_active',)
         widgets = {
-            'article': forms.HiddenInput
+            'article': forms.HiddenInput,
+            'parent': forms.HiddenInput,
         }
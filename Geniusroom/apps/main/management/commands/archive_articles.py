@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from ...archive import archive
+from ...models import Article
+
+
+class Command(BaseCommand):
+    help = 'Перенос неактивных и старых статей с комментариями в архивные таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, default=365,
+                            help='Скрытые статьи старше стольких дней')
+        parser.add_argument('--older-than-days', type=int,
+                            help='Любые статьи старше стольких дней')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Пауза между пачками, с')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        condition = Q(is_active=False, created_at__lt=now - timedelta(days=options['inactive_days']))
+        if options['older_than_days'] is not None:
+            if options['older_than_days'] <= 0:
+                raise CommandError('--older-than-days должно быть положительным')
+            condition |= Q(created_at__lt=now - timedelta(days=options['older_than_days']))
+        candidates = Article.objects.filter(condition).order_by('pk').values_list('pk', flat=True)
+        if options['dry_run']:
+            self.stdout.write('К переносу статей: %d' % candidates.count())
+            return
+
+        moved = 0
+        while True:
+            # перенесенные статьи из выборки исчезают: всегда берется начало
+            batch = list(candidates[:options['batch_size']])
+            if not batch:
+                break
+            moved += archive(batch)
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS('Перенесено в архив статей: %d' % moved))
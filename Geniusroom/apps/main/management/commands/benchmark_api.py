@@ -0,0 +1,34 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...api import article_queryset
+from ...models import Comment
+from ...serializers import ArticleSerializer, CommentSerializer, article_dict, comment_dict
+
+
+class Command(BaseCommand):
+    help = 'Сравнение сериализаторов DRF и ручной сериализации для списков API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=20, help='Объектов на страницу')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        size, repeat = options['size'], options['repeat']
+        articles = list(article_queryset()[:size])
+        comments = list(Comment.objects.filter(is_active=True)[:size])
+        if not articles:
+            raise CommandError('Нет статей для замера')
+
+        cases = (
+            ('articles', articles, ArticleSerializer, article_dict),
+            ('comments', comments, CommentSerializer, comment_dict),
+        )
+        for name, objects, serializer, to_dict in cases:
+            if not objects:
+                continue
+            drf = timeit.timeit(lambda: serializer(objects, many=True).data, number=repeat)
+            manual = timeit.timeit(lambda: [to_dict(obj) for obj in objects], number=repeat)
+            self.stdout.write('%s (%d шт.): DRF %.3f мс, вручную %.3f мс на страницу, x%.1f' % (
+                name, len(objects), drf / repeat * 1000, manual / repeat * 1000, drf / manual))
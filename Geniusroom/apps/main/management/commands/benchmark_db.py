@@ -0,0 +1,88 @@
+import multiprocessing
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import override_settings
+
+from ...models import Article, Comment
+
+AUTHOR = 'benchmark_db'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def worker(pks, duration, write_ratio, seed, results):
+    """Один воркер gunicorn: страница статьи или новый комментарий к ней."""
+    rng = random.Random(seed)
+    stats = {'read': [], 'write': [], 'errors': 0}
+    deadline = time.monotonic() + duration
+    # комментарий пишется со всеми сигналами, как из формы, но без писем
+    with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+        while time.monotonic() < deadline:
+            pk = rng.choice(pks)
+            kind = 'write' if rng.random() < write_ratio else 'read'
+            started = time.monotonic()
+            try:
+                if kind == 'write':
+                    Comment.objects.create(article_id=pk, author=AUTHOR, content='Текст')
+                else:
+                    Article.objects.select_related('rubric').get(pk=pk)
+                    list(Comment.objects.threads(pk, 0, 20))
+            except OperationalError:
+                stats['errors'] += 1
+                continue
+            stats[kind].append(time.monotonic() - started)
+    connection.close()
+    results.put(stats)
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность БД при одновременном чтении статей и записи комментариев '
+            'из нескольких процессов. Пишет комментарии: запускать на копии базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3, help='Процессов (воркеров gunicorn)')
+        parser.add_argument('--duration', type=float, default=10, help='Секунд')
+        parser.add_argument('--write-ratio', type=float, default=0.1, help='Доля запросов на запись')
+
+    def handle(self, *args, **options):
+        pks = list(Article.objects.filter(is_active=True).values_list('pk', flat=True)[:1000])
+        if not pks:
+            raise CommandError('Нет статей для замера')
+        # сравнение с PostgreSQL - тот же запуск с prod_settings
+        backend = connection.vendor
+        if backend == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                backend += ' (journal_mode=%s)' % cursor.fetchone()[0]
+
+        # соединение не должно достаться дочерним процессам
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=worker, args=(pks, options['duration'], options['write_ratio'], seed,
+                                                          results))
+                     for seed in range(options['workers'])]
+        for process in processes:
+            process.start()
+        stats = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        deleted, _ = Comment.objects.filter(author=AUTHOR).delete()
+        self.stdout.write('%s, %d процесса(ов), %g с; удалено комментариев: %d' % (
+            backend, options['workers'], options['duration'], deleted))
+        for kind, name in (('read', 'чтение'), ('write', 'запись')):
+            times = [t for s in stats for t in s[kind]]
+            self.stdout.write('%s: %.1f в секунду, p50 %.1f мс, p95 %.1f мс' % (
+                name, len(times) / options['duration'], percentile(times, 0.5) * 1000,
+                percentile(times, 0.95) * 1000))
+        self.stdout.write('ошибок "database is locked" и других OperationalError: %d' % sum(
+            s['errors'] for s in stats))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ...feeds import build_all, build_pending
+
+
+class Command(BaseCommand):
+    help = 'Полная сборка sitemap.xml и лент Atom/RSS в PUBLIC_ROOT или только измененных (--pending, по cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pending', action='store_true',
+                            help='Только файлы, отмеченные после изменений статей и рубрик')
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            done = build_pending()
+            self.stdout.write(self.style.SUCCESS('Обновлено отмеченных файлов: %d' % done))
+            return
+        build_all()
+        self.stdout.write(self.style.SUCCESS('Sitemap и ленты собраны'))
@@ -0,0 +1,41 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ... import partitions
+
+
+class Command(BaseCommand):
+    help = 'Помесячные секции main_comment (PostgreSQL): создание заранее и отсоединение старых'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3, help='Сколько месяцев вперед создать')
+        parser.add_argument('--detach-before', metavar='ГГГГ-ММ',
+                            help='Отсоединить секции месяцев раньше указанного; пустые удаляются')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write('Секционирование используется только с PostgreSQL')
+            return
+        cutoff = None
+        if options['detach_before']:
+            try:
+                year, month = map(int, options['detach_before'].split('-'))
+                cutoff = date(year, month, 1)
+            except ValueError:
+                raise CommandError('Ожидается месяц в виде ГГГГ-ММ')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError('Таблица %s не секционирована (миграция 0014)' % partitions.TABLE)
+            for shift in range(options['ahead'] + 1):
+                partitions.create_partition(cursor, partitions.month_start(date.today(), shift))
+            for name, month in partitions.partitions(cursor):
+                if cutoff and month < cutoff:
+                    if partitions.detach_partition(cursor, name):
+                        self.stdout.write('%s отсоединена, данные остались в отдельной таблице' % name)
+                    else:
+                        self.stdout.write('%s пустая, удалена' % name)
+            for name, month in partitions.partitions(cursor):
+                self.stdout.write('%s: %s' % (name, month.strftime('%Y-%m')))
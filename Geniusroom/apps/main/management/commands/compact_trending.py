@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...trending import compact
+
+
+class Command(BaseCommand):
+    help = 'Удаление остывших статей из блока "Обсуждают сейчас" и пересборка списка в кэше (по cron)'
+
+    def handle(self, *args, **options):
+        deleted = compact()
+        self.stdout.write(self.style.SUCCESS('Удалено остывших статей: %d' % deleted))
@@ -0,0 +1,259 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+
+from ...models import AdvUser, Article, AdditionalImage, SubRubric
+from ...utilities import get_timestamp_path, resize_image
+from ... import edge, publish, typeahead
+from ...feeds import build_all
+from ...stats import recompute_all
+
+FIELDS = ('title', 'content', 'source', 'characters')
+# значения is_active без учета регистра; пустое или отсутствующее - True
+BOOLEANS = {'true': True, '1': True, 'yes': True, 'да': True,
+            'false': False, '0': False, 'no': False, 'нет': False}
+
+
+def read_records(path):
+    # JSONL: один объект на строку; CSV: заголовок + строки,
+    # дополнительные иллюстрации в колонке images через ';' в виде "файл|подпись"
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                images = []
+                for item in filter(None, (row.pop('images', '') or '').split(';')):
+                    name, _, caption = item.partition('|')
+                    images.append({'file': name.strip(), 'caption': caption.strip()})
+                row['images'] = images
+                yield row
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def record_key(record):
+    if record.get('key'):
+        return str(record['key'])[:64]
+    data = json.dumps([record.get(name, '') for name in FIELDS + ('rubric',)], ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def parse_active(value):
+    # None - значение не распознано
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return BOOLEANS.get(str(value).strip().lower())
+
+
+def type_errors(record):
+    # в JSONL может оказаться что угодно: число, null, список вместо строки
+    if not isinstance(record, dict):
+        return ['запись должна быть объектом']
+    errors = ['поле %s должно быть строкой' % name for name in FIELDS + ('rubric', 'author', 'image')
+              if record.get(name) is not None and not isinstance(record[name], str)]
+    images = record.get('images') or []
+    if not isinstance(images, list) or not all(
+            isinstance(image, dict) and isinstance(image.get('file'), str)
+            and isinstance(image.get('caption', ''), str) for image in images):
+        errors.append('поле images должно быть списком объектов с file и caption')
+    return errors
+
+
+def process_image(path):
+    # выполняется в дочернем процессе пула: открыть, уменьшить и вернуть байты
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            fmt = img.format
+            out = io.BytesIO()
+            resize_image(img).save(out, fmt)
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+    return path, out.getvalue(), None
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт статей и иллюстраций из JSONL/CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Файл .jsonl или .csv')
+        parser.add_argument('--images', default='.', help='Каталог с файлами иллюстраций')
+        parser.add_argument('--author', help='Имя пользователя-автора по умолчанию')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                            help='Число процессов для обработки изображений')
+        parser.add_argument('--state', help='Файл контрольной точки для продолжения прерванного импорта')
+
+    def handle(self, *args, **options):
+        self.images_dir = options['images']
+        self.default_author = options['author']
+        state = options['state']
+        skip = 0
+        if state and os.path.exists(state):
+            with open(state) as f:
+                skip = int(f.read().strip() or 0)
+            self.stdout.write('Продолжение с записи %d' % skip)
+
+        self.rubrics = {r.name: r.pk for r in SubRubric.objects.all()}
+        self.authors = {}
+        self.created = self.skipped = self.failed = 0
+        self.touched_rubrics = set()
+        started = time.monotonic()
+
+        records = islice(enumerate(read_records(options['source']), start=1), skip, None)
+        with Pool(max(options['jobs'], 1)) as pool:
+            while True:
+                chunk = list(islice(records, options['chunk_size']))
+                if not chunk:
+                    break
+                self.import_chunk(chunk, pool)
+                if state:
+                    with open(state, 'w') as f:
+                        f.write(str(chunk[-1][0]))
+
+        if self.created:
+            # bulk_create не отправляет post_save: то, что делают обработчики сигналов
+            typeahead.invalidate()
+            recompute_all()
+            build_all()
+            # страницы статей поставлены в очередь публикации вместе с пачками
+            publish.enqueue({publish.NAV, reverse('main:index')}
+                            | {publish.rubric_path(pk) for pk in self.touched_rubrics})
+            edge.purge({edge.INDEX, edge.NAV} | {edge.rubric_key(pk) for pk in self.touched_rubrics})
+
+        self.stdout.write(self.style.SUCCESS(
+            'Создано: %d, пропущено (уже импортированы): %d, с ошибками: %d, за %.1f c' % (
+                self.created, self.skipped, self.failed, time.monotonic() - started)
+        ))
+
+    def resolve_authors(self, names):
+        missing = set(names) - set(self.authors)
+        if missing:
+            self.authors.update(AdvUser.objects.filter(username__in=missing).values_list('username', 'pk'))
+
+    def validate(self, chunk):
+        checked = [(lineno, record, type_errors(record)) for lineno, record in chunk]
+        self.resolve_authors({record.get('author') or self.default_author
+                              for _, record, errors in checked if not errors} - {None})
+        valid = []
+        for lineno, record, errors in checked:
+            if not errors:
+                errors = self.field_errors(record)
+            if errors:
+                self.failed += 1
+                self.stderr.write('Запись %d: %s' % (lineno, '; '.join(errors)))
+            else:
+                valid.append((record_key(record), record))
+        return valid
+
+    def field_errors(self, record):
+        errors = []
+        for name in FIELDS:
+            if not record.get(name):
+                errors.append('не заполнено поле %s' % name)
+        try:
+            for validator in Article._meta.get_field('characters').validators:
+                validator(record.get('characters') or '')
+        except ValidationError:
+            errors.append('неверный формат characters')
+        if len(record.get('title') or '') > Article._meta.get_field('title').max_length:
+            errors.append('слишком длинный title')
+        if parse_active(record.get('is_active')) is None:
+            errors.append('неверное значение is_active %r' % record.get('is_active'))
+        if record.get('rubric') not in self.rubrics:
+            errors.append('неизвестная рубрика %r' % record.get('rubric'))
+        if (record.get('author') or self.default_author) not in self.authors:
+            errors.append('неизвестный автор %r' % (record.get('author') or self.default_author))
+        return errors
+
+    def process_images(self, valid, pool):
+        paths = set()
+        for key, record in valid:
+            if record.get('image'):
+                paths.add(os.path.join(self.images_dir, record['image']))
+            for image in record.get('images') or ():
+                paths.add(os.path.join(self.images_dir, image['file']))
+
+        resized = {}
+        for path, data, error in pool.imap_unordered(process_image, sorted(paths), chunksize=16):
+            if error:
+                self.stderr.write('Изображение %s: %s' % (path, error))
+            else:
+                resized[path] = data
+        return resized
+
+    def import_chunk(self, chunk, pool):
+        valid = self.validate(chunk)
+        existing = set(Article.objects.filter(import_key__in=[key for key, _ in valid])
+                       .values_list('import_key', flat=True))
+        fresh = {}
+        for key, record in valid:
+            if key in existing or key in fresh:
+                self.skipped += 1
+            else:
+                fresh[key] = record
+        if not fresh:
+            return
+
+        resized = self.process_images(fresh.items(), pool)
+        saved = []
+
+        def image_name(name):
+            # хранилище отдаст то же имя для одинаковых файлов и учтет еще одну ссылку
+            # в транзакции пачки
+            data = resized.get(os.path.join(self.images_dir, name)) if name else None
+            if data is None:
+                return ''
+            saved.append(default_storage.save(get_timestamp_path(None, name), ContentFile(data)))
+            return saved[-1]
+
+        try:
+            self.save_chunk(fresh, image_name)
+        except Exception:
+            # ссылки откатились вместе со статьями, файлы без ссылок не нужны
+            default_storage.discard(saved)
+            raise
+        self.created += len(fresh)
+        self.touched_rubrics.update(self.rubrics[record['rubric']] for record in fresh.values())
+
+    def save_chunk(self, fresh, image_name):
+        with transaction.atomic():
+            Article.objects.bulk_create([
+                Article(
+                    import_key=key,
+                    rubric_id=self.rubrics[record['rubric']],
+                    author_id=self.authors[record.get('author') or self.default_author],
+                    title=record['title'],
+                    content=record['content'],
+                    source=record['source'],
+                    characters=record['characters'],
+                    image=image_name(record.get('image')),
+                    is_active=parse_active(record.get('is_active')),
+                ) for key, record in fresh.items()
+            ])
+            # bulk_create не везде возвращает pk, поэтому берем их по ключам
+            pks = dict(Article.objects.filter(import_key__in=fresh).values_list('import_key', 'pk'))
+            publish.enqueue(publish.article_path(self.rubrics[record['rubric']], pks[key])
+                            for key, record in fresh.items() if parse_active(record.get('is_active')))
+            AdditionalImage.objects.bulk_create([
+                AdditionalImage(article_id=pks[key], image=name, caption=image.get('caption', ''))
+                for key, record in fresh.items()
+                for image, name in ((image, image_name(image['file'])) for image in record.get('images') or ())
+                if name
+            ])
@@ -0,0 +1,77 @@
+import time
+from collections import Counter
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Article, AdditionalImage, ArchivedArticle, ArchivedImage, MediaFile
+
+MODELS = (Article, AdditionalImage, ArchivedArticle, ArchivedImage)
+
+
+def is_sharded(name):
+    return name.count('/') >= 2
+
+
+class Command(BaseCommand):
+    help = 'Перенос медиафайлов в хранилище с адресацией по содержимому и пересчет ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Пауза между пачками, с')
+        parser.add_argument('--recount', action='store_true',
+                            help='Только пересчитать ссылки MediaFile по данным в БД '
+                                 '(загрузки во время пересчета могут быть не учтены)')
+
+    def handle(self, *args, **options):
+        if not options['recount']:
+            moved = sum(self.migrate_model(model, options['batch_size'], options['sleep']) for model in MODELS)
+            self.stdout.write('Перенесено файлов: %d' % moved)
+        self.recount()
+
+    def migrate_model(self, model, batch_size, sleep):
+        # сначала новый файл, затем путь в БД, и только потом удаление старого файла:
+        # на любом шаге запись ссылается на существующий файл
+        moved = 0
+        last_pk = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).exclude(image='')
+                        .order_by('pk').values_list('pk', 'image')[:batch_size])
+            if not rows:
+                return moved
+            last_pk = rows[-1][0]
+
+            renamed = []
+            for pk, name in rows:
+                if is_sharded(name):
+                    continue
+                if not default_storage.exists(name):
+                    self.stderr.write('%s %d: нет файла %s' % (model.__name__, pk, name))
+                    continue
+                with default_storage.open(name, 'rb') as f:
+                    new_name = default_storage.save(name, File(f))
+                renamed.append((pk, name, new_name))
+
+            with transaction.atomic():
+                for pk, name, new_name in renamed:
+                    # update() не вызывает сигналы, django_cleanup ничего не удалит
+                    model.objects.filter(pk=pk, image=name).update(image=new_name)
+            for pk, name, new_name in renamed:
+                if not any(m.objects.filter(image=name).exists() for m in MODELS):
+                    # старый файл не учтен в MediaFile, удаляем мимо счетчика ссылок
+                    FileSystemStorage().delete(name)
+            moved += len(renamed)
+            time.sleep(sleep)
+
+    def recount(self):
+        refs = Counter()
+        for model in MODELS:
+            refs.update(name for name in model.objects.exclude(image='').values_list('image', flat=True)
+                        if is_sharded(name))
+        with transaction.atomic():
+            MediaFile.objects.all().delete()
+            MediaFile.objects.bulk_create([MediaFile(name=name, refs=count) for name, count in refs.items()],
+                                          batch_size=500)
+        self.stdout.write(self.style.SUCCESS('Учтено файлов: %d' % len(refs)))
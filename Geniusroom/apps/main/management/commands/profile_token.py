@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import AdvUser
+from ...profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Токен для профилирования запросов (заголовок X-Profile или ?profile=)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        user = AdvUser.objects.filter(username=options['username'], is_staff=True).first()
+        if user is None:
+            raise CommandError('Нет сотрудника с именем %s' % options['username'])
+        self.stdout.write(make_token(user))
@@ -0,0 +1,28 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...publish import all_paths, publish, publish_pending
+
+
+class Command(BaseCommand):
+    help = 'Публикация страниц в PUBLISH_ROOT: всех или поставленных в очередь изменениями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Перерисовать все страницы')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['all']:
+            paths = list(all_paths())
+            count, failed = len(paths), publish(paths, options['processes'])
+        else:
+            count, failed = publish_pending(options['processes'])
+        for path, error in failed:
+            self.stderr.write('%s: %s' % (path, error))
+        if failed:
+            raise CommandError('Не опубликовано страниц: %d' % len(failed))
+        self.stdout.write(self.style.SUCCESS(
+            'Опубликовано путей: %d за %.1f c' % (count, time.monotonic() - started)))
@@ -0,0 +1,74 @@
+import os
+import time
+from datetime import timedelta
+
+from captcha.models import CaptchaStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import AdvUser
+from ...uploads import stale_parts
+
+
+class Command(BaseCommand):
+    help = ('Удаление неактивированных пользователей, истекших сессий и капч небольшими пачками, '
+            'а также брошенных загрузок по частям')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--unactivated-days', type=int, default=30,
+                            help='Пользователи, не прошедшие активацию за столько дней')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Пауза между пачками, с')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def purge(self, name, queryset, batch_size, sleep):
+        # пачка - диапазон первичного ключа: каждый DELETE короткий и блокирует
+        # немного строк, а пауза дает догнать реплике и остальным запросам
+        deleted = 0
+        last = None
+        while True:
+            keys = queryset.order_by('pk')
+            if last is not None:
+                keys = keys.filter(pk__gt=last)
+            keys = list(keys.values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                break
+            last = keys[-1]
+            started = time.monotonic()
+            # условие повторяется: строка, переставшая быть устаревшей, не удаляется
+            _, counts = queryset.filter(pk__gte=keys[0], pk__lte=last).delete()
+            count = counts.get(queryset.model._meta.label, 0)
+            deleted += count
+            if self.verbosity >= 2:
+                self.stdout.write('%s: удалено %d за %.1f мс' % (name, count, (time.monotonic() - started) * 1000))
+            time.sleep(sleep)
+        return deleted
+
+    def handle(self, *args, **options):
+        if options['unactivated_days'] <= 0 or options['batch_size'] <= 0:
+            raise CommandError('--unactivated-days и --batch-size должны быть положительными')
+        self.verbosity = options['verbosity']
+        now = timezone.now()
+        targets = (
+            ('users', AdvUser.objects.filter(is_activated=False, is_active=False, is_staff=False,
+                                             date_joined__lt=now - timedelta(days=options['unactivated_days']))),
+            ('sessions', Session.objects.filter(expire_date__lt=now)),
+            ('captchas', CaptchaStore.objects.filter(expiration__lt=now)),
+        )
+        for name, queryset in targets:
+            if options['dry_run']:
+                self.stdout.write('%s: к удалению %d' % (name, queryset.count()))
+                continue
+            started = time.monotonic()
+            deleted = self.purge(name, queryset, options['batch_size'], options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                '%s: удалено %d за %.1f c' % (name, deleted, time.monotonic() - started)))
+
+        parts = stale_parts(time.time())
+        if options['dry_run']:
+            self.stdout.write('uploads: к удалению %d' % len(parts))
+            return
+        for path in parts:
+            os.remove(path)
+        self.stdout.write(self.style.SUCCESS('uploads: удалено %d' % len(parts)))
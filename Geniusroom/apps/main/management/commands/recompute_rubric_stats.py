@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...stats import recompute_all
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчет статистики рубрик (число статей, последняя статья)'
+
+    def handle(self, *args, **options):
+        recompute_all()
+        self.stdout.write(self.style.SUCCESS('Статистика рубрик пересчитана'))
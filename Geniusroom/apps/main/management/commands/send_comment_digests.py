@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...digests import send_digests
+
+
+class Command(BaseCommand):
+    help = 'Отправка авторам сводок новых комментариев к их статьям (по cron, например раз в минуту)'
+
+    def handle(self, *args, **options):
+        sent = send_digests()
+        self.stdout.write(self.style.SUCCESS('Отправлено сводок: %d' % sent))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...related import update_related
+
+
+class Command(BaseCommand):
+    help = 'Пересчет похожих статей для измененных (или всех) статей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Пересчитать все статьи')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-seconds', type=float,
+                            help='Ограничение времени; необработанные статьи останутся на следующий запуск')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        done = update_related(full=options['all'], batch_size=options['batch_size'],
+                              max_seconds=options['max_seconds'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            'Пересчитано статей: %d за %.1f c' % (done, time.monotonic() - started)))
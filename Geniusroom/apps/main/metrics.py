@@ -0,0 +1,211 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+# верхние границы корзин гистограмм, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TYPES = {
+    'http_requests_total': 'counter',
+    'http_request_duration_seconds': 'histogram',
+    'db_queries_total': 'counter',
+    'db_query_duration_seconds_total': 'counter',
+    'cache_requests_total': 'counter',
+    'thumbnail_duration_seconds': 'histogram',
+    'http_requests_shed_total': 'counter',
+    'article_views_flushed_total': 'counter',
+    'comment_digests_sent_total': 'counter',
+    'comment_digest_comments_total': 'counter',
+}
+# значения, которые считаются в момент запроса метрик: имя -> функция без аргументов
+gauges = {}
+# посчитанные значения gauges живут в общем кэше столько секунд: COUNT по
+# большим таблицам не выполняется на каждый опрос каждого воркера
+GAUGE_TIMEOUT = 15
+
+lock = threading.Lock()
+local = threading.local()
+
+
+class MmapedDict:
+    """Словарь ключ -> float в файле, отображенном в память.
+
+    Каждый процесс пишет только в свой файл, поэтому блокировки между
+    воркерами не нужны; /metrics складывает файлы всех процессов.
+    Формат: int занятый размер, затем записи
+    (int длина ключа, ключ с выравниванием до 8 байт, double значение).
+    """
+
+    def __init__(self, path, size=1 << 16):
+        self.f = open(path, 'a+b')
+        if os.fstat(self.f.fileno()).st_size == 0:
+            self.f.truncate(size)
+        self.capacity = os.fstat(self.f.fileno()).st_size
+        self.m = mmap.mmap(self.f.fileno(), self.capacity)
+        self.positions = {}
+        self.used = struct.unpack_from('i', self.m, 0)[0]
+        if self.used == 0:
+            self.used = 8
+            struct.pack_into('i', self.m, 0, self.used)
+        for key, _, pos in self.entries(self.m, self.used):
+            self.positions[key] = pos
+
+    @staticmethod
+    def entries(data, used):
+        pos = 8
+        while pos < used:
+            length = struct.unpack_from('i', data, pos)[0]
+            key = bytes(data[pos + 4:pos + 4 + length]).decode('utf-8')
+            pos += 4 + length + (8 - (length + 4) % 8)
+            yield key, struct.unpack_from('d', data, pos)[0], pos
+            pos += 8
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < 8:
+            return
+        yield from ((key, value) for key, value, _ in cls.entries(data, struct.unpack_from('i', data, 0)[0]))
+
+    def position(self, key):
+        encoded = key.encode('utf-8')
+        padded = encoded + b' ' * (8 - (len(encoded) + 4) % 8)
+        entry = struct.pack('i%dsd' % len(padded), len(encoded), padded, 0.0)
+        while self.used + len(entry) > self.capacity:
+            self.m.close()
+            self.capacity *= 2
+            self.f.truncate(self.capacity)
+            self.m = mmap.mmap(self.f.fileno(), self.capacity)
+        self.m[self.used:self.used + len(entry)] = entry
+        self.used += len(entry)
+        struct.pack_into('i', self.m, 0, self.used)
+        self.positions[key] = self.used - 8
+        return self.used - 8
+
+    def inc(self, key, amount):
+        pos = self.positions.get(key)
+        if pos is None:
+            pos = self.position(key)
+        struct.pack_into('d', self.m, pos, struct.unpack_from('d', self.m, pos)[0] + amount)
+
+
+values = None
+values_pid = None
+
+
+def get_values():
+    # после fork у воркера свой файл
+    global values, values_pid
+    if values_pid != os.getpid():
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        values = MmapedDict(os.path.join(settings.METRICS_DIR, '%d.db' % os.getpid()))
+        values_pid = os.getpid()
+    return values
+
+
+def series(name, labels):
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in sorted(labels.items())))
+
+
+def inc(name, amount=1, **labels):
+    with lock:
+        get_values().inc(series(name, labels), amount)
+
+
+def observe(name, seconds, **labels):
+    with lock:
+        store = get_values()
+        for bound in BUCKETS:
+            if seconds <= bound:
+                store.inc(series(name + '_bucket', dict(labels, le=bound)), 1)
+        store.inc(series(name + '_bucket', dict(labels, le='+Inf')), 1)
+        store.inc(series(name + '_sum', labels), seconds)
+        store.inc(series(name + '_count', labels), 1)
+
+
+def collect():
+    totals = defaultdict(float)
+    if os.path.isdir(settings.METRICS_DIR):
+        for name in os.listdir(settings.METRICS_DIR):
+            if name.endswith('.db'):
+                for key, value in MmapedDict.read(os.path.join(settings.METRICS_DIR, name)):
+                    totals[key] += value
+    return totals
+
+
+def render():
+    """Метрики всех процессов в текстовом формате Prometheus."""
+    lines = []
+    families = defaultdict(list)
+    for key, value in collect().items():
+        families[key.split('{')[0]].append((key, value))
+    for name, kind in TYPES.items():
+        rows = families.get(name, []) + families.get(name + '_bucket', []) + \
+               families.get(name + '_sum', []) + families.get(name + '_count', [])
+        if rows:
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend('%s %r' % (key, value) for key, value in sorted(rows))
+    for name, value in gauge_values().items():
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %r' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def gauge_values():
+    keys = {name: 'metrics:gauge:%s' % name for name in gauges}
+    values = cache.get_many(list(keys.values()))
+    fresh = {key: float(gauges[name]()) for name, key in keys.items() if key not in values}
+    if fresh:
+        cache.set_many(fresh, GAUGE_TIMEOUT)
+        values.update(fresh)
+    return {name: values[key] for name, key in keys.items()}
+
+
+class MetricsMiddleware:
+    """Время ответа и коды по имени маршрута, число и время запросов к БД."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db = {'count': 0, 'time': 0.0}
+
+        def count_queries(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db['count'] += 1
+                db['time'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        observe('http_request_duration_seconds', time.perf_counter() - started, route=route)
+        inc('http_requests_total', route=route, status=response.status_code)
+        inc('db_queries_total', db['count'], route=route)
+        inc('db_query_duration_seconds_total', db['time'], route=route)
+        return response
+
+
+def thumbnail_started(im, **kwargs):
+    # первый и последний обработчики THUMBNAIL_PROCESSORS: время построения миниатюры
+    local.thumbnail_started = time.perf_counter()
+    return im
+
+
+def thumbnail_finished(im, **kwargs):
+    started = getattr(local, 'thumbnail_started', None)
+    if started is not None:
+        observe('thumbnail_duration_seconds', time.perf_counter() - started)
+        local.thumbnail_started = None
+    return im
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-19 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_additionalimage_caption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='import_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Ключ импорта'),
+        ),
+        migrations.AlterField(
+            model_name='additionalimage',
+            name='caption',
+            field=models.CharField(blank=True, default='', max_length=200, null=True, verbose_name='Подпись'),
+        ),
+    ]
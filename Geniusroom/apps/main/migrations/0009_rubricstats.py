@@ -0,0 +1,27 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_mediafile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RubricStats',
+            fields=[
+                ('rubric', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='main.rubric', verbose_name='Рубрика')),
+                ('active_count', models.PositiveIntegerField(default=0, verbose_name='Статей')),
+                ('latest_created_at', models.DateTimeField(blank=True, null=True, verbose_name='Последняя статья опубликована')),
+                ('latest_article', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.article', verbose_name='Последняя статья')),
+            ],
+            options={
+                'verbose_name': 'Статистика рубрики',
+                'verbose_name_plural': 'Статистика рубрик',
+            },
+        ),
+    ]
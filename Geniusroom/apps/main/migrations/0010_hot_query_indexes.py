@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_rubricstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Показывать в списке'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Показывать'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='article_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', '-created_at'], name='article_rubric_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['author', '-created_at'], name='article_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['article', 'created_at'], name='comment_article_created_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishTarget',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(db_index=True, max_length=255, verbose_name='Путь')),
+            ],
+            options={
+                'verbose_name': 'Страница к публикации',
+                'verbose_name_plural': 'Страницы к публикации',
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PATH_STEP = 7
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    # копия models.path_segment на момент миграции
+    digits = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = PATH_DIGITS[digit] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+
+def fill_paths(apps, schema_editor):
+    # все существующие комментарии становятся корнями веток
+    Comment = apps.get_model('main', 'Comment')
+    batch = []
+    for comment in Comment.objects.only('pk').iterator(chunk_size=2000):
+        comment.path = path_segment(comment.pk)
+        batch.append(comment)
+        if len(batch) == 2000:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_publishtarget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='main.comment', verbose_name='Ответ на'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=63, verbose_name='Путь'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['article', 'path'], name='comment_article_path_idx'),
+        ),
+        # detail читает ветки по comment_article_path_idx
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_article_created_idx',
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_comment_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedArticle',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=40, verbose_name='Название статьи')),
+                ('content', models.TextField(verbose_name='Текст статьи')),
+                ('source', models.TextField(verbose_name='Источник')),
+                ('characters', models.TextField(verbose_name='Упоминаются')),
+                ('image', models.ImageField(blank=True, upload_to='', verbose_name='Основная иллюстрация')),
+                ('is_active', models.BooleanField(verbose_name='Показывать в списке')),
+                ('created_at', models.DateTimeField(verbose_name='Опубликовано')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Перенесено в архив')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('rubric', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.subrubric', verbose_name='Подрубрика')),
+            ],
+            options={
+                'verbose_name': 'Архивная статья',
+                'verbose_name_plural': 'Архивные статьи',
+            },
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='main.comment', verbose_name='Ответ на'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='', verbose_name='Изображение')),
+                ('caption', models.CharField(blank=True, default='', max_length=200, null=True, verbose_name='Подпись')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.archivedarticle', verbose_name='Статья')),
+            ],
+            options={
+                'verbose_name': 'Архивная иллюстрация',
+                'verbose_name_plural': 'Архивные иллюстрации',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedComment',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('parent_id', models.IntegerField(blank=True, null=True, verbose_name='Ответ на')),
+                ('path', models.CharField(max_length=63, verbose_name='Путь')),
+                ('author', models.CharField(max_length=30, verbose_name='Имя автора')),
+                ('content', models.TextField(verbose_name='Содержание')),
+                ('is_active', models.BooleanField(verbose_name='Показывать')),
+                ('created_at', models.DateTimeField(verbose_name='Дата публикации')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.archivedarticle', verbose_name='Статья')),
+            ],
+            options={
+                'verbose_name': 'Архивный комментарий',
+                'verbose_name_plural': 'Архивные комментарии',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedcomment',
+            index=models.Index(fields=['article', 'path'], name='main_archiv_article_779663_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+from datetime import date
+
+from django.db import migrations
+
+# копии partitions.py на момент миграции: последующие правки модуля
+# не должны менять то, что делает уже примененная миграция
+TABLE = 'main_comment'
+
+
+def month_start(day, shift=0):
+    month = day.year * 12 + day.month - 1 + shift
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return '%s_p%04d%02d' % (TABLE, month.year, month.month)
+
+
+def create_partition(cursor, month):
+    cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)'
+                   % (partition_name(month), TABLE), [month, month_start(month, 1)])
+
+
+def table_definition(cursor):
+    cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s",
+                   [TABLE, '%_pkey'])
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+    """, [TABLE])
+    return indexes, cursor.fetchall()
+
+
+def rebuild(cursor, partitioned):
+    """Пересоздает main_comment секционированной (или обычной) с теми же данными,
+    индексами и внешними ключами."""
+    indexes, foreign_keys = table_definition(cursor)
+    cursor.execute('ALTER TABLE %s RENAME TO %s_old' % (TABLE, TABLE))
+    if partitioned:
+        cursor.execute('CREATE TABLE %s (LIKE %s_old INCLUDING DEFAULTS, PRIMARY KEY (id, created_at)) '
+                       'PARTITION BY RANGE (created_at)' % (TABLE, TABLE))
+        cursor.execute('CREATE TABLE %s_default PARTITION OF %s DEFAULT' % (TABLE, TABLE))
+        cursor.execute('SELECT min(created_at) FROM %s_old' % TABLE)
+        first = cursor.fetchone()[0]
+        month = month_start(first or date.today())
+        while month <= month_start(date.today(), 3):
+            create_partition(cursor, month)
+            month = month_start(month, 1)
+    else:
+        cursor.execute('CREATE TABLE %s (LIKE %s_old INCLUDING DEFAULTS, PRIMARY KEY (id))' % (TABLE, TABLE))
+    cursor.execute('INSERT INTO %s SELECT * FROM %s_old' % (TABLE, TABLE))
+    cursor.execute("ALTER SEQUENCE %s_id_seq OWNED BY %s.id" % (TABLE, TABLE))
+    cursor.execute('DROP TABLE %s_old CASCADE' % TABLE)
+    for sql in indexes:
+        cursor.execute(sql)
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (TABLE, name, definition))
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild(schema_editor.connection.cursor(), partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild(schema_editor.connection.cursor(), partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
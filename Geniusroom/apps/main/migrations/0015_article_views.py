@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_partition_comments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedarticle',
+            name='views',
+            field=models.PositiveIntegerField(default=0, verbose_name='Просмотров'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='views',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Просмотров'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+import math
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def bump(rank, now):
+    # копия trending.bump на момент миграции
+    current = now.timestamp() / settings.TRENDING_HALF_LIFE
+    if rank is None:
+        return current
+    return current + math.log2(2 ** (rank - current) + 1)
+
+
+def fill_ranks(apps, schema_editor):
+    # ранги по комментариям, которые еще не остыли
+    Comment = apps.get_model('main', 'Comment')
+    TrendingArticle = apps.get_model('main', 'TrendingArticle')
+    since = timezone.now() - timedelta(
+        seconds=settings.TRENDING_HALF_LIFE * -math.log2(settings.TRENDING_MIN_SCORE))
+    ranks = {}
+    for article_id, created_at in Comment.objects.filter(created_at__gte=since) \
+            .order_by('created_at').values_list('article_id', 'created_at').iterator():
+        ranks[article_id] = bump(ranks.get(article_id), created_at)
+    TrendingArticle.objects.bulk_create([TrendingArticle(article_id=pk, rank=rank) for pk, rank in ranks.items()],
+                                        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_article_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingArticle',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='main.article', verbose_name='Статья')),
+                ('rank', models.FloatField(db_index=True, verbose_name='Ранг')),
+            ],
+            options={
+                'verbose_name': 'Обсуждаемая статья',
+                'verbose_name_plural': 'Обсуждаемые статьи',
+            },
+        ),
+        migrations.RunPython(fill_ranks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_trendingarticle'),
+    ]
+
+    operations = [
+        # у существующих пользователей остаются отдельные письма, сводка - выбор по умолчанию для новых
+        migrations.AddField(
+            model_name='advuser',
+            name='comment_digest',
+            field=models.BooleanField(default=False, verbose_name='Присылать комментарии сводкой'),
+        ),
+        migrations.AlterField(
+            model_name='advuser',
+            name='comment_digest',
+            field=models.BooleanField(default=True, verbose_name='Присылать комментарии сводкой'),
+        ),
+        migrations.AddField(
+            model_name='advuser',
+            name='digest_sent_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Сводка отправлена'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_advuser_comment_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedTarget',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Файл')),
+            ],
+            options={
+                'verbose_name': 'Лента к обновлению',
+                'verbose_name_plural': 'Ленты к обновлению',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.3 on 2026-10-19 18:10
+
+from django.db import migrations
+
+
+def fill_stats(apps, schema_editor):
+    # то же, что stats.recompute_all, на исторических моделях
+    Article = apps.get_model('main', 'Article')
+    Rubric = apps.get_model('main', 'Rubric')
+    RubricStats = apps.get_model('main', 'RubricStats')
+    rows = {}
+    for rubric in Rubric.objects.filter(super_rubric__isnull=False):
+        active = Article.objects.filter(rubric=rubric.pk, is_active=True)
+        latest = active.order_by('-created_at').values_list('pk', 'created_at').first()
+        rows[rubric.pk] = RubricStats(rubric_id=rubric.pk, active_count=active.count(),
+                                      latest_article_id=latest[0] if latest else None,
+                                      latest_created_at=latest[1] if latest else None)
+        parent = rows.setdefault(rubric.super_rubric_id, RubricStats(rubric_id=rubric.super_rubric_id))
+        parent.active_count += rows[rubric.pk].active_count
+        if latest and (parent.latest_created_at is None or latest[1] > parent.latest_created_at):
+            parent.latest_article_id, parent.latest_created_at = latest
+    # надрубрики без подрубрик тоже получают строку
+    for pk in Rubric.objects.filter(super_rubric__isnull=True).values_list('pk', flat=True):
+        rows.setdefault(pk, RubricStats(rubric_id=pk))
+    RubricStats.objects.all().delete()
+    RubricStats.objects.bulk_create(rows.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_feedtarget'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from enum import unique
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
 from django.db.models.constraints import Deferrable
 from django.db.models.fields import TextField
@@ -7,12 +8,17 @@ from django.db.models.fields.related import ForeignKey
 from .utilities import get_timestamp_path, send_new_comment_notification
 from django.db.models.signals import post_save
 from django.core import validators
+from django.utils import timezone
 
 
 class AdvUser(AbstractUser):
     # by default: ('username', 'email', 'first_name', 'last_name')
     is_activated = models.BooleanField(default=True, db_index=True, verbose_name='Прошел активацию')
     send_messages = models.BooleanField(default=True, verbose_name='Подписаться на уведомления')
+    # уведомления о комментариях одним письмом раз в COMMENT_DIGEST_INTERVAL (digests.py)
+    comment_digest = models.BooleanField(default=True, verbose_name='Присылать комментарии сводкой')
+    # комментарии до этого момента уже попали в сводку
+    digest_sent_at = models.DateTimeField(default=timezone.now, editable=False, verbose_name='Сводка отправлена')
 
     def delete(self, *args, **kwargs):
         for article in self.article_set.all():
@@ -23,6 +29,34 @@ class AdvUser(AbstractUser):
         pass
 
 
+class MediaFile(models.Model):
+    # число записей, ссылающихся на файл в хранилище с дедупликацией (storage.py)
+    name = models.CharField(max_length=100, primary_key=True, verbose_name='Файл')
+    refs = models.PositiveIntegerField(default=0, verbose_name='Ссылок')
+
+    class Meta:
+        verbose_name = 'Медиафайл'
+        verbose_name_plural = 'Медиафайлы'
+
+
+class PublishTarget(models.Model):
+    # очередь путей, которые manage.py publish должен перерисовать (publish.py)
+    path = models.CharField(max_length=255, db_index=True, verbose_name='Путь')
+
+    class Meta:
+        verbose_name = 'Страница к публикации'
+        verbose_name_plural = 'Страницы к публикации'
+
+
+class FeedTarget(models.Model):
+    # файлы sitemap и лент, которые manage.py build_feeds --pending должен переписать (feeds.py)
+    name = models.CharField(max_length=50, unique=True, verbose_name='Файл')
+
+    class Meta:
+        verbose_name = 'Лента к обновлению'
+        verbose_name_plural = 'Ленты к обновлению'
+
+
 # использование прокси-моделей. Таблица в бд создается одна - только для Rubric
 class Rubric(models.Model):
     name = models.CharField(max_length=20, db_index=True, unique=True, verbose_name='Название')
@@ -80,8 +114,37 @@ class Article(models.Model):
                                   })
     image = models.ImageField(blank=True, upload_to=get_timestamp_path, verbose_name='Основная иллюстрация')
     author = ForeignKey(AdvUser, on_delete=models.CASCADE, verbose_name='Автор')
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Показывать в списке')
+    is_active = models.BooleanField(default=True, verbose_name='Показывать в списке')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликовано')
+    # ключ идемпотентности для массового импорта (manage.py import_articles)
+    import_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False,
+                                  verbose_name='Ключ импорта')
+    # похожие статьи нужно пересчитать (manage.py update_related)
+    related_stale = models.BooleanField(default=True, db_index=True, editable=False,
+                                        verbose_name='Пересчитать похожие')
+    # пишет только counters.flush пачками UPDATE
+    views = models.PositiveIntegerField(default=0, editable=False, verbose_name='Просмотров')
+
+    # прежние рубрика, видимость и дата для сигналов (stats.remember_state)
+    STATE_FIELDS = ('rubric_id', 'is_active', 'created_at')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # загруженные значения запоминаются, чтобы при сохранении не перечитывать их из БД
+        if all(name in instance.__dict__ for name in cls.STATE_FIELDS):
+            instance._loaded_state = tuple(instance.__dict__[name] for name in cls.STATE_FIELDS)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # ссылка на загруженный файл (storage.py) учитывается в той же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def save_keeping_views(self):
+        # для правки загруженной раньше статьи (форма автора, админка): просмотры,
+        # накопленные с тех пор counters.flush, не затираются
+        self.save(update_fields=[f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'views'])
 
     def delete(self, *args, **kwargs):
         for ai in self.additionalimage_set.all():
@@ -93,6 +156,38 @@ class Article(models.Model):
         verbose_name_plural = 'Статьи'
         ordering = ['-created_at']
         get_latest_by = 'created_at'
+        # под горячие запросы: главная, by_rubric, profile (см. QueryPlanTest)
+        indexes = [
+            models.Index(fields=['-created_at'], condition=Q(is_active=True), name='article_active_created_idx'),
+            models.Index(fields=['rubric', '-created_at'], condition=Q(is_active=True),
+                         name='article_rubric_created_idx'),
+            models.Index(fields=['author', '-created_at'], name='article_author_created_idx'),
+        ]
+
+
+class TrendingArticle(models.Model):
+    # ранг в блоке "Обсуждают сейчас", поддерживается trending.py
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='trending',
+                                   verbose_name='Статья')
+    rank = models.FloatField(db_index=True, verbose_name='Ранг')
+
+    class Meta:
+        verbose_name = 'Обсуждаемая статья'
+        verbose_name_plural = 'Обсуждаемые статьи'
+
+
+class RubricStats(models.Model):
+    # материализованная статистика по рубрике, поддерживается stats.py
+    rubric = models.OneToOneField(Rubric, on_delete=models.CASCADE, primary_key=True, related_name='stats',
+                                  verbose_name='Рубрика')
+    active_count = models.PositiveIntegerField(default=0, verbose_name='Статей')
+    latest_created_at = models.DateTimeField(null=True, blank=True, verbose_name='Последняя статья опубликована')
+    latest_article = models.ForeignKey(Article, on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='+', verbose_name='Последняя статья')
+
+    class Meta:
+        verbose_name = 'Статистика рубрики'
+        verbose_name_plural = 'Статистика рубрик'
 
 
 class AdditionalImage(models.Model):
@@ -100,27 +195,195 @@ class AdditionalImage(models.Model):
     image = models.ImageField(upload_to=get_timestamp_path, verbose_name='Изображение')
     caption = models.CharField(max_length=200, null=True, blank=True, default="", verbose_name='Подпись')
 
+    def save(self, *args, **kwargs):
+        # как Article.save: ссылка на файл откатывается вместе с записью
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Дополнительная иллюстрация'
         verbose_name_plural = 'Дополнительные иллюстрации'
 
 
+class RelatedArticle(models.Model):
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='related_set',
+                                verbose_name='Статья')
+    related = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='+',
+                                verbose_name='Похожая статья')
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожая статья'
+        verbose_name_plural = 'Похожие статьи'
+        ordering = ['-score']
+        indexes = [models.Index(fields=['article', '-score'])]
+
+
+# материализованный путь комментария: id всех предков и свой, каждый - PATH_STEP
+# символов base36 с ведущими нулями. Сортировка по path дает порядок обхода дерева,
+# а поддерево - это диапазон path от пути корня до пути его следующего соседа.
+# Только цифры и строчные латинские буквы: порядок одинаков в любой сортировке БД
+PATH_STEP = 7
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+MAX_COMMENT_DEPTH = 8
+
+
+def path_segment(pk):
+    digits = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = PATH_DIGITS[digit] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+
+def next_id(model, using):
+    """id новой строки до вставки, из того же счетчика, что и автоинкремент."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [table])
+        else:
+            # AUTOINCREMENT SQLite не выдает id повторно (архив хранит комментарии с прежними
+            # id), а вставка явного id сдвигает sqlite_sequence; запись в транзакции уже
+            # заблокирована BEGIN IMMEDIATE (sqlite/base.py)
+            cursor.execute('SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = %%s), 0), '
+                           'COALESCE((SELECT MAX(id) FROM %s), 0)) + 1' % table, [table])
+        return cursor.fetchone()[0]
+
+
+def subtree_end(path):
+    return path[:-PATH_STEP] + path_segment(int(path[-PATH_STEP:], 36) + 1)
+
+
+def visible_tree(comments, root_depth=0):
+    """Отбрасывает ответы на скрытые комментарии.
+
+    comments - активные комментарии в порядке path: родитель всегда раньше
+    ответов, поэтому хватает одного прохода. Скрытие комментария (is_active)
+    прячет все поддерево, не трогая остальные строки.
+    """
+    shown = set()
+    result = []
+    for comment in comments:
+        if comment.depth == root_depth or comment.path[:-PATH_STEP] in shown:
+            shown.add(comment.path)
+            result.append(comment)
+    return result
+
+
+class CommentManager(models.Manager):
+    def thread(self, article, root_path):
+        # ветка целиком одним запросом по диапазону индекса (article, path)
+        return visible_tree(self.filter(article=article, is_active=True, path__gte=root_path,
+                                        path__lt=subtree_end(root_path)).order_by('path'),
+                            len(root_path) // PATH_STEP - 1)
+
+    def threads(self, article, start=0, count=None):
+        """Страница веток: корни по порядку и все ответы на них."""
+        roots = self.filter(article=article, is_active=True, parent=None).order_by('path') \
+            .values_list('path', flat=True)
+        roots = list(roots[start:start + count] if count else roots[start:])
+        if not roots:
+            return []
+        return visible_tree(self.filter(article=article, is_active=True, path__gte=roots[0],
+                                        path__lt=subtree_end(roots[-1])).order_by('path'))
+
+
 class Comment(models.Model):
     article = models.ForeignKey(Article, on_delete=models.CASCADE, verbose_name='Статья')
+    # на PostgreSQL таблица секционирована по created_at (partitions.py), а внешний ключ
+    # может ссылаться только на уникальный столбец - id уникален лишь вместе с created_at
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies',
+                               db_constraint=False, verbose_name='Ответ на')
+    path = models.CharField(max_length=PATH_STEP * (MAX_COMMENT_DEPTH + 1), default='', editable=False,
+                            verbose_name='Путь')
     author = models.CharField(max_length=30, verbose_name='Имя автора')
     content = models.TextField(verbose_name='Содержание')
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Показывать')
+    is_active = models.BooleanField(default=True, verbose_name='Показывать')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата публикации')
 
+    objects = CommentManager()
+
+    @property
+    def depth(self):
+        return len(self.path) // PATH_STEP - 1
+
+    def save(self, *args, **kwargs):
+        # путь содержит собственный id: id берется до вставки, и строка
+        # (а с ней обработчики post_save) сразу получает готовый путь
+        using = kwargs.get('using') or router.db_for_write(Comment, instance=self)
+        with transaction.atomic(using=using):
+            if self._state.adding and not self.path:
+                if self.pk is None:
+                    self.pk = next_id(Comment, using)
+                    kwargs['force_insert'] = True
+                self.path = (self.parent.path if self.parent_id else '') + path_segment(self.pk)
+            super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['article', 'path'], condition=Q(is_active=True),
+                         name='comment_article_path_idx'),
+        ]
+
+
+# архив (manage.py archive_articles): статьи и их комментарии переносятся
+# сюда с теми же id и остаются доступными через detail
+class ArchivedArticle(models.Model):
+    id = models.IntegerField(primary_key=True)
+    rubric = models.ForeignKey(SubRubric, on_delete=models.PROTECT, verbose_name='Подрубрика')
+    title = models.CharField(max_length=40, verbose_name='Название статьи')
+    content = models.TextField(verbose_name='Текст статьи')
+    source = models.TextField(verbose_name='Источник')
+    characters = models.TextField(verbose_name='Упоминаются')
+    image = models.ImageField(blank=True, verbose_name='Основная иллюстрация')
+    author = ForeignKey(AdvUser, on_delete=models.CASCADE, verbose_name='Автор')
+    is_active = models.BooleanField(verbose_name='Показывать в списке')
+    created_at = models.DateTimeField(verbose_name='Опубликовано')
+    views = models.PositiveIntegerField(default=0, verbose_name='Просмотров')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Перенесено в архив')
+
+    class Meta:
+        verbose_name = 'Архивная статья'
+        verbose_name_plural = 'Архивные статьи'
+
+
+class ArchivedImage(models.Model):
+    article = models.ForeignKey(ArchivedArticle, on_delete=models.CASCADE, verbose_name='Статья')
+    image = models.ImageField(verbose_name='Изображение')
+    caption = models.CharField(max_length=200, null=True, blank=True, default='', verbose_name='Подпись')
+
+    class Meta:
+        verbose_name = 'Архивная иллюстрация'
+        verbose_name_plural = 'Архивные иллюстрации'
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    article = models.ForeignKey(ArchivedArticle, on_delete=models.CASCADE, verbose_name='Статья')
+    parent_id = models.IntegerField(null=True, blank=True, verbose_name='Ответ на')
+    path = models.CharField(max_length=PATH_STEP * (MAX_COMMENT_DEPTH + 1), verbose_name='Путь')
+    author = models.CharField(max_length=30, verbose_name='Имя автора')
+    content = models.TextField(verbose_name='Содержание')
+    is_active = models.BooleanField(verbose_name='Показывать')
+    created_at = models.DateTimeField(verbose_name='Дата публикации')
+
+    depth = Comment.depth
+
+    class Meta:
+        verbose_name = 'Архивный комментарий'
+        verbose_name_plural = 'Архивные комментарии'
+        indexes = [models.Index(fields=['article', 'path'])]
 
 
 def post_save_dispatcher(sender, **kwargs):
-    author = kwargs['instance'].article.author
-    if kwargs['created'] and author.send_messages:
+    # авторам со сводкой (digests.py) письмо уйдет позже, здесь - один запрос
+    if kwargs['created'] and AdvUser.objects.filter(article=kwargs['instance'].article_id, send_messages=True,
+                                                    comment_digest=False).exists():
         send_new_comment_notification(kwargs['instance'])
 
 
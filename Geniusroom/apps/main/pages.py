@@ -0,0 +1,57 @@
+"""Статические страницы (other_page).
+
+Имя из адреса ищется только в PAGES: шаблоны загружаются один раз при
+прогреве (warmup.py), готовая страница хранится в кэше с ETag по содержимому,
+а неизвестное имя сразу получает 404 без поиска шаблона. Страница рисуется
+без пользовательских данных (как для publish.py), поэтому одна копия годится
+всем; меню рубрик в ней обновляется со сменой версии данных api.content_version.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotModified
+from django.template.loader import get_template, render_to_string
+
+from . import metrics
+from .api import content_version
+
+# имя в адресе -> шаблон
+PAGES = {
+    'about': 'main/about.html',
+}
+
+templates = {}
+not_found = {}
+
+
+def load():
+    for name, template_name in PAGES.items():
+        templates[name] = get_template(template_name)
+    not_found['content'] = render_to_string('404.html')
+
+
+def not_found_response():
+    if not not_found:
+        load()
+    return HttpResponseNotFound(not_found['content'])
+
+
+def page_response(request, name):
+    if not templates:
+        load()
+    key = 'page:%s:%s' % (name, content_version())
+    cached = cache.get(key)
+    metrics.inc('cache_requests_total', cache='pages', result='miss' if cached is None else 'hit')
+    if cached is None:
+        request.shared_page = True
+        content = templates[name].render(request=request).encode()
+        cached = ('"%s"' % hashlib.md5(content).hexdigest(), content)
+        cache.set(key, cached, settings.PAGE_CACHE_TIMEOUT)
+    etag, content = cached
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content)
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,54 @@
+"""Секционирование main_comment по месяцам created_at (только PostgreSQL).
+
+Первичный ключ секционированной таблицы обязан включать ключ секционирования,
+поэтому он становится (id, created_at); Django по-прежнему работает с id.
+Новые секции создает и старые отсоединяет manage.py comment_partitions.
+"""
+from datetime import date
+
+TABLE = 'main_comment'
+
+
+def month_start(day, shift=0):
+    month = day.year * 12 + day.month - 1 + shift
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return '%s_p%04d%02d' % (TABLE, month.year, month.month)
+
+
+def is_partitioned(cursor):
+    cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+    return cursor.fetchone() is not None
+
+
+def partitions(cursor):
+    """Секции по месяцам: [(имя, первое число месяца)], без секции по умолчанию."""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass ORDER BY c.relname
+    """, [TABLE])
+    result = []
+    for name, in cursor.fetchall():
+        suffix = name[len(TABLE) + 2:]
+        if name.startswith(TABLE + '_p') and suffix.isdigit() and len(suffix) == 6:
+            result.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+    return result
+
+
+def create_partition(cursor, month):
+    # заранее: строки, попавшие в секцию по умолчанию, не дадут создать секцию их месяца
+    cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)'
+                   % (partition_name(month), TABLE), [month, month_start(month, 1)])
+
+
+def detach_partition(cursor, name, drop_empty=True):
+    """Отсоединяет секцию; пустая удаляется, непустая остается отдельной таблицей для выгрузки."""
+    cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (TABLE, name))
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM %s)' % name)
+    if drop_empty and not cursor.fetchone()[0]:
+        cursor.execute('DROP TABLE %s' % name)
+        return False
+    return True
+
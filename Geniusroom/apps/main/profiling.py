@@ -0,0 +1,122 @@
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signing import BadSignature, TimestampSigner
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY = 'profile='
+
+signer = TimestampSigner(salt='profiling')
+
+
+def make_token(user):
+    return signer.sign(user.username)
+
+
+def check_token(token):
+    from .models import AdvUser
+
+    try:
+        username = signer.unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except BadSignature:
+        return False
+    return AdvUser.objects.filter(username=username, is_staff=True, is_active=True).exists()
+
+
+class StackSampler:
+    """Снимает стек потока запроса каждые interval секунд.
+
+    Результат - свернутые стеки ("кадр;кадр;кадр число"), которые читают
+    flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, path):
+        self.stopped.set()
+        self.thread.join()
+        with open(path + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+        return path + '.folded'
+
+
+class CProfiler:
+    # точные числа вызовов; .prof открывают snakeviz и flameprof
+    def __init__(self, interval):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path + '.prof')
+        return path + '.prof'
+
+
+PROFILERS = {'sample': StackSampler, 'cprofile': CProfiler}
+
+
+class ProfilerMiddleware:
+    """Профилирует отдельные запросы: по токену из manage.py profile_token
+    (заголовок X-Profile или параметр ?profile=) или случайную долю PROFILE_SAMPLE_RATE.
+
+    Стоит первым в MIDDLEWARE, поэтому в профиль попадают остальные middleware,
+    view, шаблоны и ORM. Без триггера - только проверка заголовка и строки запроса.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def triggered(self, request):
+        if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+            return True
+        token = request.META.get(HEADER)
+        if token is None and QUERY in request.META.get('QUERY_STRING', ''):
+            token = request.GET.get('profile')
+        return token is not None and check_token(token)
+
+    def __call__(self, request):
+        if not (HEADER in request.META or QUERY in request.META.get('QUERY_STRING', '')
+                or settings.PROFILE_SAMPLE_RATE) or not self.triggered(request):
+            return self.get_response(request)
+
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        name = '%s-%d-%s' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                             re.sub(r'[^\w.-]+', '_', request.path.strip('/')) or 'index')
+        profiler = PROFILERS[settings.PROFILE_MODE](settings.PROFILE_INTERVAL)
+        started = time.monotonic()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            path = profiler.stop(os.path.join(settings.PROFILE_DIR, name))
+        response['X-Profile'] = '%s %.1f ms' % (os.path.basename(path), (time.monotonic() - started) * 1000)
+        return response
@@ -0,0 +1,198 @@
+import logging
+import math
+import os
+import re
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.template.loader import render_to_string
+from django.core.handlers.base import BaseHandler
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+
+from . import metrics
+from .feeds import remove_file, write_file
+from .models import Article, Comment, PublishTarget, RelatedArticle, Rubric, SubRubric, SuperRubric
+from .pages import PAGES
+from .views import ARTICLES_PER_PAGE
+
+# боковое меню одинаково на всех страницах и включается в них через SSI,
+# поэтому изменение статистики рубрик перерисовывает один файл
+NAV = '/_fragments/nav.html'
+PAGE_RE = re.compile(r'^page-(\d+)\.html$')
+
+logger = logging.getLogger(__name__)
+handler = None
+
+
+def page_path(path, name='index.html'):
+    return os.path.join(settings.PUBLISH_ROOT, path.strip('/'), name)
+
+
+def article_path(rubric_id, pk):
+    return reverse('main:detail', kwargs={'rubric_pk': rubric_id, 'pk': pk})
+
+
+def rubric_path(pk):
+    return reverse('main:by_rubric', kwargs={'pk': pk})
+
+
+def all_paths():
+    yield NAV
+    yield reverse('main:index')
+    for page in PAGES:
+        yield reverse('main:other', kwargs={'page': page})
+    for pk in SubRubric.objects.values_list('pk', flat=True):
+        yield rubric_path(pk)
+    for pk, rubric_id in Article.objects.filter(is_active=True).values_list('pk', 'rubric_id').iterator():
+        yield article_path(rubric_id, pk)
+
+
+def enqueue(paths):
+    if settings.PUBLISH_MODE:
+        PublishTarget.objects.bulk_create([PublishTarget(path=path) for path in set(paths)], batch_size=500)
+
+
+def fetch(path, **params):
+    # запрос проходит все middleware, но создается здесь: признак публикации -
+    # атрибут запроса, который нельзя передать снаружи
+    global handler
+    if handler is None:
+        handler = BaseHandler()
+        handler.load_middleware()
+    host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+    request = RequestFactory(HTTP_HOST=host).get(path, params)
+    request.publishing = True
+    return handler.get_response(request)
+
+
+def remove_page(path, name='index.html'):
+    remove_file(page_path(path, name))
+    directory = os.path.dirname(page_path(path, name))
+    if os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+
+
+def render_page(path, response, name='index.html'):
+    if response.status_code == 200:
+        write_file(page_path(path, name), response.content)
+        return True
+    if response.status_code == 404:
+        remove_page(path, name)
+        return False
+    raise RuntimeError('%s: код ответа %d' % (path, response.status_code))
+
+
+def render_rubric(pk):
+    path = rubric_path(pk)
+    if not render_page(path, fetch(path)):
+        pages = 0
+    else:
+        count = Article.objects.filter(is_active=True, rubric=pk).count()
+        pages = max(math.ceil(count / ARTICLES_PER_PAGE), 1)
+        for number in range(2, pages + 1):
+            render_page(path, fetch(path, page=number), 'page-%d.html' % number)
+    # страницы, которых после удаления статей больше нет
+    directory = os.path.dirname(page_path(path))
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = PAGE_RE.match(name)
+            if match and int(match.group(1)) > pages:
+                remove_file(os.path.join(directory, name))
+
+
+def render_path(path):
+    if path == NAV:
+        rubrics = SubRubric.objects.select_related('super_rubric__stats', 'stats')
+        write_file(os.path.join(settings.PUBLISH_ROOT, NAV.lstrip('/')),
+                   render_to_string('main/fragments/nav.html', {'rubrics': rubrics}).encode('utf-8'))
+        return
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return
+    if match.url_name == 'by_rubric':
+        render_rubric(match.kwargs['pk'])
+    elif match.url_name == 'detail' and not Article.objects.filter(
+            pk=match.kwargs['pk'], rubric=match.kwargs['rubric_pk']).exists():
+        # detail не проверяет рубрику: после переноса статьи старый путь удаляется сам
+        remove_page(path)
+    else:
+        render_page(path, fetch(path))
+
+
+def publish_one(path):
+    try:
+        render_path(path)
+        return path, None
+    except Exception as e:
+        logger.exception('Не удалось опубликовать %s', path)
+        return path, str(e)
+
+
+def publish(paths, processes=1):
+    """Перерисовывает пути и возвращает список (путь, ошибка) для неудачных."""
+    paths = sorted(set(paths))
+    if processes > 1 and len(paths) > 1:
+        # соединения с БД не должны наследоваться дочерними процессами
+        connections.close_all()
+        with Pool(processes) as pool:
+            results = list(pool.imap_unordered(publish_one, paths, chunksize=20))
+    else:
+        results = [publish_one(path) for path in paths]
+    return [(path, error) for path, error in results if error]
+
+
+def publish_pending(processes=1):
+    # пути, поставленные в очередь во время публикации, останутся на следующий запуск
+    last = PublishTarget.objects.aggregate(last=Max('pk'))['last']
+    if last is None:
+        return 0, []
+    targets = PublishTarget.objects.filter(pk__lte=last)
+    paths = set(targets.values_list('path', flat=True))
+    failed = publish(paths, processes)
+    targets.exclude(path__in=[path for path, _ in failed]).delete()
+    return len(paths), failed
+
+
+def article_changed(sender, instance, **kwargs):
+    paths = {NAV, reverse('main:index'), article_path(instance.rubric_id, instance.pk), rubric_path(instance.rubric_id)}
+    # прежняя рубрика запоминается в stats.remember_state
+    old = getattr(instance, '_stats_state', None)
+    if old:
+        paths.update({article_path(old[0], instance.pk), rubric_path(old[0])})
+    # на странице статьи показаны заголовки похожих
+    paths.update(article_path(rubric_id, pk) for pk, rubric_id in RelatedArticle.objects.filter(
+        related=instance.pk).values_list('article_id', 'article__rubric_id'))
+    enqueue(paths)
+
+
+def comment_changed(sender, instance, **kwargs):
+    rubric_id = Article.objects.filter(pk=instance.article_id).values_list('rubric_id', flat=True).first()
+    if rubric_id is not None:
+        enqueue({article_path(rubric_id, instance.article_id)})
+
+
+def rubric_changed(sender, instance, **kwargs):
+    # название рубрики есть на страницах всех ее статей
+    rubrics = list(Rubric.objects.filter(super_rubric=instance.pk).values_list('pk', flat=True))
+    if instance.super_rubric_id:
+        rubrics.append(instance.pk)
+    paths = {NAV}
+    paths.update(rubric_path(pk) for pk in rubrics)
+    paths.update(article_path(rubric_id, pk) for pk, rubric_id in Article.objects.filter(
+        rubric__in=rubrics).values_list('pk', 'rubric_id').iterator())
+    enqueue(paths)
+
+
+post_save.connect(article_changed, sender=Article)
+post_delete.connect(article_changed, sender=Article)
+post_save.connect(comment_changed, sender=Comment)
+post_delete.connect(comment_changed, sender=Comment)
+for model in (Rubric, SubRubric, SuperRubric):
+    post_save.connect(rubric_changed, sender=model)
+    post_delete.connect(rubric_changed, sender=model)
+metrics.gauges['publish_queue_pending'] = PublishTarget.objects.count
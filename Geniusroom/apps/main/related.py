@@ -0,0 +1,239 @@
+import math
+import os
+import pickle
+import re
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import pre_delete, pre_save
+
+from . import metrics
+from .models import Article, RelatedArticle
+from .publish import article_path, enqueue
+from .utilities import parse_names
+
+WORD_RE = re.compile(r'\w{3,}')
+RELATED_COUNT = 5
+# из текста статьи в модель попадают только самые весомые слова
+TOP_TERMS = 12
+# слова, встречающиеся чаще, чем в этой доле статей, не порождают кандидатов
+MAX_DF_RATIO = 0.05
+MAX_POSTINGS = 500
+
+WEIGHT_PEOPLE = 1.0
+WEIGHT_TEXT = 0.6
+WEIGHT_RUBRIC = 0.2
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.casefold().replace('ё', 'е'))
+
+
+class RelatedModel:
+    """Разреженная модель корпуса для поиска похожих статей.
+
+    Инвертированные индексы людей и слов; у каждой статьи хранится только
+    TOP_TERMS слов с весами TF-IDF, нормированными по длине, поэтому сумма
+    произведений общих весов приближает косинусное сходство. Модель
+    сохраняется в RELATED_MODEL_PATH, и следующий запуск переиндексирует
+    только измененные статьи; веса остальных считаются по частотам слов на
+    момент их индексации, полная перестройка (--all) их обновляет.
+    Списки статей в индексах отсортированы по pk.
+    """
+
+    def __init__(self):
+        self.rubrics = {}
+        self.people = {}
+        self.terms = {}
+        # все различные слова статьи: для частот слов при переиндексации
+        self.words = {}
+        self.term_ids = {}
+        self.df = Counter()
+        self.people_postings = defaultdict(list)
+        self.term_postings = defaultdict(list)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def count(self, pk, rubric_id, characters, content):
+        self.rubrics[pk] = rubric_id
+        self.people[pk] = tuple(sorted({name.casefold() for name in parse_names(characters)}))
+        tf = Counter(self.term_ids.setdefault(word, len(self.term_ids)) for word in tokenize(content))
+        self.words[pk] = tuple(tf)
+        self.df.update(tf.keys())
+        return tf
+
+    def index(self, pk, tf):
+        total = max(len(self.rubrics), 1)
+        max_df = max(total * MAX_DF_RATIO, 2)
+        for name in self.people[pk]:
+            insort(self.people_postings[name], pk)
+        weights = sorted(((n * math.log(total / self.df[t]), t) for t, n in tf.items()), reverse=True)[:TOP_TERMS]
+        norm = math.sqrt(sum(w * w for w, _ in weights)) or 1
+        self.terms[pk] = {t: w / norm for w, t in weights if w > 0}
+        for t in self.terms[pk]:
+            if self.df[t] <= max_df:
+                insort(self.term_postings[t], pk)
+
+    def build(self, deadline=None):
+        """Полный проход по статьям; False, если не уложился в deadline."""
+        counts = {}
+        rows = Article.objects.filter(is_active=True).order_by('pk') \
+            .values_list('pk', 'rubric_id', 'characters', 'content')
+        for i, (pk, rubric_id, characters, content) in enumerate(rows.iterator(chunk_size=2000)):
+            if deadline is not None and i % 100 == 0 and time.monotonic() > deadline:
+                return False
+            counts[pk] = self.count(pk, rubric_id, characters, content)
+        for pk, tf in counts.items():
+            self.index(pk, tf)
+        return True
+
+    def remove(self, pk):
+        if pk not in self.rubrics:
+            return
+        for name in self.people.pop(pk):
+            postings = self.people_postings[name]
+            postings.pop(bisect_left(postings, pk))
+            if not postings:
+                del self.people_postings[name]
+        for t in self.terms.pop(pk):
+            postings = self.term_postings.get(t)
+            i = bisect_left(postings, pk) if postings else 0
+            if postings and i < len(postings) and postings[i] == pk:
+                postings.pop(i)
+        self.df.subtract(self.words.pop(pk))
+        del self.rubrics[pk]
+
+    def update(self, pk, rubric_id, characters, content):
+        self.remove(pk)
+        self.index(pk, self.count(pk, rubric_id, characters, content))
+
+    def similar(self, pk):
+        if pk not in self.rubrics:
+            return []
+        total = max(len(self.rubrics), 1)
+        scores = Counter()
+        for name in self.people[pk]:
+            postings = self.people_postings[name]
+            idf = math.log(1 + total / len(postings))
+            # при длинных списках - самые новые статьи
+            for other in postings[-MAX_POSTINGS:]:
+                scores[other] += WEIGHT_PEOPLE * idf
+        terms = self.terms[pk]
+        for t, w in terms.items():
+            for other in self.term_postings.get(t, ())[-MAX_POSTINGS:]:
+                scores[other] += WEIGHT_TEXT * w * self.terms[other][t]
+        scores.pop(pk, None)
+        rubric_id = self.rubrics[pk]
+        for other in scores:
+            if self.rubrics[other] == rubric_id:
+                scores[other] += WEIGHT_RUBRIC
+        return scores.most_common(RELATED_COUNT)
+
+
+def set_stale(pks, value, batch_size=1000):
+    for i in range(0, len(pks), batch_size):
+        Article.objects.filter(pk__in=pks[i:i + batch_size]).update(related_stale=value)
+
+
+def refresh_model(model, changed, deadline, batch_size=500):
+    """Переиндексирует статьи changed и убирает удаленные; False, если не уложился в deadline."""
+    active = set(Article.objects.filter(is_active=True).values_list('pk', flat=True))
+    for pk in set(model.rubrics) - active:
+        model.remove(pk)
+    # и статьи, которых нет в модели: например, снова видимые после update()
+    pks = sorted((set(changed) & active) | (active - set(model.rubrics)))
+    for i in range(0, len(pks), batch_size):
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        for row in Article.objects.filter(pk__in=pks[i:i + batch_size]).order_by('pk') \
+                .values_list('pk', 'rubric_id', 'characters', 'content'):
+            model.update(*row)
+    return True
+
+
+def update_related(full=False, batch_size=1000, max_seconds=None, log=None):
+    """Пересчитывает похожие статьи для помеченных related_stale.
+
+    Модель корпуса загружается из RELATED_MODEL_PATH и обновляется только для
+    измененных статей (полностью строится при full или без сохраненной).
+    Флаг снимается до чтения текстов: статья, сохраненная во время прохода,
+    снова помечается mark_stale и пересчитывается следующим запуском. Время
+    max_seconds проверяется и во время построения модели: при его исчерпании
+    оставшиеся статьи помечаются обратно.
+    """
+    started = time.monotonic()
+    deadline = started + max_seconds if max_seconds is not None else None
+    if full:
+        Article.objects.filter(related_stale=False).update(related_stale=True)
+    changed = set(Article.objects.filter(related_stale=True).values_list('pk', flat=True))
+    # статьи, ссылающиеся на измененные, тоже пересчитываются
+    stale = sorted(changed | set(RelatedArticle.objects.filter(related__in=changed)
+                                 .values_list('article', flat=True)))
+    if not stale:
+        return 0
+    set_stale(stale, False)
+
+    done = 0
+    try:
+        model = None if full else RelatedModel.load(settings.RELATED_MODEL_PATH)
+        if model is None:
+            model = RelatedModel()
+            ready = model.build(deadline)
+        else:
+            ready = refresh_model(model, changed, deadline)
+        if not ready:
+            if log:
+                log('Модель не построена за %.1f c' % (time.monotonic() - started))
+            return 0
+        model.save(settings.RELATED_MODEL_PATH)
+        if log:
+            log('Модель готова за %.1f c: %d статей' % (time.monotonic() - started, len(model.rubrics)))
+
+        for i in range(0, len(stale), batch_size):
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            batch = stale[i:i + batch_size]
+            rows = [RelatedArticle(article_id=pk, related_id=other, score=score)
+                    for pk in batch for other, score in model.similar(pk)]
+            with transaction.atomic():
+                RelatedArticle.objects.filter(article__in=batch).delete()
+                RelatedArticle.objects.bulk_create(rows)
+                enqueue(article_path(rubric_id, pk) for pk, rubric_id in Article.objects.filter(
+                    pk__in=batch).values_list('pk', 'rubric_id'))
+            done += len(batch)
+    finally:
+        # не пересчитанные статьи остаются на следующий запуск
+        set_stale(stale[done:], True)
+    return done
+
+
+def mark_stale(sender, instance, **kwargs):
+    # pre_save: флаг сохраняется тем же UPDATE, без отдельного запроса
+    instance.related_stale = True
+
+
+def referrers_stale(sender, instance, **kwargs):
+    # ссылки на удаляемую статью удалятся каскадом, а ссылавшимся нужна замена
+    Article.objects.filter(related_set__related=instance.pk).update(related_stale=True)
+
+
+pre_save.connect(mark_stale, sender=Article)
+pre_delete.connect(referrers_stale, sender=Article)
+metrics.gauges['related_stale_articles'] = Article.objects.filter(related_stale=True).count
@@ -0,0 +1,113 @@
+from rest_framework import serializers
+
+from .models import Article, AdditionalImage, Comment, SubRubric, SuperRubric
+
+
+def requested_fields(request, allowed):
+    # ?fields=id,title - только перечисленные поля, неизвестные игнорируются
+    fields = request.query_params.get('fields') if request else None
+    if not fields:
+        return tuple(allowed)
+    wanted = {name.strip() for name in fields.split(',')}
+    return tuple(name for name in allowed if name in wanted)
+
+
+def media_url(field, request=None):
+    # MEDIA_URL задан без ведущего '/', поэтому адрес строится от корня сайта
+    if not field:
+        return None
+    url = '/' + field.url.lstrip('/')
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class MediaUrlField(serializers.ImageField):
+    def to_representation(self, value):
+        return media_url(value, self.context.get('request'))
+
+
+class SparseFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            keep = set(requested_fields(request, self.fields))
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class AdditionalImageSerializer(serializers.ModelSerializer):
+    image = MediaUrlField()
+
+    class Meta:
+        model = AdditionalImage
+        fields = ('id', 'image', 'caption')
+
+
+class ArticleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image = MediaUrlField()
+    rubric_name = serializers.CharField(source='rubric.name')
+    super_rubric = serializers.IntegerField(source='rubric.super_rubric_id')
+    images = AdditionalImageSerializer(source='additionalimage_set', many=True)
+
+    class Meta:
+        model = Article
+        fields = ('id', 'title', 'content', 'source', 'characters', 'image',
+                  'rubric', 'rubric_name', 'super_rubric', 'created_at', 'images')
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Comment
+        fields = ('id', 'article', 'parent', 'author', 'content', 'created_at')
+
+
+class SubRubricSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SubRubric
+        fields = ('id', 'name', 'order')
+
+
+class SuperRubricSerializer(serializers.ModelSerializer):
+    rubrics = SubRubricSerializer(source='rubric_set', many=True)
+
+    class Meta:
+        model = SuperRubric
+        fields = ('id', 'name', 'order', 'rubrics')
+
+
+# Ручная сериализация для горячих списков: тот же формат, что у сериализаторов выше,
+# но без построения полей DRF на каждый объект (сравнение - manage.py benchmark_api)
+
+datetime_field = serializers.DateTimeField()
+
+ARTICLE_GETTERS = {
+    'id': lambda a, r: a.pk,
+    'title': lambda a, r: a.title,
+    'content': lambda a, r: a.content,
+    'source': lambda a, r: a.source,
+    'characters': lambda a, r: a.characters,
+    'image': lambda a, r: media_url(a.image, r),
+    'rubric': lambda a, r: a.rubric_id,
+    'rubric_name': lambda a, r: a.rubric.name,
+    'super_rubric': lambda a, r: a.rubric.super_rubric_id,
+    'created_at': lambda a, r: datetime_field.to_representation(a.created_at),
+    'images': lambda a, r: [{'id': ai.pk, 'image': media_url(ai.image, r), 'caption': ai.caption}
+                            for ai in a.additionalimage_set.all()],
+}
+
+COMMENT_GETTERS = {
+    'id': lambda c: c.pk,
+    'article': lambda c: c.article_id,
+    'parent': lambda c: c.parent_id,
+    'author': lambda c: c.author,
+    'content': lambda c: c.content,
+    'created_at': lambda c: datetime_field.to_representation(c.created_at),
+}
+
+
+def article_dict(article, fields=ArticleSerializer.Meta.fields, request=None):
+    return {name: ARTICLE_GETTERS[name](article, request) for name in fields}
+
+
+def comment_dict(comment, fields=CommentSerializer.Meta.fields):
+    return {name: COMMENT_GETTERS[name](comment) for name in fields}
@@ -0,0 +1,26 @@
+"""SQLite для нескольких воркеров gunicorn (ENGINE 'Geniusroom.apps.main.sqlite').
+
+Каждое новое соединение получает SQLITE_PRAGMAS: WAL (чтение не ждет
+записи), synchronous=NORMAL (в WAL fsync только при checkpoint), busy_timeout
+(занятая БД ждется, а не сразу "database is locked"), mmap и больший кэш страниц.
+
+Транзакции начинаются с BEGIN IMMEDIATE: блокировка на запись берется сразу,
+и при занятой БД повторные попытки busy_timeout идут до первого запроса.
+После обычного BEGIN транзакция, которая сначала читает (select_for_update в
+trending.py, storage.py), не может дождаться записи - ее снимок уже устарел,
+и SQLite сразу возвращает "database is locked". Все atomic-блоки проекта
+пишут, поэтому сериализация транзакций ничего не стоит.
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
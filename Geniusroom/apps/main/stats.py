@@ -0,0 +1,86 @@
+from django.db.models import Max, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import Article, Rubric, RubricStats, SubRubric, SuperRubric
+
+
+def refresh_rubrics(rubric_ids):
+    """Пересчитывает статистику подрубрик и их надрубрик.
+
+    На каждую подрубрику - запрос по индексу (rubric, is_active);
+    надрубрика собирается из уже посчитанных строк подрубрик.
+    """
+    super_ids = set()
+    for rubric_id in set(rubric_ids):
+        latest = Article.objects.filter(rubric=rubric_id, is_active=True) \
+            .order_by('-created_at').values_list('pk', 'created_at').first()
+        count = Article.objects.filter(rubric=rubric_id, is_active=True).count()
+        RubricStats.objects.update_or_create(rubric_id=rubric_id, defaults={
+            'active_count': count,
+            'latest_created_at': latest[1] if latest else None,
+            'latest_article_id': latest[0] if latest else None,
+        })
+        super_ids.add(Rubric.objects.filter(pk=rubric_id).values_list('super_rubric_id', flat=True).first())
+    super_ids.discard(None)
+    refresh_super_rubrics(super_ids)
+
+
+def refresh_super_rubrics(super_ids):
+    for super_id in super_ids:
+        children = RubricStats.objects.filter(rubric__super_rubric=super_id)
+        latest = children.exclude(latest_article=None).order_by('-latest_created_at') \
+            .values_list('latest_article_id', 'latest_created_at').first()
+        RubricStats.objects.update_or_create(rubric_id=super_id, defaults={
+            'active_count': children.aggregate(count=Sum('active_count'))['count'] or 0,
+            'latest_created_at': latest[1] if latest else None,
+            'latest_article_id': latest[0] if latest else None,
+        })
+
+
+def recompute_all():
+    refresh_rubrics(SubRubric.objects.values_list('pk', flat=True))
+    # надрубрики без подрубрик тоже получают строку
+    refresh_super_rubrics(SuperRubric.objects.values_list('pk', flat=True))
+
+
+def remember_state(sender, instance, **kwargs):
+    """Прежнее состояние статьи для обработчиков post_save (stats, publish, feeds, edge).
+
+    Берется из значений, загруженных вместе со статьей (Article.from_db); запрос
+    к БД нужен только статье, созданной в коде с готовым pk или загруженной без
+    этих полей (only/defer).
+    """
+    instance._stats_state = None
+    if instance.pk:
+        instance._stats_state = getattr(instance, '_loaded_state', None)
+        if instance._stats_state is None:
+            instance._stats_state = Article.objects.filter(pk=instance.pk) \
+                .values_list(*Article.STATE_FIELDS).first()
+
+
+def article_saved(sender, instance, created, **kwargs):
+    old = getattr(instance, '_stats_state', None)
+    new = tuple(getattr(instance, name) for name in Article.STATE_FIELDS)
+    # следующее сохранение того же объекта сравнивается уже с этим
+    instance._loaded_state = new
+    if created or old != new:
+        refresh_rubrics({instance.rubric_id, old[0]} if old else {instance.rubric_id})
+
+
+def article_deleted(sender, instance, **kwargs):
+    refresh_rubrics({instance.rubric_id})
+
+
+def rubric_saved(sender, instance, created, **kwargs):
+    if created and instance.super_rubric_id:
+        # новая подрубрика сразу получает строку с нулями
+        refresh_rubrics({instance.pk})
+    # подрубрику могли перенести в другую надрубрику
+    refresh_super_rubrics(SuperRubric.objects.values_list('pk', flat=True))
+
+
+pre_save.connect(remember_state, sender=Article)
+post_save.connect(article_saved, sender=Article)
+post_delete.connect(article_deleted, sender=Article)
+for model in (Rubric, SubRubric, SuperRubric):
+    post_save.connect(rubric_saved, sender=model)
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+def content_hash(content):
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+def sharded_name(digest, ext):
+    return '%s/%s/%s%s' % (digest[:2], digest[2:4], digest, ext.lower())
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы именуются по SHA-256 содержимого: ab/cd/<hash>.<ext>.
+
+    Одинаковые загрузки хранятся один раз, а MediaFile считает ссылки,
+    поэтому delete() (его вызывает django_cleanup) удаляет файл
+    только вместе с последней ссылкой. _save вызывается из pre_save поля,
+    и Article.save и AdditionalImage.save идут в транзакции: если запись не
+    сохранилась, ссылка откатывается вместе с ней. Файл остается на диске без
+    ссылки, и следующая такая же загрузка его использует; кто сохраняет много
+    файлов в одной транзакции (import_articles), после отката убирает их
+    через discard().
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # имя определяется содержимым: совпадение имени означает тот же файл
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaFile
+
+        name = sharded_name(content_hash(content), os.path.splitext(name)[1])
+        with transaction.atomic():
+            if not MediaFile.objects.filter(name=name).update(refs=F('refs') + 1):
+                try:
+                    with transaction.atomic():
+                        MediaFile.objects.create(name=name, refs=1)
+                except IntegrityError:
+                    MediaFile.objects.filter(name=name).update(refs=F('refs') + 1)
+            if not self.exists(name):
+                # запись во временный файл и атомарная замена: читатели не увидят
+                # недописанный файл, а параллельная загрузка того же содержимого безвредна
+                tmp = super()._save('%s.%s.tmp' % (name, uuid.uuid4().hex), content)
+                os.replace(self.path(tmp), self.path(name))
+        return name
+
+    def delete(self, name):
+        from .models import MediaFile
+
+        with transaction.atomic():
+            media = MediaFile.objects.select_for_update().filter(name=name).first()
+            if media is not None and media.refs > 1:
+                media.refs -= 1
+                media.save(update_fields=['refs'])
+                return
+            if media is not None:
+                media.delete()
+            super().delete(name)
+
+    def discard(self, names):
+        """Удаляет файлы names, ссылки на которые откатились вместе с транзакцией."""
+        from .models import MediaFile
+
+        names = set(names)
+        names -= set(MediaFile.objects.filter(name__in=names).values_list('name', flat=True))
+        for name in names:
+            super().delete(name)
@@ -1,3 +1,1413 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import smtplib
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings as django_settings
+from captcha.models import CaptchaStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.signals import template_rendered
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from .models import AdvUser, Article, AdditionalImage, Comment, PublishTarget, RelatedArticle, SubRubric, SuperRubric
+from .models import ArchivedArticle, FeedTarget, MediaFile, RubricStats, TrendingArticle, path_segment
+from . import admission, counters, digests, edge, metrics, publish, related, throttling, trending, typeahead
+from .profiling import make_token
+from .publish import publish_pending
+from .utilities import signer
+from .warmup import walk_patterns
+from .serializers import ArticleSerializer, CommentSerializer, article_dict, comment_dict
+
+# каталоги для @override_settings: путь известен при объявлении класса,
+# сам каталог создается заново для каждого теста (temp_dir)
+TEST_ROOT = os.path.join(tempfile.gettempdir(), 'geniusroom-tests-%d' % os.getpid())
+
+
+def tearDownModule():
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
+
+
+def temp_dir(test, name):
+    """Пустой каталог TEST_ROOT/name, удаляемый после теста."""
+    path = os.path.join(TEST_ROOT, name)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+class RubricFixture:
+    """Автор bach и подрубрика Барокко надрубрики Классика, общие для тестов класса."""
+
+    @classmethod
+    def create_rubric(cls):
+        cls.author = AdvUser.objects.create(username='bach')
+        cls.classic = SuperRubric.objects.create(name='Классика')
+        cls.rubric = SubRubric.objects.create(name='Барокко', super_rubric=cls.classic)
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_rubric()
+
+
+class ApiTest(RubricFixture, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(30):
+            article = Article.objects.create(rubric=cls.rubric, author=cls.author, title='Статья %d' % i,
+                                             content='Текст', source='Источник',
+                                             characters='Иоганн Себастьян Бах (1685-1750)')
+            AdditionalImage.objects.create(article=article, image='a%d.jpg' % i, caption='Подпись')
+            Comment.objects.create(article=article, author='Гость', content='Комментарий')
+        cls.article = article
+        for i in range(30):
+            Comment.objects.create(article=article, author='Гость', content='Комментарий %d' % i)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_article_list_queries(self):
+        # статьи + дополнительные иллюстрации, независимо от размера страницы
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/articles/?page_size=25')
+        data = response.json()
+        self.assertEqual(len(data['results']), 25)
+        self.assertEqual(data['results'][0]['images'][0]['caption'], 'Подпись')
+
+    def test_cursor_pagination(self):
+        first = self.client.get('/api/v1/articles/').json()
+        second = self.client.get(first['next']).json()
+        ids = [a['id'] for a in first['results'] + second['results']]
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(len(set(ids)), 30)
+        self.assertIsNone(second['next'])
+
+    def test_sparse_fields(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/articles/?fields=id,title')
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+
+    def test_comment_list_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/articles/%d/comments/' % self.article.pk)
+        self.assertEqual(len(response.json()['results']), 20)
+
+    def test_rubric_list_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/rubrics/')
+        self.assertEqual(response.json()[0]['rubrics'][0]['name'], 'Барокко')
+
+    def test_etag_and_cache(self):
+        response = self.client.get('/api/v1/articles/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/articles/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get('/api/v1/articles/').content, response.content)
+
+        Comment.objects.create(article=self.article, author='Гость', content='Новый')
+        self.assertEqual(self.client.get('/api/v1/articles/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_manual_serialization_matches_serializers(self):
+        article = Article.objects.prefetch_related('additionalimage_set').get(pk=self.article.pk)
+        self.assertEqual(article_dict(article), ArticleSerializer(article).data)
+        comment = Comment.objects.first()
+        self.assertEqual(comment_dict(comment), CommentSerializer(comment).data)
+
+
+class QueryPlanTest(TestCase):
+    """Горячие запросы представлений должны идти по индексам, а не полным просмотром."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = AdvUser.objects.create(username='bach')
+        other = AdvUser.objects.create(username='handel')
+        classic = SuperRubric.objects.create(name='Классика')
+        rubrics = [SubRubric.objects.create(name='Рубрика %d' % i, super_rubric=classic) for i in range(10)]
+        cls.rubric = rubrics[0]
+        Article.objects.bulk_create([
+            Article(rubric=rubrics[i % 10], author=cls.author if i % 20 == 0 else other,
+                    title='Статья %d' % i, content='Текст', source='Источник',
+                    characters='Иоганн Себастьян Бах (1685-1750)', is_active=i % 7 != 0)
+            for i in range(500)
+        ])
+        cls.article = Article.objects.filter(is_active=True).first()
+        Comment.objects.bulk_create([
+            Comment(article_id=pk, author='Гость', content='Комментарий', is_active=i % 5 != 0)
+            for i, pk in enumerate(Article.objects.values_list('pk', flat=True)) for _ in range(3)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def hot_queries(self):
+        # те же запросы, что в index, by_rubric, profile и detail
+        return {
+            'index': Article.objects.filter(is_active=True)[:10],
+            'by_rubric': Article.objects.filter(is_active=True, rubric=self.rubric.pk)[:2],
+            'profile': Article.objects.filter(author=self.author.pk),
+            'detail_roots': Comment.objects.filter(article=self.article.pk, is_active=True, parent=None)
+                .order_by('path'),
+            'detail_threads': Comment.objects.filter(article=self.article.pk, is_active=True,
+                                                     path__gte='0000001', path__lt='0000002').order_by('path'),
+        }
+
+    def assert_uses_index(self, name, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # без подходящего индекса планировщик все равно выберет Seq Scan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn('Seq Scan', plan, '%s:\n%s' % (name, plan))
+            self.assertNotIn('Sort Key', plan, '%s:\n%s' % (name, plan))
+        elif connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            for line in plan.splitlines():
+                self.assertFalse('SCAN' in line and 'USING' not in line, '%s:\n%s' % (name, plan))
+                self.assertNotIn('TEMP B-TREE', line, '%s:\n%s' % (name, plan))
+        else:
+            self.skipTest('План запроса проверяется только для PostgreSQL и SQLite')
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                self.assert_uses_index(name, queryset)
+
+
+@override_settings(PUBLISH_MODE=True, PUBLISH_ROOT=os.path.join(TEST_ROOT, 'publish'))
+class PublishTest(RubricFixture, TestCase):
+    def setUp(self):
+        self.root = temp_dir(self, 'publish')
+        self.articles = [Article.objects.create(rubric=self.rubric, author=self.author, title='Статья %d' % i,
+                                                content='Текст', characters='Иоганн Себастьян Бах (1685-1750)')
+                         for i in range(3)]
+
+    def published(self, *parts):
+        return os.path.exists(os.path.join(self.root, *parts))
+
+    def test_publish_and_incremental_rebuild(self):
+        self.assertEqual(publish_pending(), (6, []))
+        self.assertFalse(PublishTarget.objects.exists())
+        rubric, article = str(self.rubric.pk), str(self.articles[0].pk)
+        for parts in (('index.html',), (rubric, 'index.html'), (rubric, 'page-2.html'),
+                      (rubric, article, 'index.html'), ('_fragments', 'nav.html')):
+            self.assertTrue(self.published(*parts), parts)
+        with open(os.path.join(self.root, rubric, article, 'index.html'), encoding='utf-8') as f:
+            page = f.read()
+        # пользовательские части приходят из /fragments/, страница одинакова для всех
+        self.assertIn('data-fragment="comment_form"', page)
+        self.assertNotIn('csrfmiddlewaretoken', page)
+        self.assertIn('<!--# include virtual="/_fragments/nav.html" -->', page)
+        # заголовок клиента режим публикации не включает
+        for path in ('/%s/%s/' % (rubric, article), '/about/'):
+            response = self.client.get(path, HTTP_X_PUBLISH='1')
+            self.assertNotIn('<!--# include', response.content.decode(), path)
+
+        Comment.objects.create(article=self.articles[1], author='Гость', content='Комментарий')
+        self.assertEqual(list(PublishTarget.objects.values_list('path', flat=True)),
+                         ['/%s/%d/' % (rubric, self.articles[1].pk)])
+        self.articles[0].delete()
+        self.articles[1].delete()
+        publish_pending()
+        self.assertFalse(self.published(rubric, article, 'index.html'))
+        self.assertFalse(self.published(rubric, 'page-2.html'))
+        self.assertTrue(self.published(rubric, 'index.html'))
+
+    def test_fragments(self):
+        response = self.client.get('/fragments/?names=auth,comment_form&article=%d' % self.articles[0].pk)
+        self.assertIn('no-store', response['Cache-Control'])
+        data = response.json()
+        self.assertIn('Вход', data['auth'])
+        self.assertIn('csrfmiddlewaretoken', data['comment_form'])
+
+
+@override_settings(RELATED_MODEL_PATH=os.path.join(TEST_ROOT, 'related', 'related.pickle'))
+class RelatedTest(RubricFixture, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.romantic = SubRubric.objects.create(name='Романтизм', super_rubric=cls.classic)
+
+    def setUp(self):
+        temp_dir(self, 'related')
+        baroque, romantic = self.rubric, self.romantic
+        rows = (
+            (baroque, 'Иоганн Себастьян Бах (1685-1750)', 'Фуга токката органная месса кантата'),
+            (baroque, 'Иоганн Себастьян Бах (1685-1750)', 'Фуга органная хорал'),
+            (baroque, 'Георг Фридрих Гендель (1685-1759)', 'Оратория опера'),
+            (romantic, 'Фредерик Шопен (1810-1849)', 'Ноктюрн мазурка полонез'),
+        )
+        self.articles = [Article.objects.create(rubric=rubric, author=self.author, title='Статья', content=content,
+                                                characters=characters) for rubric, characters, content in rows]
+
+    def related(self, article):
+        return list(RelatedArticle.objects.filter(article=article).values_list('related_id', flat=True))
+
+    def test_scoring(self):
+        bach, bach2, handel, chopin = self.articles
+        self.assertEqual(related.update_related(), 4)
+        self.assertFalse(Article.objects.filter(related_stale=True).exists())
+        # общий человек и слова, рубрика добавляется только к уже найденным
+        self.assertEqual(self.related(bach), [bach2.pk])
+        self.assertEqual(self.related(handel), [])
+        self.assertEqual(self.related(chopin), [])
+        model = related.RelatedModel.load(django_settings.RELATED_MODEL_PATH)
+        (other, score), = model.similar(bach.pk)
+        self.assertEqual(other, bach2.pk)
+        self.assertGreater(score, related.WEIGHT_PEOPLE + related.WEIGHT_RUBRIC)
+
+    def test_incremental_update_and_stale_propagation(self):
+        bach, bach2, handel, chopin = self.articles
+        related.update_related()
+        handel.characters = 'Иоганн Себастьян Бах (1685-1750)'
+        handel.save()
+        # читается только измененная статья, остальные берутся из сохраненной модели
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(related.update_related(), 1)
+        texts = [q['sql'] for q in queries if '"content"' in q['sql']]
+        self.assertEqual(len(texts), 1)
+        self.assertIn('"id" IN (%d)' % handel.pk, texts[0])
+        self.assertEqual(set(self.related(handel)), {bach.pk, bach2.pk})
+
+        # ссылки на удаленную статью удаляются каскадом, ссылавшиеся пересчитываются
+        bach2.delete()
+        self.assertEqual(set(Article.objects.filter(related_stale=True).values_list('pk', flat=True)),
+                         {bach.pk, handel.pk})
+        related.update_related()
+        self.assertEqual(self.related(bach), [handel.pk])
+        model = related.RelatedModel.load(django_settings.RELATED_MODEL_PATH)
+        self.assertNotIn(bach2.pk, model.rubrics)
+        self.assertEqual(model.people_postings['иоганн себастьян бах'], [bach.pk, handel.pk])
+
+    def test_edit_during_pass_is_not_lost(self):
+        bach, bach2, handel, chopin = self.articles
+        related.update_related()
+        handel.characters = 'Иоганн Себастьян Бах (1685-1750)'
+        handel.save()
+        save = related.RelatedModel.save
+
+        def save_and_edit(model, path):
+            # модель уже прочитала текст Генделя, пересчитанного в этом проходе
+            save(model, path)
+            handel.characters = 'Фредерик Шопен (1810-1849)'
+            handel.save()
+
+        with mock.patch.object(related.RelatedModel, 'save', autospec=True, side_effect=save_and_edit):
+            related.update_related()
+        self.assertEqual(list(Article.objects.filter(related_stale=True).values_list('pk', flat=True)), [handel.pk])
+        related.update_related()
+        self.assertEqual(self.related(handel), [chopin.pk])
+
+    def test_max_seconds(self):
+        # время кончилось во время построения модели: все остается на следующий запуск
+        self.assertEqual(related.update_related(max_seconds=0), 0)
+        self.assertEqual(Article.objects.filter(related_stale=True).count(), 4)
+        self.assertFalse(os.path.exists(django_settings.RELATED_MODEL_PATH))
+        self.assertEqual(related.update_related(batch_size=2), 4)
+
+        self.articles[0].save()
+        self.assertEqual(related.update_related(max_seconds=0), 0)
+        self.assertTrue(Article.objects.get(pk=self.articles[0].pk).related_stale)
+
+
+@override_settings(PUBLIC_ROOT=os.path.join(TEST_ROOT, 'feeds'))
+class FeedsTest(RubricFixture, TestCase):
+    def setUp(self):
+        self.root = temp_dir(self, 'feeds')
+        self.articles = [Article.objects.create(rubric=self.rubric, author=self.author, title='Статья %d' % i,
+                                                content='Текст', characters='Иоганн Себастьян Бах (1685-1750)',
+                                                is_active=i != 2) for i in range(3)]
+
+    def read(self, *parts):
+        path = os.path.join(self.root, *parts)
+        with open(path, 'rb') as f, gzip.open(path + '.gz') as compressed:
+            data = f.read()
+            # рядом с каждым файлом - сжатая копия для gzip_static
+            self.assertEqual(compressed.read(), data)
+        return data.decode('utf-8')
+
+    def test_build_all(self):
+        call_command('build_feeds', stdout=StringIO())
+        shard = self.read('sitemaps', 'articles-0.xml')
+        for article in self.articles:
+            url = 'http://localhost:8000/%d/%d/</loc>' % (self.rubric.pk, article.pk)
+            self.assertEqual(url in shard, article.is_active, article.title)
+        self.assertIn('/%d/</loc>' % self.rubric.pk, self.read('sitemaps', 'pages.xml'))
+        index = self.read('sitemap.xml')
+        self.assertIn('/sitemaps/articles-0.xml</loc>', index)
+        self.assertIn('/sitemaps/pages.xml</loc>', index)
+
+        atom = self.read('feeds', 'all.atom')
+        self.assertIn('<title>Статья 1</title>', atom)
+        self.assertNotIn('Статья 2', atom)
+        self.assertIn('<category>Барокко</category>', self.read('feeds', 'rubric-%d.rss' % self.rubric.pk))
+
+    def test_changes_marked_for_pending_build(self):
+        call_command('build_feeds', stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.articles[0].title = 'Новое название'
+            self.articles[0].save()
+        # запрос файлы не переписывает, только отмечает
+        self.assertNotIn('Новое название', self.read('feeds', 'all.atom'))
+        self.assertEqual(set(FeedTarget.objects.values_list('name', flat=True)),
+                         {'articles-0', 'rubric-%d' % self.rubric.pk, 'pages'})
+
+        call_command('build_feeds', pending=True, stdout=StringIO())
+        self.assertIn('Новое название', self.read('feeds', 'all.atom'))
+        self.assertIn('Новое название', self.read('feeds', 'rubric-%d.atom' % self.rubric.pk))
+        self.assertFalse(FeedTarget.objects.exists())
+
+
+class StubProxy(BaseHTTPRequestHandler):
+    # запоминает запросы очистки вместо настоящего прокси
+    requests = []
+
+    def do_PURGE(self):
+        self.requests.append((self.command, self.headers['Surrogate-Key']))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class EdgeCacheTest(RubricFixture, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.proxy = HTTPServer(('127.0.0.1', 0), StubProxy)
+        threading.Thread(target=cls.proxy.serve_forever, daemon=True).start()
+        # порт прокси известен только после запуска, поэтому не декоратором класса
+        cls.proxy_settings = override_settings(EDGE_CACHE_ENABLED=True, EDGE_CACHE_PURGE={
+            'TRANSPORT': 'Geniusroom.apps.main.edge.HttpPurgeTransport',
+            'URLS': ['http://127.0.0.1:%d/' % cls.proxy.server_port],
+        })
+        cls.proxy_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.proxy_settings.disable()
+        cls.proxy.shutdown()
+        cls.proxy.server_close()
+
+    def setUp(self):
+        StubProxy.requests = []
+        self.article, self.other = [
+            Article.objects.create(rubric=self.rubric, author=self.author, title='Статья %d' % i, content='Текст',
+                                   characters='Иоганн Себастьян Бах (1685-1750)') for i in range(2)]
+        RelatedArticle.objects.create(article=self.article, related=self.other, score=1)
+
+    def test_surrogate_headers(self):
+        response = self.client.get('/%d/%d/' % (self.rubric.pk, self.article.pk))
+        self.assertEqual(response['Surrogate-Key'], 'a%d a%d nav r%d' % (
+            self.article.pk, self.other.pk, self.rubric.pk))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('csrfmiddlewaretoken', response.content.decode())
+        self.assertEqual(self.client.get('/').get('Surrogate-Key'), 'index nav')
+
+        response = self.client.post('/%d/%d/' % (self.rubric.pk, self.article.pk),
+                                    {'article': self.article.pk, 'author': 'Гость', 'content': 'Текст'})
+        self.assertNotIn('Surrogate-Key', response)
+
+    def test_private_response_not_cached(self):
+        # cookie или Vary: Cookie, добавленные middleware после представления, делают ответ личным
+        def view(request):
+            request.edge_cached, request.surrogate_keys = True, {edge.INDEX}
+            response = HttpResponse('Страница')
+            patch_vary_headers(response, ['Cookie'])
+            return response
+
+        self.assertNotIn('Surrogate-Key', edge.EdgeCacheMiddleware(view)(RequestFactory().get('/')))
+
+    def test_purge_batched_after_commit(self):
+        # ключи из setUp не отправлены: в TestCase транзакция не фиксируется
+        edge.local.keys = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.title = 'Новый заголовок'
+            self.article.save()
+            Comment.objects.create(article=self.article, author='Гость', content='Комментарий')
+            self.assertEqual(StubProxy.requests, [])
+        edge.wait()
+        # заголовок не меняет меню, ключ статьи отправлен один раз
+        self.assertEqual(StubProxy.requests, [('PURGE', 'a%d index r%d' % (self.article.pk, self.rubric.pk))])
+
+
+@override_settings(PROFILE_DIR=os.path.join(TEST_ROOT, 'profiles'), PROFILE_INTERVAL=0.001)
+class ProfilerTest(TestCase):
+    def setUp(self):
+        self.root = temp_dir(self, 'profiles')
+
+    def test_profile_only_with_staff_token(self):
+        self.assertNotIn('X-Profile', self.client.get('/'))
+        user = AdvUser.objects.create(username='guest')
+        self.assertNotIn('X-Profile', self.client.get('/', HTTP_X_PROFILE=make_token(user)))
+        self.assertEqual(os.listdir(self.root), [])
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get('/', {'profile': make_token(user)})
+        name = response['X-Profile'].split()[0]
+        self.assertTrue(name.endswith('-index.folded'))
+        self.assertEqual(os.listdir(self.root), [name])
+
+
+@override_settings(METRICS_DIR=os.path.join(TEST_ROOT, 'metrics'))
+class MetricsTest(RubricFixture, TestCase):
+    def setUp(self):
+        self.root = temp_dir(self, 'metrics')
+        # файл процесса открывается заново в новом каталоге
+        metrics.values_pid = None
+        self.addCleanup(setattr, metrics, 'values_pid', None)
+
+    def test_mmaped_dict_sums_processes(self):
+        first = metrics.MmapedDict(os.path.join(self.root, '1.db'), size=64)
+        for i in range(50):
+            first.inc('key%d' % i, i)
+        second = metrics.MmapedDict(os.path.join(self.root, '2.db'))
+        second.inc('key1', 10)
+        # файл перечитывается с уже записанными ключами
+        metrics.MmapedDict(os.path.join(self.root, '1.db')).inc('key49', 1)
+        totals = metrics.collect()
+        self.assertEqual(totals['key1'], 11)
+        self.assertEqual(totals['key49'], 50)
+
+    def test_endpoint(self):
+        self.client.get('/')
+        response = self.client.get('/metrics/')
+        text = response.content.decode()
+        self.assertIn('http_requests_total{route="main:index",status="200"} 1.0', text)
+        self.assertIn('http_request_duration_seconds_bucket{le="+Inf",route="main:index"} 1.0', text)
+        self.assertIn('# TYPE publish_queue_pending gauge', text)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+    def test_cache_requests_and_cached_gauges(self):
+        cache.clear()
+        Article.objects.create(rubric=self.rubric, author=self.author, title='Бахиана', content='Текст',
+                               characters='Эйтор Вилла-Лобос (1887-1959)')
+        index = typeahead.PrefixIndex()
+        for _ in range(2):
+            self.client.get('/about/')
+            index.search('ба')
+        text = metrics.render()
+        for name in ('pages', 'typeahead'):
+            for result in ('hit', 'miss'):
+                self.assertIn('cache_requests_total{cache="%s",result="%s"} 1.0' % (name, result), text)
+        # счетчики очередей пересчитываются не на каждый опрос
+        with self.assertNumQueries(0):
+            self.assertIn('publish_queue_pending 0.0', metrics.render())
+
+
+# настройки для проверки Geniusroom/wsgi.py в отдельном процессе
+FORK_SETTINGS = '''
+from django.core.cache.backends.locmem import LocMemCache
+from Geniusroom.settings import *
+
+DATABASES['default']['NAME'] = %r
+CACHES = {'default': {'BACKEND': 'fork_settings.ConnectionCache'}}
+
+
+class ConnectionCache(LocMemCache):
+    # как клиент memcached: соединение открывается первым обращением
+    connected = False
+
+    def make_key(self, *args, **kwargs):
+        self.connected = True
+        return super().make_key(*args, **kwargs)
+
+    def close(self, **kwargs):
+        self.connected = False
+'''
+
+
+class StartupTest(TestCase):
+    # бюджеты в несколько раз больше измеренного (0.5 c и 0.02 c): ловят только регрессии
+    IMPORT_BUDGET = 2.0
+    APP_IMPORT_BUDGET = 0.1
+
+    def test_ready_after_warmup(self):
+        response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ready'])
+
+    def test_no_connections_left_for_workers(self):
+        # с preload_app все открытое в мастере после прогрева достается воркерам
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'fork_settings.py'), 'w') as f:
+            f.write(FORK_SETTINGS % os.path.join(directory, 'db.sqlite3'))
+        code = '\n'.join((
+            'import django; django.setup()',
+            'from django.core.management import call_command; call_command("migrate", verbosity=0)',
+            'from django.db import connections; connections.close_all()',
+            'import Geniusroom.wsgi',
+            'from django.core.cache import caches',
+            'from Geniusroom.apps.main.warmup import state',
+            'print(state["ready"], caches["default"].connected, any(c.connection for c in connections.all()))',
+        ))
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='fork_settings',
+                   PYTHONPATH=os.pathsep.join((directory, str(django_settings.BASE_DIR))))
+        result = subprocess.run([sys.executable, '-c', code], env=env, cwd=django_settings.BASE_DIR,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ['True', 'False', 'False'])
+
+    def test_import_time_budget(self):
+        code = "import django; django.setup(); import Geniusroom.urls"
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='Geniusroom.settings')
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                                cwd=django_settings.BASE_DIR, capture_output=True, text=True, check=True)
+        total = app = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            if not name.startswith('  '):
+                # модуль верхнего уровня: его время включает все вложенные
+                total += int(cumulative)
+            if name.strip().startswith('Geniusroom'):
+                app += int(own)
+        self.assertLess(total / 1e6, self.IMPORT_BUDGET)
+        self.assertLess(app / 1e6, self.APP_IMPORT_BUDGET)
+
+
+class ThreadedCommentTest(RubricFixture, TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(rubric=self.rubric, author=self.author, title='Статья', content='Текст',
+                                              characters='Иоганн Себастьян Бах (1685-1750)')
+
+    def comment(self, name, parent=None):
+        return Comment.objects.create(article=self.article, parent=parent, author=name, content=name)
+
+    def test_tree_order_and_subtree_moderation(self):
+        first = self.comment('1')
+        second = self.comment('2')
+        reply = self.comment('1.1', first)
+        self.comment('1.1.1', reply)
+        self.comment('2.1', second)
+        self.comment('1.2', first)
+
+        with self.assertNumQueries(2):
+            tree = Comment.objects.threads(self.article)
+        self.assertEqual([(c.author, c.depth) for c in tree],
+                         [('1', 0), ('1.1', 1), ('1.1.1', 2), ('1.2', 1), ('2', 0), ('2.1', 1)])
+        self.assertEqual([c.author for c in Comment.objects.threads(self.article, start=1, count=1)], ['2', '2.1'])
+
+        # скрывается одна строка, ответы на нее пропадают вместе с ней
+        Comment.objects.filter(pk=reply.pk).update(is_active=False)
+        self.assertEqual([c.author for c in Comment.objects.threads(self.article)], ['1', '1.2', '2', '2.1'])
+        self.assertEqual([c.author for c in Comment.objects.thread(self.article, first.path)], ['1', '1.2'])
+
+    def test_reply_form(self):
+        other = Article.objects.create(rubric=self.article.rubric, author=self.article.author, title='Другая',
+                                       content='Текст', characters='Георг Фридрих Гендель (1685-1759)')
+        parent = self.comment('1')
+        url = '/%d/%d/' % (self.article.rubric_id, self.article.pk)
+        self.client.post(url, {'article': other.pk, 'parent': parent.pk, 'author': 'Гость', 'content': 'Нет'})
+        self.assertFalse(parent.replies.exists())
+
+        AdvUser.objects.create_user(username='handel', password='password')
+        self.client.login(username='handel', password='password')
+        self.assertContains(self.client.get(url + '?reply=%d' % parent.pk),
+                            'name="parent" value="%d"' % parent.pk)
+        self.client.post(url, {'article': self.article.pk, 'parent': parent.pk, 'author': 'handel', 'content': 'Да'})
+        self.assertEqual(parent.replies.get().path, parent.path + path_segment(parent.replies.get().pk))
+
+    def test_path_ready_for_receivers(self):
+        paths = []
+        receiver = lambda sender, instance, **kwargs: paths.append(instance.path)
+        post_save.connect(receiver, sender=Comment, weak=False, dispatch_uid='path')
+        self.addCleanup(post_save.disconnect, sender=Comment, dispatch_uid='path')
+        root = self.comment('1')
+        with CaptureQueriesContext(connection) as queries:
+            reply = self.comment('1.1', root)
+        self.assertEqual(paths, [root.path, root.path + path_segment(reply.pk)])
+        self.assertEqual(Comment.objects.get(pk=reply.pk).path, paths[1])
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('UPDATE "main_comment"')])
+
+        # id удаленных (и архивных) комментариев не выдаются повторно
+        last = reply.pk
+        reply.delete()
+        self.assertGreater(self.comment('2').pk, last)
+
+
+class ArchiveTest(RubricFixture, TestCase):
+    def test_archived_article_stays_readable(self):
+        old, fresh = [Article.objects.create(rubric=self.rubric, author=self.author, title=title, content='Текст',
+                                             characters='Иоганн Себастьян Бах (1685-1750)', is_active=False)
+                      for title in ('Старая', 'Новая')]
+        Article.objects.filter(pk=old.pk).update(created_at=old.created_at - timedelta(days=400),
+                                                 image='ab/cd/abcd.jpg')
+        MediaFile.objects.create(name='ab/cd/abcd.jpg', refs=1)
+        root = Comment.objects.create(article=old, author='Гость', content='Вопрос')
+        Comment.objects.create(article=old, parent=root, author='Автор', content='Ответ')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_articles', stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(Article.objects.values_list('pk', flat=True)), [fresh.pk])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(ArchivedArticle.objects.get().archivedcomment_set.count(), 2)
+        # django_cleanup снял ссылку удаленной статьи, архивная осталась
+        self.assertEqual(MediaFile.objects.get().refs, 1)
+
+        response = self.client.get('/%d/%d/' % (self.rubric.pk, old.pk))
+        self.assertContains(response, 'Старая')
+        self.assertContains(response, 'Ответ')
+        self.assertContains(response, 'Статья в архиве')
+
+
+class StatsTest(RubricFixture, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.baroque = cls.rubric
+        cls.romantic = SubRubric.objects.create(name='Романтизм', super_rubric=cls.classic)
+
+    def setUp(self):
+        self.articles = [Article.objects.create(rubric=self.baroque, author=self.author, title=title, content='Текст',
+                                                characters='Иоганн Себастьян Бах (1685-1750)')
+                         for title in ('Первая', 'Вторая')]
+
+    def stats(self):
+        return dict(RubricStats.objects.values_list('rubric_id', 'active_count'))
+
+    def test_new_subrubric_gets_row(self):
+        rubric = SubRubric.objects.create(name='Классицизм', super_rubric=self.classic)
+        self.assertEqual(self.stats()[rubric.pk], 0)
+        self.assertEqual(RubricStats.objects.get(rubric=rubric).latest_article, None)
+
+    def test_backfill_migration(self):
+        from django.apps import apps
+        RubricStats.objects.all().delete()
+        empty = SuperRubric.objects.create(name='Джаз')
+        import_module('Geniusroom.apps.main.migrations.0019_rubricstats_fill').fill_stats(apps, None)
+        self.assertEqual(self.stats(), {self.classic.pk: 2, self.baroque.pk: 2, self.romantic.pk: 0, empty.pk: 0})
+        self.assertEqual(RubricStats.objects.get(rubric=self.classic).latest_article, self.articles[1])
+
+    def test_save_uses_loaded_state(self):
+        article = Article.objects.get(pk=self.articles[0].pk)
+        article.title = 'Первая статья'
+        with CaptureQueriesContext(connection) as queries:
+            article.save()
+        # ни перечитывания статьи, ни пересчета рубрик
+        self.assertFalse([q['sql'] for q in queries if 'FROM "main_article"' in q['sql']
+                          or 'main_rubricstats' in q['sql']])
+
+        article.rubric = self.romantic
+        article.save()
+        self.assertEqual(self.stats(), {self.classic.pk: 2, self.baroque.pk: 1, self.romantic.pk: 1})
+        article.is_active = False
+        article.save()
+        self.assertEqual(self.stats(), {self.classic.pk: 1, self.baroque.pk: 1, self.romantic.pk: 0})
+
+
+class TypeaheadTest(RubricFixture, TestCase):
+    def setUp(self):
+        cache.clear()
+        rows = (
+            ('Ёлка', 'Иоганн Себастьян Бах (1685-1750)'),
+            ('Фуга', 'Иоганн Себастьян Бах (1685-1750), Дмитрий Шостакович (1906-1975)'),
+            ('Бахиана', 'Эйтор Вилла-Лобос (1887-1959)'),
+        )
+        now = timezone.now()
+        self.articles = []
+        for age, (title, characters) in enumerate(rows):
+            article = Article.objects.create(rubric=self.rubric, author=self.author, title=title, content='Текст',
+                                             characters=characters)
+            Article.objects.filter(pk=article.pk).update(created_at=now - timedelta(days=len(rows) - age))
+            self.articles.append(article)
+        self.index = typeahead.PrefixIndex()
+        self.index.build()
+
+    def labels(self, query):
+        return [item['label'] for item in self.index.search(query)]
+
+    def test_folding_and_ranking(self):
+        self.assertEqual(self.labels('елк'), ['Ёлка'])
+        self.assertEqual(self.labels('ШОСТ'), ['Дмитрий Шостакович'])
+        # свежие первыми, одна подпись - одна подсказка
+        self.assertEqual(self.labels('бах'), ['Бахиана', 'Иоганн Себастьян Бах'])
+        self.assertEqual(self.index.search('ба')[0]['article'], self.articles[2].pk)
+
+    def test_results_are_copies(self):
+        self.index.search('ба')[0]['url'] = '/'
+        self.assertNotIn('url', self.index.search('ба')[0])
+
+    def test_short_prefixes_cache_is_bounded(self):
+        for query in ('zz', 'qq', 'ъ'):
+            self.assertEqual(self.labels(query), [])
+        self.assertEqual(len(self.index.short), 0)
+        with mock.patch.object(typeahead, 'SHORT_SIZE', 2):
+            for query in ('ба', 'фу', 'ио', 'ба'):
+                self.index.search(query)
+        self.assertEqual(list(self.index.short), [('ио', 10), ('ба', 10)])
+
+    def test_other_worker_catches_up(self):
+        article = self.articles[0]
+        article.title = 'Токката'
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+            self.articles[1].delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.index.sync()
+        self.assertEqual(self.labels('токк'), ['Токката'])
+        # изменения дочитываются по pk, без перестроения
+        self.assertEqual(len(queries), 1)
+        self.assertIn(' IN (', queries[0]['sql'])
+        self.assertEqual(self.labels('шост'), [])
+        self.assertEqual(self.labels('елк'), [])
+
+        typeahead.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            self.index.sync()
+        self.assertEqual(self.labels('токк'), ['Токката'])
+        self.assertNotIn(' IN (', queries[0]['sql'])
+
+    def test_index_changes_after_commit(self):
+        typeahead.index.build()
+        article = self.articles[0]
+        article.title = 'Токката'
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                article.save()
+                raise RuntimeError
+        # откаченное сохранение не попадает в индекс и не считается изменением
+        self.assertEqual(typeahead.index.search('токк'), [])
+        self.assertEqual(typeahead.index.version, typeahead.current_version())
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+        self.assertEqual([item['label'] for item in typeahead.index.search('токк')], ['Токката'])
+        # своя копия индекса принимает новую версию без перестроения
+        self.assertEqual(typeahead.index.version, typeahead.current_version())
+
+
+class ViewCounterTest(RubricFixture, TestCase):
+    def test_views_coalesced_into_batched_update(self):
+        cache.clear()
+        first, second = [Article.objects.create(rubric=self.rubric, author=self.author, title=title, content='Текст',
+                                                characters='Иоганн Себастьян Бах (1685-1750)')
+                         for title in ('Первая', 'Вторая')]
+        counters.take()
+        url = '/%d/%d/' % (self.rubric.pk, first.pk)
+        for _ in range(3):
+            self.client.get(url)
+        # опубликованная страница считает просмотр через /fragments/: раз на клиента
+        for _ in range(3):
+            self.client.get('/fragments/?names=auth&article=%d' % second.pk)
+        self.client.get('/fragments/?names=auth&article=%d' % second.pk, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(Article.objects.get(pk=first.pk).views, 0)
+
+        # правка статьи, загруженной до записи, не затирает просмотры
+        stale = Article.objects.get(pk=first.pk)
+        with self.assertNumQueries(3):
+            self.assertEqual(counters.flush(), 5)
+        stale.title = 'Первая статья'
+        stale.save_keeping_views()
+        self.assertEqual(dict(Article.objects.values_list('title', 'views')), {'Первая статья': 3, 'Вторая': 2})
+        self.assertEqual(counters.flush(), 0)
+
+
+class TrendingTest(RubricFixture, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.articles = [Article.objects.create(rubric=self.rubric, author=self.author, title=title, content='Текст',
+                                                characters='Иоганн Себастьян Бах (1685-1750)')
+                         for title in ('Первая', 'Вторая', 'Третья')]
+
+    def comment(self, article):
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=article, author='Гость', content='Текст')
+
+    def test_decayed_ranking(self):
+        now = timezone.now()
+        # два комментария TRENDING_HALF_LIFE назад весят как один сейчас
+        earlier = now - timedelta(seconds=django_settings.TRENDING_HALF_LIFE)
+        self.assertAlmostEqual(trending.bump(trending.bump(None, earlier), earlier), trending.bump(None, now))
+
+        first, second, third = self.articles
+        self.comment(first)
+        self.comment(second)
+        self.comment(second)
+        self.assertEqual([e['title'] for e in trending.top()], ['Вторая', 'Первая'])
+        with self.assertNumQueries(0):
+            trending.top()
+        self.assertContains(self.client.get('/'), 'Обсуждают сейчас')
+
+        second.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertEqual([e['title'] for e in trending.top()], ['Первая'])
+
+    def test_compaction(self):
+        first, second, _ = self.articles
+        self.comment(first)
+        self.comment(second)
+        TrendingArticle.objects.filter(article=first).update(rank=trending.time_rank(timezone.now()) - 20)
+        self.assertEqual(trending.compact(), 1)
+        self.assertEqual([e['title'] for e in trending.top()], ['Вторая'])
+
+
+class AdmissionTest(RubricFixture, TestCase):
+    def setUp(self):
+        cache.clear()
+        admission.state.update(in_flight=0, latency=0.0, updated=0.0)
+        self.article = Article.objects.create(rubric=self.rubric, author=self.author, title='Статья', content='Текст',
+                                              characters='Иоганн Себастьян Бах (1685-1750)')
+
+    def get(self, url, waited):
+        # как nginx: $msec в момент получения запроса
+        return self.client.get(url, HTTP_X_REQUEST_START='t=%.3f' % (time.time() - waited))
+
+    def test_sheds_low_priority_and_keeps_articles(self):
+        detail = '/%d/%d/' % (self.rubric.pk, self.article.pk)
+        self.assertEqual(self.get('/', 0).status_code, 200)
+        self.get('/api/v1/articles/', 0)
+
+        response = self.get('/', 2)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(django_settings.ADMISSION_RETRY_AFTER))
+        self.assertEqual(self.get('/%d/?keyword=Бах' % self.rubric.pk, 2).status_code, 503)
+        self.assertEqual(self.get(detail, 2).status_code, 200)
+        # ответ API из кэша отдается, промах - нет
+        self.assertEqual(self.get('/api/v1/articles/', 2).status_code, 200)
+        self.assertEqual(self.get('/api/v1/articles/?fields=id', 2).status_code, 503)
+        # клиент, ждавший дольше срока, ответа уже не прочтет
+        self.assertEqual(self.get(detail, django_settings.ADMISSION_DEADLINE + 1).status_code, 503)
+
+    def test_publish_renders_not_shed(self):
+        admission.record(20, time.time())
+        latency = admission.state['latency']
+        self.assertEqual(publish.fetch('/').status_code, 200)
+        self.assertEqual(publish.fetch('/%d/' % self.rubric.pk).status_code, 200)
+        self.assertEqual(admission.state['latency'], latency)
+        self.assertEqual(self.get('/', 0).status_code, 503)
+
+    def test_recent_latency_decays(self):
+        now = time.time()
+        admission.record(20, now)
+        self.assertTrue(admission.overloaded(0, now))
+        self.assertFalse(admission.overloaded(0, now + 10 * admission.LATENCY_HALF_LIFE))
+
+    def test_in_flight_limit_only_for_threaded_workers(self):
+        admission.state['in_flight'] = 3
+        self.assertFalse(admission.overloaded(0, time.time()))
+        with override_settings(ADMISSION_MAX_IN_FLIGHT=2):
+            self.assertTrue(admission.overloaded(0, time.time()))
+
+
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def hit(self, at):
+        # подменяются только часы окна, срок ключей в кэше идет по настоящим
+        with mock.patch.object(throttling, 'time') as clock:
+            clock.time.return_value = 600 * 60 + at
+            return throttling.hit('test', 2, 60)
+
+    def test_rejected_requests_do_not_spend_budget(self):
+        self.assertEqual([self.hit(0), self.hit(1)], [(True, 0), (True, 0)])
+        # в следующем окне два запроса этого станут вкладом 2 * (1 - elapsed / 60)
+        self.assertEqual(self.hit(2), (False, 88))
+        for _ in range(10):
+            self.hit(3)
+        self.assertEqual(cache.get('rl:test:600'), 2)
+
+        # середина следующего окна: вклад предыдущего 1, места - на один запрос
+        self.assertEqual(self.hit(90), (True, 0))
+        self.assertEqual(self.hit(91), (False, 29))
+        self.assertEqual(self.hit(120), (True, 0))
+
+    @override_settings(RATELIMITS={'login': '1/m'})
+    def test_view_answers_429(self):
+        data = {'username': 'bach', 'password': 'wrong'}
+        self.assertEqual(self.client.post('/accounts/login/', data).status_code, 200)
+        response = self.client.post('/accounts/login/', data)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.client.get('/accounts/login/').status_code, 200)
+
+
+class PurgeStaleTest(TestCase):
+    def test_batched_purge(self):
+        now = timezone.now()
+        for name, activated, joined in (('old1', False, 40), ('old2', False, 40), ('new', False, 1), ('ok', True, 40)):
+            AdvUser.objects.create(username=name, is_activated=activated, is_active=activated,
+                                   date_joined=now - timedelta(days=joined))
+        for key, expires in (('a' * 32, -1), ('b' * 32, -1), ('c' * 32, 1)):
+            Session.objects.create(session_key=key, session_data='', expire_date=now + timedelta(days=expires))
+        CaptchaStore.objects.create(challenge='1+1', response='2', hashkey='x', expiration=now - timedelta(hours=1))
+
+        out = StringIO()
+        call_command('purge_stale', '--dry-run', stdout=out)
+        self.assertIn('users: к удалению 2', out.getvalue())
+        self.assertEqual(AdvUser.objects.count(), 4)
+
+        out = StringIO()
+        call_command('purge_stale', '--batch-size', '1', '--sleep', '0', '-v', '2', stdout=out)
+        self.assertEqual(sorted(AdvUser.objects.values_list('username', flat=True)), ['new', 'ok'])
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['c' * 32])
+        self.assertFalse(CaptchaStore.objects.exists())
+        self.assertEqual(out.getvalue().count('sessions: удалено 1 за'), 2)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(TEST_ROOT, 'storage'))
+class StorageTest(RubricFixture, TransactionTestCase):
+    # django_cleanup удаляет файлы в on_commit, а откат записи нужен настоящий
+    def setUp(self):
+        temp_dir(self, 'storage')
+        # TransactionTestCase не вызывает setUpTestData
+        self.create_rubric()
+        self.article = Article.objects.create(rubric=self.rubric, author=self.author, title='Статья', content='Текст',
+                                              characters='Иоганн Себастьян Бах (1685-1750)', import_key='bach')
+
+    def upload(self, name='bach.png', content=b'\x89PNG same bytes'):
+        return AdditionalImage.objects.create(article=self.article, image=SimpleUploadedFile(name, content))
+
+    def test_refs_follow_records(self):
+        first, second = self.upload(), self.upload('copy.PNG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(MediaFile.objects.get(name=first.image.name).refs, 2)
+        path = first.image.path
+
+        first.delete()
+        self.assertEqual(MediaFile.objects.get(name=second.image.name).refs, 1)
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_failed_save_keeps_refs(self):
+        name = self.upload().image.name
+        duplicate = Article(rubric=self.article.rubric, author=self.article.author, title='Копия', content='Текст',
+                            characters=self.article.characters, import_key='bach',
+                            image=SimpleUploadedFile('bach.png', b'\x89PNG same bytes'))
+        with self.assertRaises(IntegrityError):
+            duplicate.save()
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 1)
+
+    def test_migrate_media(self):
+        os.makedirs(os.path.join(django_settings.MEDIA_ROOT, 'old'))
+        for name in ('old/a.png', 'old/b.png'):
+            with open(os.path.join(django_settings.MEDIA_ROOT, name), 'wb') as f:
+                f.write(b'\x89PNG legacy')
+        images = [AdditionalImage.objects.create(article=self.article, image=name)
+                  for name in ('old/a.png', 'old/b.png')]
+        call_command('migrate_media', sleep=0, stdout=StringIO())
+
+        names = {image.image.name for image in AdditionalImage.objects.filter(pk__in=[i.pk for i in images])}
+        self.assertEqual(len(names), 1)
+        name, = names
+        self.assertRegex(name, r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertTrue(os.path.exists(os.path.join(django_settings.MEDIA_ROOT, name)))
+        self.assertFalse(os.path.exists(os.path.join(django_settings.MEDIA_ROOT, 'old', 'a.png')))
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 2)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(TEST_ROOT, 'import', 'media'),
+                   PUBLIC_ROOT=os.path.join(TEST_ROOT, 'import', 'public'))
+class ImportTest(RubricFixture, TestCase):
+    def setUp(self):
+        self.root = temp_dir(self, 'import')
+        from PIL import Image
+        Image.new('RGB', (400, 300), 'white').save(os.path.join(self.root, 'bach.png'))
+
+    def record(self, key, **fields):
+        record = {'key': key, 'title': 'Статья %s' % key, 'content': 'Текст', 'source': 'Источник',
+                  'characters': 'Иоганн Себастьян Бах (1685-1750)', 'rubric': 'Барокко'}
+        record.update(fields)
+        return record
+
+    def run_import(self, records, **options):
+        source = os.path.join(self.root, 'articles.jsonl')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        out, err = StringIO(), StringIO()
+        call_command('import_articles', source, images=self.root, author='bach', jobs=1, stdout=out, stderr=err,
+                     **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_validation_and_is_active(self):
+        out, err = self.run_import([
+            self.record('a', is_active='FALSE'), self.record('b', is_active='no'), self.record('c', is_active='Да'),
+            self.record('d', is_active='может быть'), self.record('e', rubric='Джаз'), self.record('f', title=''),
+            self.record('g', title=123), self.record('h', content=None), self.record('i', rubric=['Барокко']),
+            [1, 2],
+        ])
+        self.assertIn('Создано: 3, пропущено (уже импортированы): 0, с ошибками: 7', out)
+        self.assertIn('Запись 7: поле title должно быть строкой', err)
+        self.assertIn('Запись 8: не заполнено поле content', err)
+        self.assertIn('Запись 9: поле rubric должно быть строкой', err)
+        self.assertIn('Запись 10: запись должна быть объектом', err)
+        self.assertIn("Запись 4: неверное значение is_active 'может быть'", err)
+        self.assertIn("Запись 5: неизвестная рубрика 'Джаз'", err)
+        self.assertIn('Запись 6: не заполнено поле title', err)
+        self.assertEqual(dict(Article.objects.values_list('import_key', 'is_active')),
+                         {'a': False, 'b': False, 'c': True})
+
+    def test_imported_pages_published_and_purged(self):
+        rubric = self.rubric
+        edge.local.keys = None
+        self.addCleanup(setattr, edge.local, 'keys', None)
+        with override_settings(PUBLISH_MODE=True, EDGE_CACHE_ENABLED=True):
+            self.run_import([self.record('a'), self.record('b', is_active=False)])
+        article = Article.objects.get(import_key='a')
+        self.assertEqual(set(PublishTarget.objects.values_list('path', flat=True)), {
+            '/_fragments/nav.html', '/', '/%d/' % rubric.pk, '/%d/%d/' % (rubric.pk, article.pk)})
+        self.assertEqual(edge.local.keys, {'index', 'nav', 'r%d' % rubric.pk})
+
+    def test_chunks_idempotency_and_resume(self):
+        records = [self.record(str(i)) for i in range(5)]
+        state = os.path.join(self.root, 'state')
+        out, _ = self.run_import(records[:3], chunk_size=2, state=state)
+        self.assertIn('Создано: 3, пропущено (уже импортированы): 0', out)
+        with open(state) as f:
+            self.assertEqual(f.read(), '3')
+
+        # повтор с начала не создает дублей, продолжение пропускает записи до контрольной точки
+        out, _ = self.run_import(records, chunk_size=2)
+        self.assertIn('Создано: 2, пропущено (уже импортированы): 3', out)
+        Article.objects.filter(import_key__in=['3', '4']).delete()
+        out, _ = self.run_import(records, chunk_size=2, state=state)
+        self.assertIn('Продолжение с записи 3', out)
+        self.assertIn('Создано: 2, пропущено (уже импортированы): 0', out)
+        self.assertEqual(Article.objects.count(), 5)
+
+    def test_failed_chunk_leaves_no_files(self):
+        records = [self.record('a', image='bach.png', images=[{'file': 'bach.png', 'caption': 'Бах'}])]
+        with mock.patch.object(AdditionalImage.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.run_import(records)
+        self.assertFalse(Article.objects.exists())
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(django_settings.MEDIA_ROOT) if files], [])
+
+        self.run_import(records)
+        article = Article.objects.get()
+        self.assertEqual(MediaFile.objects.get(name=article.image.name).refs, 2)
+        self.assertTrue(os.path.exists(article.image.path))
+
+
+@override_settings(MEDIA_ROOT=os.path.join(TEST_ROOT, 'upload', 'media'),
+                   RESUMABLE_UPLOAD_DIR=os.path.join(TEST_ROOT, 'upload', 'resumable'))
+class UploadTest(RubricFixture, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author.set_password('password')
+        cls.author.save()
+
+    def setUp(self):
+        temp_dir(self, 'upload')
+        os.makedirs(django_settings.RESUMABLE_UPLOAD_DIR)
+        self.client.login(username='bach', password='password')
+
+    def image(self, size=(400, 300)):
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', size, 'white').save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def post(self, **data):
+        fields = {'rubric': self.rubric.pk, 'title': 'Статья', 'content': 'Текст', 'source': 'Источник',
+                  'characters': 'Иоганн Себастьян Бах (1685-1750)', 'author': self.author.pk, 'is_active': 'on',
+                  'additionalimage_set-TOTAL_FORMS': 0, 'additionalimage_set-INITIAL_FORMS': 0}
+        fields.update(data)
+        return self.client.post('/accounts/profile/add', fields)
+
+    def test_limits_checked_while_streaming(self):
+        with override_settings(UPLOAD_MAX_FILE_SIZE=1024):
+            response = self.post(image=SimpleUploadedFile('big.jpg', self.image()))
+        self.assertContains(response, 'Файл «big.jpg» больше 1,0')
+        with override_settings(UPLOAD_MAX_PIXELS=1000):
+            self.assertContains(self.post(image=SimpleUploadedFile('wide.jpg', self.image())),
+                                'Изображение «wide.jpg» больше 0.001 мегапикселей')
+        self.assertContains(self.post(image=SimpleUploadedFile('text.jpg', b'not an image')),
+                            'Файл «text.jpg» не является изображением')
+        self.assertFalse(Article.objects.exists())
+
+        self.assertEqual(self.post(image=SimpleUploadedFile('ok.jpg', self.image())).status_code, 302)
+        self.assertEqual(Article.objects.get().image.width, 300)
+
+    def test_resumable_upload(self):
+        content = self.image((1200, 900))
+        token = self.client.post('/accounts/profile/upload/', {'name': 'large.jpg', 'size': len(content)}).json()['token']
+        url = '/accounts/profile/upload/?token=' + token
+        half = len(content) // 2
+        self.assertEqual(self.client.post(url + '&offset=0', content[:half],
+                                          content_type='application/octet-stream').json()['offset'], half)
+        # повтор уже принятой части после обрыва
+        response = self.client.post(url + '&offset=0', content[:half], content_type='application/octet-stream')
+        self.assertEqual((response.status_code, response.json()['offset']), (409, half))
+        self.assertEqual(self.client.get(url).json()['offset'], half)
+        self.assertTrue(self.client.post(url + '&offset=%d' % half, content[half:],
+                                         content_type='application/octet-stream').json()['complete'])
+
+        # чужой токен не принимается, даже если в поле author подставлен его владелец
+        AdvUser.objects.create_user(username='handel', password='password')
+        self.client.login(username='handel', password='password')
+        self.assertContains(self.post(image_upload=token), 'Загрузка не найдена')
+        self.assertFalse(Article.objects.exists())
+
+        self.client.login(username='bach', password='password')
+        self.assertEqual(self.post(image_upload=token).status_code, 302)
+        self.assertEqual(Article.objects.get().image.width, 300)
+        self.assertEqual(os.listdir(django_settings.RESUMABLE_UPLOAD_DIR), [])
+
+
+class StaticPageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_page_and_cheap_404(self):
+        rendered = []
+        template_rendered.connect(lambda sender, template, **kwargs: rendered.append(template.name), weak=False,
+                                  dispatch_uid='static-page-test')
+        self.addCleanup(template_rendered.disconnect, dispatch_uid='static-page-test')
+
+        response = self.client.get('/about/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('data-fragment', response.content.decode())
+        etag = response['ETag']
+        rendered.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/about/').content, response.content)
+        self.assertEqual(self.client.get('/about/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(rendered, [])
+
+        # меню рубрик на странице: новая версия данных - новая копия
+        SubRubric.objects.create(name='Барокко', super_rubric=SuperRubric.objects.create(name='Классика'))
+        self.assertNotEqual(self.client.get('/about/')['ETag'], etag)
+
+        rendered.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get('/wp-login.php/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(rendered, [])
+
+
+class RejectingEmailBackend(locmem.EmailBackend):
+    # как SMTP-сервер, не принимающий адреса в домене .invalid
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.endswith('.invalid') for address in message.to):
+                raise smtplib.SMTPRecipientsRefused({address: (550, b'No such user') for address in message.to})
+        return super().send_messages(messages)
+
+
+class CommentDigestTest(TestCase):
+    def test_digest_batches_mail_per_author(self):
+        rubric = SubRubric.objects.create(name='Барокко', super_rubric=SuperRubric.objects.create(name='Классика'))
+        bach = AdvUser.objects.create(username='bach', email='bach@example.com')
+        handel = AdvUser.objects.create(username='handel', email='handel@example.com', comment_digest=False)
+        articles = [Article.objects.create(rubric=rubric, author=author, title='Статья', content='Текст',
+                                           characters='Иоганн Себастьян Бах (1685-1750)')
+                    for author in (bach, bach, handel)]
+        for article in articles:
+            for i in range(3):
+                Comment.objects.create(article=article, author='Гость', content='Комментарий %d' % i)
+        # сразу - только автору без сводки, по письму на комментарий
+        self.assertEqual([message.to for message in mail.outbox], [['handel@example.com']] * 3)
+        mail.outbox.clear()
+
+        self.assertEqual(digests.send_digests(), 0)
+        later = timezone.now() + timedelta(seconds=django_settings.COMMENT_DIGEST_INTERVAL)
+        with self.assertNumQueries(3):
+            self.assertEqual(digests.send_digests(later), 1)
+        self.assertEqual(mail.outbox[0].to, ['bach@example.com'])
+        self.assertEqual(mail.outbox[0].subject, 'Новые комментарии к Вашим статьям: 6')
+        self.assertEqual(mail.outbox[0].alternatives[0][0].count('<blockquote>'), 6)
+        self.assertEqual(digests.send_digests(later), 0)
+
+        bach.refresh_from_db()
+        self.assertEqual(bach.digest_sent_at, later - digests.SETTLE)
+        self.assertIn('comment_digests_sent_total{}', metrics.render())
+
+    @override_settings(EMAIL_BACKEND='Geniusroom.apps.main.tests.RejectingEmailBackend')
+    def test_rejected_address_does_not_stall_others(self):
+        rubric = SubRubric.objects.create(name='Барокко', super_rubric=SuperRubric.objects.create(name='Классика'))
+        authors = [AdvUser.objects.create(username=name, email=email) for name, email in (
+            ('bach', 'bach@example.com'), ('handel', 'handel@example.invalid'), ('admin', ''))]
+        for author in authors:
+            article = Article.objects.create(rubric=rubric, author=author, title='Статья', content='Текст',
+                                             characters='Иоганн Себастьян Бах (1685-1750)')
+            Comment.objects.create(article=article, author='Гость', content='Комментарий')
+
+        later = timezone.now() + timedelta(seconds=django_settings.COMMENT_DIGEST_INTERVAL)
+        with self.assertLogs('Geniusroom.apps.main.digests', 'ERROR'):
+            self.assertEqual(digests.send_digests(later), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['bach@example.com']])
+        sent_at = dict(AdvUser.objects.values_list('username', 'digest_sent_at'))
+        self.assertEqual(sent_at['bach'], later - digests.SETTLE)
+        # непринятое письмо повторится, автору без адреса сводка не собирается
+        self.assertLess(sent_at['handel'], later - digests.SETTLE)
+        self.assertEqual(digests.pending(later).filter(article__author__username='admin').count(), 0)
+        with self.assertLogs('Geniusroom.apps.main.digests', 'ERROR'):
+            self.assertEqual(digests.send_digests(later), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class SqliteTest(TestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'только для SQLite')
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            for name, value in (('busy_timeout', 5000), ('synchronous', 1), ('temp_store', 2),
+                                ('cache_size', -64 * 1024)):
+                cursor.execute('PRAGMA %s' % name)
+                self.assertEqual(cursor.fetchone()[0], value, name)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(TEST_ROOT, 'budget'))
+class BudgetTest(TestCase):
+    """Бюджеты каждого маршрута main: запросы к БД и отрисованные шаблоны
+    (не больше) и время ответа (с запасом BUDGET_TOLERANCE раз).
+
+    Новый маршрут без строки в BUDGETS роняет тест; исправленный N+1
+    закрепляется уменьшением числа в таблице.
+    """
+    # маршрут: (запросов и шаблонов для анонима), (то же для вошедшего пользователя) - верхние границы;
+    # закрытые страницы аноним получает перенаправлением на вход
+    BUDGETS = {
+        'index': ((2, 5), (4, 5)),
+        'detail_img': ((0, 0), (0, 0)),
+        'detail': ((7, 25), (8, 17)),
+        'by_rubric': ((4, 9), (6, 9)),
+        'typeahead': ((0, 0), (0, 0)),
+        'fragments': ((1, 23), (2, 15)),
+        'metrics': ((0, 0), (0, 0)),
+        'ready': ((0, 0), (0, 0)),
+        'login': ((1, 11), (3, 5)),
+        'logout': ((0, 0), (5, 5)),
+        'profile_article_detail': ((6, 5), (8, 5)),
+        'profile': ((0, 0), (4, 5)),
+        'profile_article_change': ((0, 0), (10, 134)),
+        'profile_article_delete': ((0, 0), (4, 5)),
+        'profile_change': ((0, 0), (4, 24)),
+        'profile_delete': ((0, 0), (4, 5)),
+        'profile_article_add': ((0, 0), (8, 92)),
+        'upload': ((0, 0), (2, 0)),
+        'password_change': ((0, 0), (3, 15)),
+        'register_done': ((1, 5), (3, 5)),
+        'register_activate': ((2, 5), (4, 5)),
+        'register': ((1, 32), (3, 32)),
+        'other': ((0, 0), (0, 0)),
+    }
+    LATENCY_BUDGET = 0.1
+    BUDGET_TOLERANCE = float(os.environ.get('BUDGET_TOLERANCE', 5))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AdvUser.objects.create_user(username='bach', password='password', email='bach@example.com')
+        guest = AdvUser.objects.create_user(username='handel', password='password', is_active=False,
+                                            is_activated=False)
+        cls.sign = signer.sign(guest.username)
+        for name in ('Классика', 'Романтизм'):
+            super_rubric = SuperRubric.objects.create(name=name)
+            for sub in range(2):
+                rubric = SubRubric.objects.create(name='%s %d' % (name, sub), super_rubric=super_rubric)
+                for i in range(6):
+                    article = Article.objects.create(rubric=rubric, author=cls.user, title='Статья %d' % i,
+                                                     content='Текст', source='Источник',
+                                                     characters='Иоганн Себастьян Бах (1685-1750)')
+                    for j in range(3):
+                        AdditionalImage.objects.create(article=article, image='ab/cd/%d.jpg' % j, caption='Подпись')
+                    root = Comment.objects.create(article=article, author='Гость', content='Вопрос')
+                    for j in range(4):
+                        Comment.objects.create(article=article, parent=root, author='Автор', content='Ответ %d' % j)
+        cls.rubric = rubric
+        cls.article = article
+        RelatedArticle.objects.bulk_create([RelatedArticle(article=article, related=other, score=1)
+                                            for other in Article.objects.exclude(pk=article.pk)[:5]])
+
+    def setUp(self):
+        cache.clear()
+        root = temp_dir(self, 'budget')
+        os.makedirs(os.path.join(root, 'ab', 'cd'))
+        with open(os.path.join(root, 'ab', 'cd', '0.jpg'), 'wb') as f:
+            f.write(b'jpeg')
+
+    def urls(self):
+        rubric, article = self.rubric.pk, self.article.pk
+        return {
+            'index': '/',
+            'detail_img': '/%d/%d/ab/cd/0.jpg' % (rubric, article),
+            'detail': '/%d/%d/' % (rubric, article),
+            'by_rubric': '/%d/?keyword=Статья' % rubric,
+            'typeahead': '/typeahead/?q=Ста',
+            'fragments': '/fragments/?names=auth,messages,comment_form&article=%d' % article,
+            'metrics': '/metrics/',
+            'ready': '/ready/',
+            'login': '/accounts/login/',
+            'logout': '/accounts/logout/',
+            'profile_article_detail': '/accounts/profile/%d/' % article,
+            'profile': '/accounts/profile/',
+            'profile_article_change': '/accounts/profile/change/%d/' % article,
+            'profile_article_delete': '/accounts/profile/delete/%d/' % article,
+            'profile_change': '/accounts/profile/change',
+            'profile_delete': '/accounts/profile/delete/',
+            'profile_article_add': '/accounts/profile/add',
+            'upload': '/accounts/profile/upload/?token=bad',
+            'password_change': '/accounts/password/change',
+            'register_done': '/accounts/register/done',
+            'register_activate': '/accounts/register/activate/%s/' % self.sign,
+            'register': '/accounts/register/',
+            'other': '/about/',
+        }
+
+    def get(self, url, authenticated):
+        if authenticated:
+            self.client.force_login(self.user)
+        else:
+            self.client.logout()
+        templates = []
+        template_rendered.connect(lambda sender, template, **kwargs: templates.append(template.name),
+                                  weak=False, dispatch_uid='budget')
+        try:
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            elapsed = time.perf_counter() - started
+        finally:
+            template_rendered.disconnect(dispatch_uid='budget')
+        return len(queries), len(templates), elapsed
+
+    def test_every_route_has_budget(self):
+        from .urls import urlpatterns
+
+        names = {pattern.name for pattern in walk_patterns(urlpatterns)}
+        self.assertEqual(names, set(self.urls()))
+        self.assertEqual(names, set(self.BUDGETS))
+
+    def test_query_template_and_latency_budgets(self):
+        for name, url in self.urls().items():
+            for authenticated, budget in zip((False, True), self.BUDGETS[name]):
+                # первый запрос прогревает кэши: подсказки, обсуждаемые статьи, /ready/
+                self.get(url, authenticated)
+                runs = [self.get(url, authenticated) for _ in range(3)]
+                with self.subTest(route=name, authenticated=authenticated):
+                    self.assertLessEqual(runs[0][0], budget[0], 'запросов к БД')
+                    self.assertLessEqual(runs[0][1], budget[1], 'шаблонов')
+                    self.assertLess(min(run[2] for run in runs), self.LATENCY_BUDGET * self.BUDGET_TOLERANCE)
@@ -0,0 +1,95 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def client_ip(request):
+    ip = request.META.get(settings.RATELIMIT_IP_META) or request.META.get('REMOTE_ADDR', '')
+    return ip.split(',')[0].strip()
+
+
+def client_key(request, key):
+    if key == 'user' and request.user.is_authenticated:
+        return 'u%s' % request.user.pk
+    return 'ip%s' % client_ip(request)
+
+
+def retry_after(previous, count, elapsed, limit, period):
+    """Секунд до момента, когда еще один запрос уложится в limit."""
+    if count < limit:
+        # мешает только убывающий вклад предыдущего окна
+        wait = period * (1 - (limit - count - 1) / previous) - elapsed
+    else:
+        # в следующем окне текущий счетчик станет предыдущим
+        wait = period - elapsed + period * (1 - (limit - 1) / max(count, 1))
+    return max(1, math.ceil(wait))
+
+
+def hit(name, limit, period):
+    """Учитывает запрос в скользящем окне, возвращает (разрешен, секунд до повтора).
+
+    Окно приближается двумя счетчиками фиксированных окон: текущего и предыдущего,
+    вклад предыдущего убывает линейно. add/incr атомарны в memcached,
+    поэтому лимит общий для всех воркеров. Отклоненный запрос счетчик не
+    увеличивает: клиент, который повторяет попытки, не продлевает себе запрет.
+    """
+    now = time.time()
+    window = int(now // period)
+    current = 'rl:%s:%d' % (name, window)
+    previous_key = 'rl:%s:%d' % (name, window - 1)
+    counts = cache.get_many([current, previous_key])
+    count, previous = counts.get(current, 0), counts.get(previous_key, 0)
+    elapsed = now - window * period
+    weight = 1 - elapsed / period
+    if previous * weight + count + 1 > limit:
+        return False, retry_after(previous, count, elapsed, limit, period)
+
+    cache.add(current, 0, period * 2)
+    try:
+        count = cache.incr(current)
+    except ValueError:
+        # ключ успел истечь между add и incr
+        cache.add(current, 1, period * 2)
+        count = 1
+    if previous * weight + count > limit:
+        # остаток лимита заняли параллельные запросы: свой учет возвращается
+        try:
+            cache.decr(current)
+        except ValueError:
+            pass
+        return False, retry_after(previous, count - 1, elapsed, limit, period)
+    return True, 0
+
+
+def ratelimit(group, key='ip', methods=('POST',)):
+    """Ограничивает частоту запросов к представлению.
+
+    Лимит берется из settings.RATELIMITS[group], key - 'ip' или 'user'.
+    Превышение отвечает 429 до валидации формы и проверки капчи.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            rate = settings.RATELIMITS.get(group)
+            if rate and request.method in methods:
+                limit, period = parse_rate(rate)
+                allowed, retry_after = hit('%s:%s' % (group, client_key(request, key)), limit, period)
+                if not allowed:
+                    response = HttpResponse('Слишком много запросов, повторите позже',
+                                            status=429, content_type='text/plain; charset=utf-8')
+                    response['Retry-After'] = retry_after
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
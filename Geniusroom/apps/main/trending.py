@@ -0,0 +1,96 @@
+"""Блок "Обсуждают сейчас": статьи с наибольшим числом комментариев,
+затухающим вдвое каждые TRENDING_HALF_LIFE секунд.
+
+Вместо затухающего счета хранится ранг log2(счет) + время / TRENDING_HALF_LIFE:
+со временем он не меняется, поэтому порядок статей по рангу всегда совпадает
+с порядком по текущему счету, а новый комментарий меняет только одну строку.
+Первые TRENDING_SIZE статей лежат в кэше; manage.py compact_trending
+удаляет остывшие строки и пересобирает список.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.urls import reverse
+from django.utils import timezone
+
+from . import edge
+from .models import Article, Comment, TrendingArticle
+
+KEY = 'trending:top'
+
+
+def time_rank(now):
+    return now.timestamp() / settings.TRENDING_HALF_LIFE
+
+
+def bump(rank, now):
+    # ранг после еще одного комментария: log2(2 ** (rank - t) + 1) + t
+    current = time_rank(now)
+    if rank is None:
+        return current
+    return current + math.log2(2 ** (rank - current) + 1)
+
+
+def rebuild(notify=True):
+    old = cache.get(KEY)
+    top = [{'pk': pk, 'rubric_id': rubric_id, 'title': title, 'rank': rank}
+           for pk, rubric_id, title, rank in TrendingArticle.objects.filter(article__is_active=True)
+           .order_by('-rank').values_list('article_id', 'article__rubric_id', 'article__title', 'rank')
+           [:settings.TRENDING_SIZE]]
+    cache.set(KEY, top, None)
+    if notify and (old is None or [(e['pk'], e['title']) for e in old] != [(e['pk'], e['title']) for e in top]):
+        # блок есть на главной; publish импортирует views, поэтому здесь
+        from .publish import enqueue
+        edge.purge({edge.INDEX})
+        enqueue({reverse('main:index')})
+    return top
+
+
+def top():
+    # для шаблона - одно чтение из кэша; после его очистки список
+    # собирается той страницей, которая сейчас рисуется
+    entries = cache.get(KEY)
+    return rebuild(notify=False) if entries is None else entries
+
+
+def refresh(pk, rank):
+    entries = cache.get(KEY)
+    if entries is not None and len(entries) >= settings.TRENDING_SIZE and rank <= entries[-1]['rank'] \
+            and pk not in {e['pk'] for e in entries}:
+        # статья не попадает в список, остальные затухают одинаково
+        return
+    rebuild()
+
+
+def compact(now=None):
+    """Удаляет статьи со счетом ниже TRENDING_MIN_SCORE и пересобирает список."""
+    threshold = time_rank(now or timezone.now()) + math.log2(settings.TRENDING_MIN_SCORE)
+    deleted, _ = TrendingArticle.objects.filter(rank__lt=threshold).delete()
+    rebuild()
+    return deleted
+
+
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    with transaction.atomic():
+        rank = bump(TrendingArticle.objects.select_for_update().filter(article=instance.article_id)
+                    .values_list('rank', flat=True).first(), timezone.now())
+        TrendingArticle.objects.update_or_create(article_id=instance.article_id, defaults={'rank': rank})
+    transaction.on_commit(lambda: refresh(instance.article_id, rank))
+
+
+def article_changed(sender, instance, **kwargs):
+    # заголовок или видимость статьи из списка (или статьи, которая может в него вернуться)
+    entries = cache.get(KEY)
+    if entries is None or instance.pk in {e['pk'] for e in entries} or \
+            TrendingArticle.objects.filter(article=instance.pk).exists():
+        transaction.on_commit(rebuild)
+
+
+post_save.connect(comment_created, sender=Comment)
+post_save.connect(article_changed, sender=Article)
+post_delete.connect(article_changed, sender=Article)
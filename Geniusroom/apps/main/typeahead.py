@@ -0,0 +1,236 @@
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from heapq import nlargest
+
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import metrics
+from .models import Article
+from .utilities import parse_names
+
+logger = logging.getLogger(__name__)
+
+# номер последнего изменения статей (cache.incr) и pk статьи под каждым номером:
+# фоновый поток воркера раз в SYNC_INTERVAL секунд догоняет чужие изменения
+# точечно, а полностью перестраивает индекс, только если отстал больше чем
+# на MAX_CHANGES или записи изменений истекли
+VERSION_KEY = 'typeahead:version'
+CHANGE_KEY = 'typeahead:change:%d'
+CHANGE_TIMEOUT = 3600
+MAX_CHANGES = 500
+SYNC_INTERVAL = 5
+# сколько результатов коротких префиксов помнить (вытесняются давно не запрошенные)
+SHORT_SIZE = 2000
+FIELDS = ('pk', 'title', 'characters', 'created_at', 'rubric_id')
+
+
+def fold(text):
+    # регистр для кириллицы + ё/е, чтобы "Шостакович" и "шостакович" совпадали
+    return text.casefold().replace('ё', 'е')
+
+
+def prefixes(label):
+    # ключи с начала каждого слова: "бах" находит "Иоганн Себастьян Бах"
+    folded = fold(label)
+    words = [m.start() for m in re.finditer(r'\w+', folded)]
+    return {folded[start:] for start in words} or {folded}
+
+
+class PrefixIndex:
+    """Отсортированный массив (ключ, -время, pk, вид, подпись, рубрика) с поиском через bisect."""
+
+    def __init__(self):
+        self.keys = []
+        self.by_article = {}
+        self.short = OrderedDict()
+        self.lock = threading.Lock()
+        # sync и применение своих изменений не должны перемежаться
+        self.sync_lock = threading.Lock()
+        self.version = None
+
+    def entries(self, pk, title, characters, created_at, rubric_id):
+        rank = -created_at.timestamp()
+        labels = [('title', title)] + [('person', name) for name in parse_names(characters)]
+        return [(key, rank, pk, kind, label, rubric_id)
+                for kind, label in labels for key in prefixes(label)]
+
+    def build(self):
+        # версия берется до чтения статей: изменения, сделанные во время
+        # чтения, будут применены повторно, а не потеряны
+        version = current_version()
+        rows = Article.objects.filter(is_active=True).values_list(*FIELDS)
+        by_article = {row[0]: self.entries(*row) for row in rows.iterator()}
+        keys = sorted(entry for entries in by_article.values() for entry in entries)
+        with self.lock:
+            self.keys, self.by_article, self.short = keys, by_article, OrderedDict()
+            self.version = version
+
+    def update(self, pk, row=None):
+        """Заменяет записи статьи pk записями из row (None - статья удалена или скрыта)."""
+        entries = self.entries(*row) if row else []
+        with self.lock:
+            for entry in self.by_article.pop(pk, ()):
+                i = bisect_left(self.keys, entry)
+                if i < len(self.keys) and self.keys[i] == entry:
+                    del self.keys[i]
+            if entries:
+                self.by_article[pk] = entries
+                for entry in entries:
+                    insort(self.keys, entry)
+            self.short = OrderedDict()
+
+    def catch_up(self, version):
+        """Применяет чужие изменения после self.version; False - нужно перестроить индекс."""
+        if not isinstance(version, int) or not 0 < version - self.version <= MAX_CHANGES:
+            return False
+        numbers = range(self.version + 1, version + 1)
+        changes = cache.get_many([CHANGE_KEY % n for n in numbers])
+        if len(changes) != len(numbers):
+            return False
+        pks = set(changes.values())
+        rows = {row[0]: row for row in Article.objects.filter(pk__in=pks, is_active=True).values_list(*FIELDS)}
+        for pk in pks:
+            self.update(pk, rows.get(pk))
+        self.version = version
+        return True
+
+    def sync(self):
+        # другие воркеры меняют статьи в своих процессах: сверяем общую версию
+        with self.sync_lock:
+            if self.version is None:
+                self.build()
+                return
+            version = cache.get(VERSION_KEY)
+            if version != self.version and not self.catch_up(version):
+                self.build()
+
+    def newest(self, prefix, limit):
+        # ключи отсортированы по (ключ, -время): внутри ключа свежие записи идут
+        # первыми, поэтому от каждого ключа хватает первых limit записей, сколько
+        # бы статей его ни повторяли
+        keys = self.keys
+        lo = bisect_left(keys, (prefix,))
+        hi = bisect_left(keys, (prefix + '\uffff',), lo)
+        while lo < hi:
+            end = bisect_left(keys, (keys[lo][0], float('inf')), lo, hi)
+            yield from keys[lo:min(end, lo + limit)]
+            lo = end
+
+    def search(self, query, limit=10):
+        """Подсказки для префикса query, свежие статьи первыми; список новых словарей.
+
+        Индекс не сверяется с другими воркерами на пути запроса (это делает
+        фоновый поток, start); строится здесь, только если прогрев не успел.
+        """
+        if self.version is None:
+            self.sync()
+        prefix = fold(query.strip())
+        if not prefix:
+            return []
+        short = len(prefix) <= 2
+        with self.lock:
+            cached = self.short.get((prefix, limit)) if short else None
+            if cached is not None:
+                self.short.move_to_end((prefix, limit))
+        if short:
+            metrics.inc('cache_requests_total', cache='typeahead', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return [dict(item) for item in cached]
+
+        with self.lock:
+            candidates = nlargest(limit * 4, self.newest(prefix, limit * 4), key=lambda entry: -entry[1])
+        seen = set()
+        result = []
+        for key, rank, pk, kind, label, rubric_id in candidates:
+            if (kind, label) in seen:
+                continue
+            seen.add((kind, label))
+            result.append({'label': label, 'kind': kind, 'article': pk, 'rubric': rubric_id})
+            if len(result) == limit:
+                break
+        if short and result:
+            # короткие префиксы совпадают с большой частью индекса: результат
+            # запоминается до изменения индекса; пустые не запоминаются, чтобы
+            # мусорные запросы не раздували память
+            with self.lock:
+                self.short[(prefix, limit)] = result
+                if len(self.short) > SHORT_SIZE:
+                    self.short.popitem(last=False)
+            return [dict(item) for item in result]
+        return result
+
+
+index = PrefixIndex()
+state = {'pid': None}
+
+
+def current_version():
+    cache.add(VERSION_KEY, 0, None)
+    return cache.get(VERSION_KEY)
+
+
+def record_change(pk=None):
+    """Новый номер изменения; pk=None заставляет все воркеры перестроить индекс."""
+    cache.add(VERSION_KEY, 0, None)
+    version = cache.incr(VERSION_KEY)
+    if pk is not None:
+        cache.set(CHANGE_KEY % version, pk, CHANGE_TIMEOUT)
+    # своя копия индекса уже обновлена; если до этого она была актуальной,
+    # новую версию можно принять без перестроения
+    if pk is not None and index.version == version - 1:
+        index.version = version
+
+
+def invalidate():
+    # все воркеры перестраивают индекс (например, после массового импорта)
+    record_change()
+
+
+def apply_change(pk, row=None):
+    with index.sync_lock:
+        if index.version is not None:
+            index.update(pk, row)
+        record_change(pk)
+
+
+def article_saved(sender, instance, **kwargs):
+    # после commit: откаченное сохранение не оставляет подсказку в индексе,
+    # а другие воркеры не дочитывают статью раньше, чем она видна в БД
+    row = [getattr(instance, name) for name in FIELDS] if instance.is_active else None
+    transaction.on_commit(lambda: apply_change(instance.pk, row))
+
+
+def article_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: apply_change(pk))
+
+
+def run():
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        close_old_connections()
+        try:
+            index.sync()
+        except Exception:
+            # кэш или БД недоступны: подсказки отстают до следующей попытки
+            logger.exception('Не удалось обновить индекс подсказок')
+
+
+def start():
+    # свой поток в каждом воркере, как counters.start
+    with index.sync_lock:
+        if state['pid'] == os.getpid():
+            return
+        state['pid'] = os.getpid()
+    threading.Thread(target=run, name='typeahead-sync', daemon=True).start()
+
+
+post_save.connect(article_saved, sender=Article)
+post_delete.connect(article_deleted, sender=Article)
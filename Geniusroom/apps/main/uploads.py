@@ -0,0 +1,205 @@
+"""Загрузка изображений без лишней памяти.
+
+Обычные формы: LimitedUploadHandler стоит перед TemporaryFileUploadHandler
+(FILE_UPLOAD_HANDLERS), поэтому файлы пишутся на диск кусками по 64 КБ,
+а лимиты размера, числа файлов и пикселей проверяются по мере чтения запроса.
+Размер изображения берется из заголовка файла без декодирования. Файл, не
+прошедший проверку, пропускается, остальные поля формы разбираются как
+обычно, а причина попадает в request.upload_errors (см. add_errors).
+
+Большие изображения форма статьи загружает по частям (resumable_upload):
+части дописываются в файл в RESUMABLE_UPLOAD_DIR, после обрыва загрузка
+продолжается с того же места, а форма получает только токен загрузки.
+"""
+import fcntl
+import os
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.http import JsonResponse
+from django.template.defaultfilters import filesizeformat
+
+FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+READ_SIZE = 64 * 1024
+
+
+def inspect(fp, name):
+    """Проверяет заголовок изображения; возвращает текст ошибки или None.
+
+    Image.open читает только заголовок, пиксели не декодируются.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(fp, formats=FORMATS) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        return 'Изображение «%s» больше %g мегапикселей' % (name, settings.UPLOAD_MAX_PIXELS / 1e6)
+    except Exception:
+        return 'Файл «%s» не является изображением' % name
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        return 'Изображение «%s» больше %g мегапикселей' % (name, settings.UPLOAD_MAX_PIXELS / 1e6)
+    return None
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request.upload_errors = []
+        self.total = 0
+        self.files = 0
+        # заявленный размер: файлы такого запроса даже не пишутся на диск
+        self.rejected = content_length > settings.UPLOAD_MAX_REQUEST_SIZE
+        if self.rejected:
+            self.reject('Размер запроса больше %s' % filesizeformat(settings.UPLOAD_MAX_REQUEST_SIZE))
+
+    def reject(self, message):
+        self.request.upload_errors.append(message)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+        self.head = b''
+        self.checked = False
+        self.files += 1
+        if self.rejected:
+            raise SkipFile()
+        if self.files > settings.UPLOAD_MAX_FILES:
+            self.rejected = True
+            self.reject('Файлов больше %d' % settings.UPLOAD_MAX_FILES)
+            raise SkipFile()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        self.total += len(raw_data)
+        if self.total > settings.UPLOAD_MAX_REQUEST_SIZE:
+            self.rejected = True
+            self.reject('Размер запроса больше %s' % filesizeformat(settings.UPLOAD_MAX_REQUEST_SIZE))
+            raise SkipFile()
+        if self.size > settings.UPLOAD_MAX_FILE_SIZE:
+            self.reject('Файл «%s» больше %s' % (self.file_name, filesizeformat(settings.UPLOAD_MAX_FILE_SIZE)))
+            raise SkipFile()
+        if not self.checked:
+            self.head += raw_data
+            error = inspect(BytesIO(self.head), self.file_name)
+            if error is None or len(self.head) >= settings.UPLOAD_HEADER_BYTES:
+                # заголовок прочитан (или его нет в начале файла)
+                self.checked = True
+                self.head = b''
+                if error:
+                    self.reject(error)
+                    raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        # файл короче UPLOAD_HEADER_BYTES проверяется целиком; пропустить его
+        # здесь уже нельзя, но ошибка не даст форме сохраниться
+        if not self.checked:
+            error = inspect(BytesIO(self.head), self.file_name)
+            if error:
+                self.reject(error)
+            self.head = b''
+        return None
+
+
+def add_errors(request, form):
+    for message in getattr(request, 'upload_errors', ()):
+        form.add_error(None, message)
+
+
+def part_path(upload):
+    return os.path.join(settings.RESUMABLE_UPLOAD_DIR, '%s.part' % upload['id'])
+
+
+def load(token):
+    try:
+        return signing.loads(token, salt='uploads', max_age=settings.RESUMABLE_UPLOAD_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def resumable_file(token, user_pk):
+    """Собранное изображение по токену загрузки пользователя user_pk для формы статьи."""
+    upload = load(token)
+    if upload is None or user_pk is None or upload['user'] != user_pk:
+        raise ValidationError('Загрузка не найдена, выберите файл заново')
+    path = part_path(upload)
+    if not os.path.exists(path) or os.path.getsize(path) != upload['size']:
+        raise ValidationError('Загрузка изображения не завершена')
+    return File(open(path, 'rb'), name=upload['name'])
+
+
+def discard(token):
+    upload = load(token) if token else None
+    if upload is not None:
+        try:
+            os.remove(part_path(upload))
+        except FileNotFoundError:
+            pass
+
+
+def stale_parts(now):
+    # токен уже просрочен: загрузку не продолжить и не сохранить
+    if not os.path.isdir(settings.RESUMABLE_UPLOAD_DIR):
+        return []
+    paths = (os.path.join(settings.RESUMABLE_UPLOAD_DIR, name) for name in os.listdir(settings.RESUMABLE_UPLOAD_DIR)
+             if name.endswith('.part'))
+    return [path for path in paths if os.path.getmtime(path) < now - settings.RESUMABLE_UPLOAD_MAX_AGE]
+
+
+def resumable_upload(request):
+    """POST name, size - новая загрузка; GET ?token= - сколько байт уже принято;
+    POST ?token=&offset= с частью файла в теле - дописывает часть.
+
+    Тело читается блоками прямо в файл, поэтому часть в память не попадает.
+    """
+    if request.method == 'POST' and 'token' not in request.GET:
+        name = os.path.basename(request.POST.get('name', ''))[:100]
+        size = int(request.POST['size']) if request.POST.get('size', '').isdigit() else 0
+        if not name or not 0 < size <= settings.RESUMABLE_UPLOAD_MAX_SIZE:
+            return JsonResponse({'error': 'Файл больше %s' % filesizeformat(settings.RESUMABLE_UPLOAD_MAX_SIZE)},
+                                status=413)
+        os.makedirs(settings.RESUMABLE_UPLOAD_DIR, exist_ok=True)
+        upload = {'id': uuid.uuid4().hex, 'user': request.user.pk, 'name': name, 'size': size}
+        open(part_path(upload), 'wb').close()
+        return JsonResponse({'token': signing.dumps(upload, salt='uploads'), 'offset': 0})
+
+    upload = load(request.GET.get('token', ''))
+    if upload is None or upload['user'] != request.user.pk or not os.path.exists(part_path(upload)):
+        return JsonResponse({'error': 'Загрузка не найдена'}, status=404)
+    path = part_path(upload)
+    if request.method != 'POST':
+        return JsonResponse({'offset': os.path.getsize(path)})
+
+    length = int(request.META.get('CONTENT_LENGTH') or 0)
+    with open(path, 'ab') as f:
+        try:
+            # одна часть за раз: повторная отправка той же части ждет ответа
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return JsonResponse({'offset': os.path.getsize(path)}, status=409)
+        offset = f.seek(0, os.SEEK_END)
+        if request.GET.get('offset') != str(offset):
+            return JsonResponse({'offset': offset}, status=409)
+        if length > settings.RESUMABLE_UPLOAD_CHUNK_SIZE or offset + length > upload['size']:
+            return JsonResponse({'error': 'Слишком большая часть', 'offset': offset}, status=413)
+        remaining = length
+        while remaining:
+            data = request.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            f.write(data)
+            remaining -= len(data)
+        f.flush()
+        received = f.tell()
+    if offset < settings.UPLOAD_HEADER_BYTES <= received or received == upload['size']:
+        with open(path, 'rb') as f:
+            error = inspect(f, upload['name'])
+        if error:
+            os.remove(path)
+            return JsonResponse({'error': error}, status=400)
+    return JsonResponse({'offset': received, 'complete': received == upload['size']})
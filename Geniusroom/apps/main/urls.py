@@ -5,15 +5,20 @@ from .views import ChangeUserInfoView, GRPasswordChangeView
 from .views import RegisterUserView, RegisterDoneView
 from .views import user_activate, by_rubric, detail
 from .views import profile_article_detail, profile_article_add, profile_article_delete, profile_article_change, detail_img
+from .views import typeahead_suggest, fragments, metrics_view, ready, upload
 
 app_name = 'main'
 
 urlpatterns = [
     path('', index, name='index'),
 
-    path('<int:rubric_pk>/<int:pk>/<str:img>', detail_img, name='detail_img'),
+    path('<int:rubric_pk>/<int:pk>/<path:img>', detail_img, name='detail_img'),
     path('<int:rubric_pk>/<int:pk>/', detail, name='detail'),
     path('<int:pk>/', by_rubric, name='by_rubric'),
+    path('typeahead/', typeahead_suggest, name='typeahead'),
+    path('fragments/', fragments, name='fragments'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('ready/', ready, name='ready'),
 
 
     path('accounts/', include([
@@ -28,6 +33,7 @@ urlpatterns = [
         path('profile/change', ChangeUserInfoView.as_view(), name='profile_change'),
         path('profile/delete/', DeleteUserView.as_view(), name='profile_delete'),
         path('profile/add', profile_article_add, name='profile_article_add'),
+        path('profile/upload/', upload, name='upload'),
 
         path('password/change', GRPasswordChangeView.as_view(), name='password_change'),
         path('register/done', RegisterDoneView.as_view(), name='register_done'),
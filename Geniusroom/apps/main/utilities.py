@@ -3,20 +3,27 @@ from django.core.signing import Signer
 from django.core.mail import send_mail
 from datetime import datetime
 from os.path import splitext
+import re
 from decouple import config
 from Geniusroom.settings import ALLOWED_HOSTS, EMAIL_HOST_USER
 
 signer = Signer()
 
-def send_activation_notification(user):
+# "Иоганн Себастьян Бах (1685-1750), Георг Фридрих Гендель (1685-1759)"
+NAME_RE = re.compile(r'\s*([^,(]+?)\s*\(\d{4}-')
+
+
+def get_host():
     if ALLOWED_HOSTS:
-        host = 'http://' + ALLOWED_HOSTS[0]
+        return 'http://' + ALLOWED_HOSTS[0]
     else:
-        host = 'http://localhost:8000'
+        return 'http://localhost:8000'
+
 
+def send_activation_notification(user):
     context = {
         'user': user,
-        'host': host,
+        'host': get_host(),
         'sign': signer.sign(user.username)
     }
 
@@ -35,15 +42,29 @@ def get_timestamp_path(instance, filename):
     return '%s%s' % (datetime.now().timestamp(), splitext(filename)[1])
 
 
-def send_new_comment_notification(comment):
-    if ALLOWED_HOSTS:
-        host = 'http://' + ALLOWED_HOSTS[0]
+def parse_names(characters):
+    # имена из поля Article.characters
+    return [name for name in NAME_RE.findall(characters or '') if name]
+
+
+def resize_image(img, side=300):
+    # уменьшает изображение так, чтобы большая сторона была равна side
+    w = img.size[0]
+    h = img.size[1]
+
+    if w > h:
+        quotient = h / w
+        return img.resize(size=(side, round(side * quotient)))
     else:
-        host = 'http://localhost:8000'
+        quotient = w / h
+        return img.resize(size=(round(side * quotient), side))
+
+
+def send_new_comment_notification(comment):
     author = comment.article.author
     context = {
         'author': author,
-        'host': host,
+        'host': get_host(),
         'comment': comment,
     }
     subject = render_to_string('main/email/new_comment_letter_subject.txt', context)
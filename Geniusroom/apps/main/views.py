@@ -4,45 +4,58 @@ from django.db.models import query, Q
 from django.forms import formsets
 from django.http import HttpResponse, Http404, request
 from django.shortcuts import redirect, render
-from django.template import TemplateDoesNotExist
-from django.template.loader import get_template
+from django.template.loader import get_template, render_to_string
 from django.contrib.auth.views import LoginView, PasswordChangeView
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.contrib.messages.views import SuccessMessageMixin
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.shortcuts import get_object_or_404
 from django.core.signing import BadSignature
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
 from django.core.mail import send_mail
 from django.contrib.auth import logout
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.views.generic.base import TemplateView
-from django.http import FileResponse
+from django.http import FileResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.conf import settings
+from django.views.decorators.cache import never_cache
 
-from .models import AdvUser, Rubric, SubRubric, Article, Comment
+from .models import AdvUser, Rubric, SubRubric, Article, Comment, RelatedArticle, MAX_COMMENT_DEPTH
 from .forms import AIFormSet, ArticleForm, ChangeUserInfoForm, RegisterUserForm, SearchForm, UserCommentForm, GuestCommentForm
 from .utilities import signer
-from Geniusroom.settings import MEDIA_URL
+from .throttling import client_ip, ratelimit
+from . import counters, metrics, pages, trending, typeahead, uploads
+from .archive import archived_detail
+from .warmup import ensure_ready, state as warmup_state
+from .edge import edge_cache, index_keys, rubric_keys, detail_keys, image_keys, article_key
 
+ARTICLES_PER_PAGE = 2
 
+
+@edge_cache(index_keys)
 def index(request):
     articles = Article.objects.filter(is_active=True)[:10]
-    context = {'articles': articles}
+    context = {'articles': articles, 'trending': trending.top()}
     return render(request, template_name='main/index.html', context=context)
 
 
 def other_page(request, page):
-    try:
-        template = 'main/' + page + '.html'
-    except TemplateDoesNotExist:
-        raise Http404
-
-    return render(request, template_name=template)
+    # сюда же попадают адреса сканеров вроде /wp-login.php/
+    if page not in pages.PAGES:
+        return pages.not_found_response()
+    if getattr(request, 'publishing', False):
+        # publish.py: меню подключается через SSI
+        return render(request, pages.PAGES[page])
+    return pages.page_response(request, page)
 
 
+@method_decorator(ratelimit('login'), name='dispatch')
 class GRLoginView(LoginView):
     template_name = 'main/login.html'
 
@@ -84,6 +97,7 @@ class GRPasswordChangeView(SuccessMessageMixin, LoginRequiredMixin, PasswordChan
     success_url = reverse_lazy('main:profile')
 
 
+@method_decorator(ratelimit('register'), name='dispatch')
 class RegisterUserView(CreateView):
     model = AdvUser
     template_name = 'main/register_user.html'
@@ -134,16 +148,10 @@ def user_activate(request, sign):
     return render(request, template)
 
 
+@edge_cache(rubric_keys)
 def by_rubric(request, pk):
-    rubric = get_object_or_404(SubRubric, pk=pk)
-    # articles = Article.objects.filter(is_active=True, rubric=pk)
-    articles = Article.objects.raw("""
-        select * 
-        from main_article 
-        where 1=1 
-            and is_active = 1
-            and rubric_id = %s
-    """, [pk])
+    rubric = get_object_or_404(SubRubric.objects.select_related('super_rubric', 'stats'), pk=pk)
+    articles = Article.objects.filter(is_active=True, rubric=pk)
 
     if 'keyword' in request.GET:
         keyword = request.GET['keyword']
@@ -154,7 +162,7 @@ def by_rubric(request, pk):
 
     form = SearchForm(initial={'keyword': keyword})
 
-    paginator = Paginator(articles, 2)  # по 2 на страницу
+    paginator = Paginator(articles, ARTICLES_PER_PAGE)
     if 'page' in request.GET:
         page_num = request.GET['page']
     else:
@@ -170,19 +178,38 @@ def by_rubric(request, pk):
     return render(request, 'main/by_rubric.html', context)
 
 
-def detail(request, rubric_pk, pk):
-    article = get_object_or_404(Article, pk=pk)
-    ais = article.additionalimage_set.all()
-    comments = Comment.objects.filter(article=pk, is_active=True)
+def comment_form(request, article_pk):
     initial = {
-        'article': article.pk
+        'article': article_pk
     }
-    if request.user.is_authenticated:
+    # ссылка "Ответить" ведет на ?reply=<id комментария>
+    if request.GET.get('reply', '').isdigit():
+        initial['parent'] = int(request.GET['reply'])
+    # общая копия страницы не читает сессию: форма для посетителя придет с /fragments/
+    if not getattr(request, 'edge_cached', False) and request.user.is_authenticated:
         initial['author'] = request.user.username
-        form_class = UserCommentForm
-    else:
-        form_class = GuestCommentForm
+        return UserCommentForm, initial
+    return GuestCommentForm, initial
+
 
+@edge_cache(detail_keys)
+@ratelimit('comment', key='user')
+def detail(request, rubric_pk, pk):
+    article = Article.objects.select_related('rubric').filter(pk=pk).first()
+    if article is None:
+        # статья перенесена в архив (manage.py archive_articles): только чтение
+        context = archived_detail(pk)
+        if context is None:
+            raise Http404
+        return render(request, 'main/detail.html', context)
+    if request.method == 'GET' and not (getattr(request, 'publishing', False) or request.edge_cached):
+        # общую копию страницы считает /fragments/, который она запрашивает у каждого посетителя
+        counters.hit(article.pk)
+    ais = article.additionalimage_set.all()
+    related = RelatedArticle.objects.filter(article=pk, related__is_active=True) \
+        .select_related('related').only('related__id', 'related__title', 'related__rubric_id', 'score')
+    request.surrogate_keys.update(article_key(item.related_id) for item in related)
+    form_class, initial = comment_form(request, article.pk)
     form = form_class(initial=initial)
     if request.method == 'POST':
         c_form = form_class(request.POST)
@@ -198,17 +225,19 @@ def detail(request, rubric_pk, pk):
     context = {
         'article': article,
         'ais': ais,
-        'comments': comments,
+        'comments': Comment.objects.threads(pk),
+        'related': related,
         'form': form,
+        'max_depth': MAX_COMMENT_DEPTH - 1,
     }
     return render(request, 'main/detail.html', context)
 
 
 def profile_article_detail(request, pk):
     article = get_object_or_404(Article, pk=pk)
-    subrubric = get_object_or_404(SubRubric, pk=article.rubric.pk)
+    subrubric = get_object_or_404(SubRubric.objects.select_related('super_rubric'), pk=article.rubric_id)
     ais = article.additionalimage_set.all()
-    comments = Comment.objects.filter(article=pk, is_active=True)
+    comments = Comment.objects.threads(pk)
     context = {
         'article': article,
         'ais': ais,
@@ -222,7 +251,8 @@ def profile_article_detail(request, pk):
 @login_required
 def profile_article_add(request):
     if request.method == 'POST':
-        form = ArticleForm(request.POST, request.FILES)
+        form = ArticleForm(request.POST, request.FILES, user=request.user)
+        uploads.add_errors(request, form)
         formset = AIFormSet()
         if form.is_valid():
             article = form.save()
@@ -242,6 +272,7 @@ def profile_article_add(request):
     context = {
         'form': form,
         'formset': formset,
+        'chunk_size': settings.RESUMABLE_UPLOAD_CHUNK_SIZE,
     }
 
     return render(request, 'main/profile_article_add.html', context)
@@ -251,9 +282,12 @@ def profile_article_add(request):
 def profile_article_change(request, pk):
     article = get_object_or_404(Article, pk=pk)
     if request.method == 'POST':
-        form = ArticleForm(request.POST, request.FILES, instance=article)
+        form = ArticleForm(request.POST, request.FILES, instance=article, user=request.user)
+        uploads.add_errors(request, form)
+        formset = AIFormSet(instance=article)
         if form.is_valid():
-            article = form.save()
+            article = form.save(commit=False)
+            article.save_keeping_views()
             formset = AIFormSet(request.POST, request.FILES, instance=article)
             if formset.is_valid():
                 formset.save()
@@ -265,11 +299,19 @@ def profile_article_change(request, pk):
         formset = AIFormSet(instance=article)
     context = {
         'form': form,
-        'formset': formset
+        'formset': formset,
+        'chunk_size': settings.RESUMABLE_UPLOAD_CHUNK_SIZE,
     }
     return render(request, 'main/profile_article_change.html', context)
 
 
+@login_required
+@never_cache
+def upload(request):
+    # изображение для формы статьи по частям, с продолжением после обрыва
+    return uploads.resumable_upload(request)
+
+
 @login_required
 def profile_article_delete(request, pk):
     article = get_object_or_404(Article, pk=pk)
@@ -285,6 +327,54 @@ def profile_article_delete(request, pk):
         return render(request, 'main/profile_article_delete.html', context)
 
 
+def typeahead_suggest(request):
+    query = request.GET.get('q', '')[:SearchForm.base_fields['keyword'].max_length]
+    suggestions = typeahead.index.search(query)
+    for suggestion in suggestions:
+        if suggestion['kind'] == 'title':
+            suggestion['url'] = reverse('main:detail', kwargs={'rubric_pk': suggestion['rubric'],
+                                                               'pk': suggestion['article']})
+    return JsonResponse({'suggestions': suggestions})
+
+
+@never_cache
+def fragments(request):
+    # пользовательские части опубликованных страниц (publish.py)
+    result = {}
+    if request.GET.get('article', '').isdigit():
+        # адрес может запросить кто угодно: просмотр считается раз в окно на клиента
+        counters.hit_from(client_ip(request), int(request.GET['article']))
+    for name in request.GET.get('names', '').split(','):
+        if name == 'auth':
+            result[name] = render_to_string('main/fragments/auth_menu.html', request=request)
+        elif name == 'messages':
+            result[name] = render_to_string('main/fragments/messages.html', request=request)
+        elif name == 'comment_form' and request.GET.get('article', '').isdigit():
+            form_class, initial = comment_form(request, int(request.GET['article']))
+            result[name] = render_to_string('main/fragments/comment_form.html',
+                                            {'form': form_class(initial=initial)}, request=request)
+    return JsonResponse(result)
+
+
+def ready(request):
+    # для балансировщика и деплоя: 200 только после прогрева
+    if not ensure_ready():
+        return JsonResponse({'ready': False}, status=503)
+    return JsonResponse({'ready': True, 'warmup_seconds': round(warmup_state['seconds'], 3)})
+
+
+def metrics_view(request):
+    # сводка по всем воркерам для Prometheus; снаружи не видна
+    if client_ip(request) not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@edge_cache(image_keys)
 def detail_img(request, rubric_pk, pk, img):
-    path = MEDIA_URL + img
-    return FileResponse(open(path, 'rb'))
\ No newline at end of file
+    # имена файлов теперь содержат подкаталоги (ab/cd/<hash>.<ext>),
+    # хранилище не даст выйти за пределы MEDIA_ROOT
+    try:
+        return FileResponse(default_storage.open(img, 'rb'))
+    except (FileNotFoundError, SuspiciousFileOperation):
+        raise Http404
\ No newline at end of file
@@ -0,0 +1,63 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.template.loader import get_template, render_to_string
+from django.urls import URLPattern, URLResolver, get_resolver
+
+logger = logging.getLogger(__name__)
+state = {'ready': False, 'seconds': None}
+
+
+def walk_patterns(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from walk_patterns(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            yield pattern
+
+
+def template_names():
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(('.html', '.txt')):
+                    yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+
+def warmup():
+    """Делает то, что иначе достается первым запросам каждого воркера.
+
+    С preload_app (config/gunicorn.conf.py) выполняется один раз в мастере,
+    и воркеры получают готовые резольвер, шаблоны и индекс подсказок
+    через copy-on-write.
+    """
+    from .models import SubRubric
+    from . import pages, typeahead
+
+    started = time.monotonic()
+    resolver = get_resolver()
+    for pattern in walk_patterns(resolver.url_patterns):
+        # регулярные выражения маршрутов компилируются лениво
+        pattern.pattern.regex
+    resolver.reverse_dict
+    for name in template_names():
+        get_template(name)
+    pages.load()
+    rubrics = SubRubric.objects.select_related('super_rubric__stats', 'stats')
+    render_to_string('main/fragments/nav.html', {'rubrics': rubrics})
+    typeahead.index.build()
+    state['seconds'] = time.monotonic() - started
+    state['ready'] = True
+    logger.info('Прогрев завершен за %.2f c', state['seconds'])
+
+
+def ensure_ready():
+    if not state['ready']:
+        try:
+            warmup()
+        except Exception:
+            # например, БД еще недоступна: /ready/ повторит попытку
+            logger.exception('Прогрев не удался')
+    return state['ready']
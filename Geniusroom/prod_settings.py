@@ -12,17 +12,41 @@ DEBUG = False
 ALLOWED_HOSTS = ['127.0.0.1']
 
 
-DATABASES = {
+# небольшие инстансы работают на SQLite (apps/main/sqlite): SQLITE_PATH=/путь/к/файлу;
+# соединение живет между запросами, поэтому PRAGMA выполняются раз на воркер
+if config('SQLITE_PATH', default=''):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'Geniusroom.apps.main.sqlite',
+            'NAME': config('SQLITE_PATH'),
+            'CONN_MAX_AGE': None,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': 'geniusroom',
+            'USER': config('POSTGRES_USER'),
+            'PASSWORD': config('POSTGRES_USER_PASSWORD'),
+            'HOST': config('POSTGRES_HOST'),
+            'PORT': '5432',
+        }
+    }
+
+# общий для всех воркеров gunicorn кэш: incr/add в memcached атомарны
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'geniusroom',
-        'USER': config('POSTGRES_USER'),
-        'PASSWORD': config('POSTGRES_USER_PASSWORD'),
-        'HOST': config('POSTGRES_HOST'),
-        'PORT': '5432',
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': config('MEMCACHED_LOCATION', default='127.0.0.1:11211'),
     }
 }
 
+RATELIMIT_IP_META = 'HTTP_X_REAL_IP'
+
+# nginx отдает опубликованные страницы из PUBLISH_ROOT (config/nginx.conf)
+PUBLISH_MODE = True
+
 
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
 STATICFILES_DIRS = [STATIC_DIR]
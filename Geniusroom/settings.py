@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from decouple import config
 
 # Application definition
@@ -31,10 +32,16 @@ INSTALLED_APPS = [
     'django_cleanup',
     'easy_thumbnails',
     'captcha',
+    'rest_framework',
 ]
 
 MIDDLEWARE = [
+    'Geniusroom.apps.main.profiling.ProfilerMiddleware',
+    'Geniusroom.apps.main.metrics.MetricsMiddleware',
+    'Geniusroom.apps.main.admission.AdmissionMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # выше сессий и CSRF: видит их cookie и Vary (edge.py)
+    'Geniusroom.apps.main.edge.EdgeCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -116,6 +123,105 @@ STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = 'media/'
+# sitemap.xml и ленты Atom/RSS, которые отдает веб-сервер (config/nginx.conf)
+PUBLIC_ROOT = os.path.join(BASE_DIR, 'public')
+# изменения ставят затронутые файлы в очередь FeedTarget для manage.py build_feeds --pending
+FEEDS_AUTO_UPDATE = True
+# готовые HTML-страницы для анонимных посетителей (manage.py publish);
+# при PUBLISH_MODE изменения ставят затронутые страницы в очередь PublishTarget
+PUBLISH_ROOT = os.path.join(PUBLIC_ROOT, 'pages')
+PUBLISH_MODE = False
+
+# профилирование отдельных запросов (profiling.py): токен из manage.py profile_token
+# или случайная доля запросов; 'sample' пишет свернутые стеки для flame graph, 'cprofile' - .prof
+PROFILE_DIR = os.path.join(BASE_DIR, 'logs', 'profiles')
+PROFILE_MODE = 'sample'
+PROFILE_INTERVAL = 0.005
+PROFILE_SAMPLE_RATE = 0
+PROFILE_TOKEN_MAX_AGE = 3600
+
+# метрики (metrics.py): каждый процесс пишет в свой файл в METRICS_DIR,
+# /metrics/ складывает их; каталог очищается при старте gunicorn
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'geniusroom-metrics'))
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+# просмотры статей (counters.py) копятся в памяти воркера и пишутся пачками
+VIEW_COUNTS_FLUSH_INTERVAL = 10
+VIEW_COUNTS_MAX_PENDING = 1000
+VIEW_COUNTS_BATCH_SIZE = 500
+# /fragments/?article= считает один просмотр на клиента и статью за окно
+VIEW_COUNTS_CLIENT_WINDOW = 1800
+
+# блок "Обсуждают сейчас" на главной (trending.py): вес комментария затухает
+# вдвое за TRENDING_HALF_LIFE секунд; остывшие статьи удаляет manage.py compact_trending
+TRENDING_HALF_LIFE = 12 * 3600
+TRENDING_SIZE = 5
+TRENDING_MIN_SCORE = 0.01
+
+# сброс нагрузки (admission.py): ожидание в очереди по X-Request-Start от nginx
+# и недавнее время ответа, секунды
+ADMISSION_MAX_QUEUE_DELAY = 0.5
+# одновременные запросы воркера: только для worker_class = 'gthread' (например,
+# число threads); синхронные воркеры (config/gunicorn.conf.py) - None
+ADMISSION_MAX_IN_FLIGHT = None
+ADMISSION_MAX_LATENCY = 2.0
+# столько клиент уже не ждет (timeout в config/gunicorn.conf.py - 60 c)
+ADMISSION_DEADLINE = 30
+ADMISSION_RETRY_AFTER = 10
+
+# загрузки (uploads.py): файлы сразу пишутся во временные файлы на диске,
+# лимиты проверяются по мере чтения запроса
+FILE_UPLOAD_HANDLERS = [
+    'Geniusroom.apps.main.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+UPLOAD_MAX_FILE_SIZE = 10 * 1024 * 1024
+UPLOAD_MAX_REQUEST_SIZE = 32 * 1024 * 1024
+UPLOAD_MAX_FILES = 20
+UPLOAD_MAX_PIXELS = 50 * 1000 * 1000
+UPLOAD_HEADER_BYTES = 256 * 1024
+# большие изображения форма статьи загружает по частям; незавершенные
+# загрузки старше RESUMABLE_UPLOAD_MAX_AGE удаляет manage.py purge_stale
+RESUMABLE_UPLOAD_DIR = config('RESUMABLE_UPLOAD_DIR',
+                              default=os.path.join(tempfile.gettempdir(), 'geniusroom-uploads'))
+RESUMABLE_UPLOAD_MAX_SIZE = 64 * 1024 * 1024
+RESUMABLE_UPLOAD_CHUNK_SIZE = 1024 * 1024
+RESUMABLE_UPLOAD_MAX_AGE = 86400
+
+# PRAGMA каждого соединения с SQLite (apps/main/sqlite)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # отрицательное значение - в КиБ
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# сводки комментариев авторам (digests.py): не чаще раза в столько секунд,
+# в письме не больше COMMENT_DIGEST_MAX_COMMENTS комментариев
+COMMENT_DIGEST_INTERVAL = 3600
+COMMENT_DIGEST_MAX_COMMENTS = 50
+
+# модель корпуса для похожих статей (related.py) между запусками update_related
+RELATED_MODEL_PATH = config('RELATED_MODEL_PATH', default=os.path.join(BASE_DIR, 'var', 'related-model.pickle'))
+
+# статические страницы (pages.py) хранятся в кэше готовыми
+PAGE_CACHE_TIMEOUT = 3600
+
+# кэширующий прокси перед gunicorn (edge.py): страницы помечаются Surrogate-Key,
+# изменения моделей очищают их по ключам
+EDGE_CACHE_ENABLED = False
+EDGE_CACHE_TIMEOUT = 86400
+EDGE_CACHE_PURGE = {
+    'TRANSPORT': 'Geniusroom.apps.main.edge.HttpPurgeTransport',
+    'URLS': ['http://127.0.0.1:6081/'],
+    'METHOD': 'PURGE',
+}
+
+# загрузки хранятся под хэшем содержимого в ab/cd/<hash>.<ext>, одинаковые - один раз
+DEFAULT_FILE_STORAGE = 'Geniusroom.apps.main.storage.ContentAddressedStorage'
 
 THUMBNAIL_ALIASES = {
     '': {
@@ -126,6 +232,34 @@ THUMBNAIL_ALIASES = {
     }
 }
 THUMBNAIL_BASEDIR = 'thumbnails'
+# стандартная цепочка, обрамленная замером времени для /metrics/
+THUMBNAIL_PROCESSORS = (
+    'Geniusroom.apps.main.metrics.thumbnail_started',
+    'easy_thumbnails.processors.colorspace',
+    'easy_thumbnails.processors.autocrop',
+    'easy_thumbnails.processors.scale_and_crop',
+    'easy_thumbnails.processors.filters',
+    'easy_thumbnails.processors.background',
+    'Geniusroom.apps.main.metrics.thumbnail_finished',
+)
+
+# Публичное API только для чтения: без аутентификации и Browsable API
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'UNAUTHENTICATED_USER': None,
+}
+API_CACHE_TIMEOUT = 300
+
+# Ограничение частоты запросов: '<число>/<s|m|h|d>' для каждой группы
+RATELIMITS = {
+    'comment': '5/m',
+    'register': '5/h',
+    'login': '10/m',
+}
+# откуда брать IP клиента (за прокси - из заголовка, который он выставляет)
+RATELIMIT_IP_META = 'REMOTE_ADDR'
 
 try:
     from .local_settings import *
@@ -14,20 +14,25 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 from django.conf import settings
 from django.contrib.staticfiles.views import serve
+from django.views.static import serve as serve_file
 from django.views.decorators.cache import never_cache
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('captcha/', include('captcha.urls')),
+    path('api/v1/', include('Geniusroom.apps.main.api')),
     path('', include('Geniusroom.apps.main.urls')),
 ]
 
 
 if settings.DEBUG:
     urlpatterns.append(path('static/<path:path>', never_cache(serve)))
+    # в продакшене эти файлы отдает nginx
+    urlpatterns.append(re_path(r'^(?P<path>sitemap\.xml|sitemaps/.+|feeds/.+)$', serve_file,
+                               {'document_root': settings.PUBLIC_ROOT}))
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 
 import os
 
+from django.core.cache import close_caches
 from django.core.wsgi import get_wsgi_application
+from django.db import connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Geniusroom.settings')
 
 application = get_wsgi_application()
+
+# с preload_app прогрев выполняется в мастере gunicorn до fork воркеров;
+# открытые при этом соединения с БД и кэшем (сокет memcached) воркерам не достаются
+from Geniusroom.apps.main.warmup import ensure_ready  # noqa: E402
+ensure_ready()
+connections.close_all()
+close_caches()
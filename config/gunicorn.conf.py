@@ -1,4 +1,36 @@
 bind = '127.0.0.1:8000'
 workers = 3
 user = 'bach'
-timeout = 60
\ No newline at end of file
+timeout = 60
+# приложение и прогрев (Geniusroom/wsgi.py) загружаются один раз в мастере,
+# воркеры делят память с ним через copy-on-write
+preload_app = True
+
+
+def on_starting(server):
+    # счетчики метрик прошлого запуска (metrics.py)
+    import os
+    import shutil
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Geniusroom.settings')
+    from django.conf import settings
+    shutil.rmtree(settings.METRICS_DIR, ignore_errors=True)
+
+
+
+def post_worker_init(worker):
+    # фоновая запись просмотров статей (counters.py) и сверка индекса подсказок (typeahead.py)
+    from Geniusroom.apps.main import counters, typeahead
+    counters.start()
+    typeahead.start()
+
+
+def worker_exit(server, worker):
+    # при плановой остановке воркера просмотры из памяти не теряются
+    from Geniusroom.apps.main import counters
+    try:
+        counters.flush()
+    except Exception:
+        server.log.exception('Просмотры статей не записаны')
+    # очистки кэша прокси, поставленные в очередь последними запросами (edge.py)
+    from Geniusroom.apps.main import edge
+    edge.wait()